@@ -0,0 +1,86 @@
+# CPU benchmark of the WRN training and prediction steps with and without XLA compilation
+# Runs on synthetic 32x32 images, so no dataset is needed. Every configuration is timed after a few
+# warm-up steps, which include the XLA compilation itself.
+#
+# Example:
+#   python bench_xla.py --configs 2:2,2:4 --batch-size 128 --output bench_xla.json
+
+import argparse
+import json
+import time
+import numpy as np
+
+from keras import backend as K
+from keras.optimizers import SGD
+
+from svhn_data import IMAGE_SHAPE
+from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+
+# The N:k configurations from the experiment notes, WRN-16-1, WRN-16-2 and WRN-16-4
+DEFAULT_CONFIGS = '2:1,2:2,2:4'
+
+
+def time_steps(step, steps, warmup):
+    """Returns the median time in seconds of `steps` calls of step() after `warmup` calls."""
+    for _ in range(warmup):
+        step()
+    timings = []
+    for _ in range(steps):
+        start = time.time()
+        step()
+        timings.append(time.time() - start)
+    return float(np.median(timings))
+
+
+def benchmark(N, k, jit_compile, batch_size=128, steps=20, warmup=3, seed=0):
+    """
+    Times the training and prediction steps of a WRN-(6N+4)-k on synthetic data
+    :return: dict with the configuration and the median step times in seconds
+    """
+    K.clear_session()
+    rng = np.random.RandomState(seed)
+    x = rng.standard_normal((batch_size,) + IMAGE_SHAPE).astype(np.float32)
+    y = rng.randint(0, 10, batch_size).astype(np.int8)
+
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=N, k=k, dropout=0.0, verbose=0)
+    compile_wide_residual_network(model, SGD(lr=0.1, momentum=0.9, nesterov=False), jit_compile=jit_compile)
+
+    train_step = time_steps(lambda: model.train_on_batch(x, y), steps, warmup)
+    predict_step = time_steps(lambda: model.predict_on_batch(x), steps, warmup)
+    return {'N': N, 'k': k, 'jit_compile': jit_compile, 'batch_size': batch_size,
+            'train_step_sec': train_step, 'predict_step_sec': predict_step,
+            'train_images_per_sec': batch_size / train_step,
+            'predict_images_per_sec': batch_size / predict_step}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Times the WRN steps with and without XLA on CPU.')
+    parser.add_argument('--configs', default=DEFAULT_CONFIGS, help='comma-separated N:k pairs')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', help='.json file to write the results to')
+    args = parser.parse_args(args)
+
+    results = []
+    print('%6s %4s %8s %14s %16s %8s' % ('depth', 'k', 'XLA', 'train step ms', 'predict step ms', 'speedup'))
+    for config in args.configs.split(','):
+        N, k = [int(v) for v in config.split(':')]
+        baseline = None
+        for jit_compile in (False, True):
+            result = benchmark(N, k, jit_compile, args.batch_size, args.steps, args.warmup)
+            results.append(result)
+            if baseline is None:
+                baseline = result
+            print('%6d %4d %8s %14.1f %16.1f %7.2fx' % (6 * N + 4, k, 'on' if jit_compile else 'off',
+                                                       result['train_step_sec'] * 1000,
+                                                       result['predict_step_sec'] * 1000,
+                                                       baseline['train_step_sec'] / result['train_step_sec']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+# Reproducible benchmark suite of the WRN
+# Replaces the hand-kept timings in the notes at the bottom of model_3_wide_resnet.py. For every
+# configuration of a grid of N, k, batch size and dataset size it measures, in a fresh process:
+#   - input pipeline throughput and the time to load the data
+#   - training throughput (images/sec) in steady state
+#   - inference latency and throughput per batch size
+#   - wall time until given validation accuracies are reached
+#   - peak RSS of the process
+# It runs offline on synthetic images or on the SVHN arrays already converted by svhn_data, and
+# writes one JSON line per configuration, so the results of two commits can be compared with --compare.
+#
+# Example:
+#   python benchmark_wrn.py --N 2 --k 1,2 --batch-size 128,512 --dataset-size 20000 --output bench.jsonl
+#   python benchmark_wrn.py ... --output bench_new.jsonl --compare bench.jsonl
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+from svhn_data import IMAGE_SHAPE, cache_paths
+
+# Metrics where lower is better are times, sizes and epoch counts, matched by suffix or prefix, e.g.
+# data_load_sec, predict_bs32_latency_p50_ms, peak_rss_mb, sec_per_epoch, epochs and epochs_to_0.95
+# Rates such as train_images_per_sec are higher-is-better
+LOWER_IS_BETTER_SUFFIXES = ('_sec', '_ms', '_mb')
+LOWER_IS_BETTER_PREFIXES = ('epochs', 'sec_per_', 'time_to_')
+
+
+def lower_is_better(metric):
+    """Whether a lower value of the metric is an improvement."""
+    if '_per_sec' in metric:
+        return False
+    return metric.endswith(LOWER_IS_BETTER_SUFFIXES) or metric.startswith(LOWER_IS_BETTER_PREFIXES)
+
+
+def synthetic_svhn(num_images, seed=0):
+    """
+    Generates learnable synthetic 32x32 digit-like images
+    Every class brightens its own 8x8 patch of a noisy image, so the WRN can reach a high accuracy and
+    time-to-accuracy can be measured without the dataset.
+    :return: (images, labels) - uint8 images and SVHN labels 1-10
+    """
+    rng = np.random.RandomState(seed)
+    labels = rng.randint(1, 11, num_images)
+    images = rng.randint(0, 160, (num_images,) + IMAGE_SHAPE).astype(np.uint8)
+    for digit in range(10):
+        row, col = divmod(digit, 4)
+        index = labels % 10 == digit
+        images[index, row * 8 + 4:row * 8 + 12, col * 8:col * 8 + 8] += 90
+    return images, labels
+
+
+def load_cached(cache_dir, num_images, split='extra'):
+    """Memory-maps the first images of a SVHN split already converted by svhn_data, without downloading."""
+    images_path, labels_path = cache_paths(os.path.join(cache_dir, '%s_32x32.mat' % split))
+    if not os.path.exists(images_path):
+        raise ValueError('%s has not been converted yet, run svhn_data.load_svhn(%r) once online.'
+                         % (images_path, split))
+    return np.load(images_path, mmap_mode='r')[:num_images], np.load(labels_path, mmap_mode='r')[:num_images]
+
+
+def run_config(config):
+    """Runs the benchmarks of one configuration, returns the results as a dict."""
+    import tensorflow as tf
+    from keras.callbacks import Callback, EarlyStopping
+    from keras.optimizers import SGD
+
+    from svhn_data import encode_labels
+    from svhn_stats import compute_stats
+    from svhn_input import train_valid_datasets
+    from svhn_augment import make_augment
+    from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau
+    from predict_wrn import benchmark_batch_sizes
+
+    if config['threads']:
+        tf.config.threading.set_intra_op_parallelism_threads(config['threads'])
+    np.random.seed(config['seed'])
+    tf.random.set_seed(config['seed'])
+
+    results = {}
+    start = time.time()
+    if config['data'] == 'synthetic':
+        images, labels = synthetic_svhn(config['dataset_size'], config['seed'])
+    else:
+        images, labels = load_cached(config['data'], config['dataset_size'])
+    labels = encode_labels(labels)
+    stats = compute_stats([(images, labels)])
+    augment = make_augment() if config['augment'] else None
+    train_dataset, valid_dataset = train_valid_datasets(images, labels, stats.mean, stats.std,
+                                                        batch_size=config['batch_size'], cache=True,
+                                                        seed=config['seed'], augment=augment)
+    results['data_load_sec'] = time.time() - start
+
+    # Input pipeline on its own, two epochs so the second one is served from the cache
+    for epoch in range(2):
+        start = time.time()
+        num_images = sum(int(x.shape[0]) for x, y in train_dataset)
+        results['input_images_per_sec_epoch%d' % (epoch + 1)] = num_images / (time.time() - start)
+
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=config['N'], k=config['k'],
+                                         dropout=0.0, verbose=0)
+    compile_wide_residual_network(model, SGD(lr=0.1, momentum=0.9, nesterov=False),
+                                  jit_compile=config['jit_compile'])
+
+    # Steady-state training throughput, after warm-up steps which build the graph
+    batches = iter(train_dataset.repeat())
+    for _ in range(3):
+        model.train_on_batch(*next(batches))
+    start = time.time()
+    for _ in range(config['train_steps']):
+        model.train_on_batch(*next(batches))
+    results['train_images_per_sec'] = config['train_steps'] * config['batch_size'] / (time.time() - start)
+
+    # Inference latency per batch size
+    sample = stats.standardize(images[:max(config['latency_batch_sizes'])])
+    for result in benchmark_batch_sizes(model, sample, config['latency_batch_sizes']):
+        for key in ('latency_p50_ms', 'latency_p99_ms', 'images_per_sec'):
+            results['predict_bs%d_%s' % (result['batch_size'], key)] = result[key]
+
+    # Time to accuracy with the training recipe of the script, from freshly initialized weights
+    if config['epochs']:
+        targets = sorted(config['targets'])
+
+        class TimeToAccuracy(Callback):
+            def on_train_begin(self, logs=None):
+                self.start = time.time()
+
+            def on_epoch_end(self, epoch, logs=None):
+                accuracy = (logs or {}).get('val_accuracy', (logs or {}).get('val_acc'))
+                for target in targets:
+                    key = 'time_to_%g_sec' % target
+                    if accuracy is not None and accuracy >= target and key not in results:
+                        results[key] = time.time() - self.start
+                        results['epochs_to_%g' % target] = epoch + 1
+                if all('time_to_%g_sec' % target in results for target in targets):
+                    self.model.stop_training = True
+
+        model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=config['N'], k=config['k'],
+                                             dropout=0.0, verbose=0)
+        compile_wide_residual_network(model, SGD(lr=0.1, momentum=0.9, nesterov=False),
+                                      jit_compile=config['jit_compile'])
+        start = time.time()
+        log = model.fit(train_dataset, validation_data=valid_dataset, epochs=config['epochs'], verbose=0,
+                        callbacks=[TimeToAccuracy(), EarlyStopping(monitor='val_loss', patience=4),
+                                   Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2,
+                                                            min_delta=0.0001, min_lr=0)])
+        results['train_sec'] = time.time() - start
+        results['epochs'] = len(log.history['loss'])
+        results['sec_per_epoch'] = results['train_sec'] / results['epochs']
+
+    # ru_maxrss is in KB on Linux
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    return results
+
+
+def environment():
+    """Describes the machine and the commit the benchmark ran on."""
+    import tensorflow as tf
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'host': platform.node(), 'cpu_count': os.cpu_count(),
+            'python': platform.python_version(), 'tensorflow': tf.__version__}
+
+
+def compare(results, baseline_path, threshold=0.05):
+    """Prints the change of every metric against a previous results file, flagging regressions."""
+    with open(baseline_path) as f:
+        baseline = [json.loads(line) for line in f if line.strip()]
+
+    def key(record):
+        # Results from before --augment existed were not augmented
+        return json.dumps(dict((name, record['config'].get(name, False))
+                               for name in ('N', 'k', 'batch_size', 'dataset_size', 'data', 'jit_compile',
+                                            'augment')),
+                          sort_keys=True)
+
+    baseline = dict((key(record), record) for record in baseline)
+    regressions = 0
+    for record in results:
+        previous = baseline.get(key(record))
+        if previous is None:
+            continue
+        print('\n%s' % key(record))
+        for metric, value in sorted(record['metrics'].items()):
+            old = previous['metrics'].get(metric)
+            if not old:
+                continue
+            change = (value - old) / float(old)
+            worse = change if lower_is_better(metric) else -change
+            flag = ''
+            if worse > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('  %-40s %12.4g -> %12.4g  %+7.1f%%%s' % (metric, old, value, change * 100, flag))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the WRN over a grid of configurations.')
+    parser.add_argument('--N', default='2', help='comma-separated depths, N = (n - 4) / 6')
+    parser.add_argument('--k', default='2', help='comma-separated widths')
+    parser.add_argument('--batch-size', default='128', help='comma-separated training batch sizes')
+    parser.add_argument('--dataset-size', default='20000', help='comma-separated numbers of images')
+    parser.add_argument('--data', default='synthetic', help="'synthetic', or the directory of the converted SVHN arrays")
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--augment', action='store_true', help='augment the training batches, see svhn_augment.py')
+    parser.add_argument('--train-steps', type=int, default=20)
+    parser.add_argument('--latency-batch-sizes', default='1,32,128')
+    parser.add_argument('--epochs', type=int, default=10, help='maximum epochs of the time-to-accuracy run, 0 to skip it')
+    parser.add_argument('--targets', default='0.9,0.95', help='validation accuracies to time')
+    parser.add_argument('--threads', type=int, help='intra-op threads')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.jsonl')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.05, help='relative change counted as a regression')
+    args = parser.parse_args(args)
+
+    env = environment()
+    grid = itertools.product([int(v) for v in args.N.split(',')], [int(v) for v in args.k.split(',')],
+                             [int(v) for v in args.batch_size.split(',')],
+                             [int(v) for v in args.dataset_size.split(',')])
+
+    results = []
+    for N, k, batch_size, dataset_size in grid:
+        config = {'N': N, 'k': k, 'batch_size': batch_size, 'dataset_size': dataset_size, 'data': args.data,
+                  'jit_compile': args.jit_compile, 'augment': args.augment, 'train_steps': args.train_steps,
+                  'latency_batch_sizes': [int(v) for v in args.latency_batch_sizes.split(',')],
+                  'epochs': args.epochs, 'targets': [float(v) for v in args.targets.split(',')],
+                  'threads': args.threads, 'seed': args.seed}
+        print('WRN-%d-%d, batch size %d, %d images' % (6 * N + 4, k, batch_size, dataset_size))
+
+        # A fresh process for every configuration, so that peak RSS and the graphs are not shared
+        pool = multiprocessing.get_context('spawn').Pool(1)
+        try:
+            metrics = pool.apply(run_config, (config,))
+        finally:
+            pool.close()
+            pool.join()
+
+        record = {'config': config, 'metrics': metrics, 'environment': env, 'timestamp': time.time()}
+        results.append(record)
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        for metric, value in sorted(metrics.items()):
+            print('  %-40s %12.4g' % (metric, value))
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        print('\n%d regressions' % regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# Knowledge distillation of the trained WRN-16-2 into a smaller, faster WRN
+# The shipped model_weights.h5 is the teacher. A smaller student from create_wide_residual_network
+# (e.g. WRN-10-1, N=1 and k=1) is trained on a mix of the true labels and of the teacher outputs
+# softened by a temperature (Hinton et al., 2015). The teacher logits of the training slice are
+# computed once and saved next to the teacher weights, so later runs only read them.
+# The student is then scored against the teacher for accuracy and CPU latency.
+#
+# Example:
+#   python distill_wrn.py --N 1 --k 1 --temperature 4 --alpha 0.1 --output student_weights.h5
+
+import argparse
+import json
+import os
+import numpy as np
+
+from svhn_data import IMAGE_SHAPE, load_svhn
+from svhn_stats import load_stats, save_stats, stats_path
+from predict_wrn import open_images, find_stats, build_model, benchmark_batch_sizes, predict
+
+
+def logits_path(weights_path, key):
+    """
+    Returns the path of the teacher logits saved next to its weights
+    :param key: Name of the dataset slice the logits were computed over, e.g. 'extra_0_100000'
+    :return: e.g. 'model_weights.extra_0_100000.logits.npy'
+    """
+    return '%s.%s.logits.npy' % (os.path.splitext(weights_path)[0], key)
+
+
+def teacher_logits(teacher, stats, images, path, chunk_size=10000, batch_size=256):
+    """
+    Memory-maps the teacher logits of the images, computing and saving them on first use
+    The teacher ends in a softmax, so the log-probabilities are saved. They only differ from the
+    logits by a constant per image, which a softmax at any temperature cancels out.
+    :return: (n, 10) float32 memmap
+    """
+    if os.path.exists(path):
+        logits = np.load(path, mmap_mode='r')
+        if len(logits) == len(images):
+            return logits
+
+    # Written to a temporary file first so that an interrupted run is never picked up as a cache
+    tmp_path = '%s.%d.tmp.npy' % (path, os.getpid())
+    logits = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(images), 10))
+    for start in range(0, len(images), chunk_size):
+        stop = min(start + chunk_size, len(images))
+        probs = teacher.predict(stats.standardize(images[start:stop]), batch_size=batch_size, verbose=0)
+        logits[start:stop] = np.log(np.maximum(probs, 1e-30))
+    logits.flush()
+    del logits
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+def distillation_targets(labels, logits):
+    """Packs the class indices and the teacher logits into (n, 11) float32 targets for the loss."""
+    targets = np.empty((len(labels), 11), dtype=np.float32)
+    targets[:, 0] = labels
+    targets[:, 1:] = logits
+    return targets
+
+
+def distillation_loss(temperature=4., alpha=0.1):
+    """
+    Returns a loss of the student probabilities against (n, 11) targets from distillation_targets
+    alpha * crossentropy with the labels + (1 - alpha) * T^2 * KL divergence between the teacher and
+    the student outputs softened by the temperature T. The T^2 keeps the gradients of the soft part
+    at the same scale whatever the temperature.
+    """
+    import tensorflow as tf
+
+    def loss(y_true, y_pred):
+        labels = tf.cast(y_true[:, 0], tf.int32)
+        teacher = tf.nn.softmax(y_true[:, 1:] / temperature)
+        # Log-probabilities are logits up to a constant, as for the teacher
+        student_logits = tf.math.log(tf.maximum(y_pred, 1e-30))
+        student = tf.nn.log_softmax(student_logits / temperature)
+        hard = tf.keras.losses.sparse_categorical_crossentropy(labels, y_pred)
+        soft = tf.reduce_sum(teacher * (tf.math.log(tf.maximum(teacher, 1e-30)) - student), axis=-1)
+        return alpha * hard + (1. - alpha) * temperature ** 2 * soft
+    return loss
+
+
+def label_accuracy(y_true, y_pred):
+    """Accuracy of the student against the labels packed in the distillation targets."""
+    import tensorflow as tf
+
+    labels = tf.cast(y_true[:, 0], tf.int64)
+    return tf.reduce_mean(tf.cast(tf.equal(tf.argmax(y_pred, axis=-1), labels), tf.float32))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Distills the trained WRN into a smaller student WRN.')
+    parser.add_argument('--weights', default='model_weights.h5', help='weights of the teacher')
+    parser.add_argument('--stats', help='normalization stats the teacher was trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--teacher-N', type=int, default=2)
+    parser.add_argument('--teacher-k', type=int, default=2)
+    parser.add_argument('--N', type=int, default=1, help='depth of the student, N = (n - 4) / 6')
+    parser.add_argument('--k', type=int, default=1, help='width of the student')
+    parser.add_argument('--temperature', type=float, default=4.)
+    parser.add_argument('--alpha', type=float, default=0.1, help='weight of the loss on the true labels')
+    parser.add_argument('--stop', type=int, default=100000, help='number of extra images to train on')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--lr', type=float, default=0.1)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--output', default='student_weights.h5')
+    parser.add_argument('--test', help='.mat or .npy test images, defaults to the SVHN test split')
+    parser.add_argument('--report', default='distillation_report.json')
+    parser.add_argument('--batch-sizes', default='1,32,128,512')
+    args = parser.parse_args(args)
+
+    from keras.callbacks import ModelCheckpoint, EarlyStopping
+    from keras.optimizers import SGD
+
+    from svhn_cache import load_preprocessed
+    from svhn_input import train_valid_datasets
+    from wide_resnet import create_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau
+
+    stats = load_stats(args.stats or find_stats(args.weights))
+    teacher = build_model(args.weights, args.teacher_N, args.teacher_k)
+
+    # The student is trained on the same slice and with the same standardization as the teacher
+    key = 'extra_0_%d' % args.stop
+    images, labels, _ = load_preprocessed('extra', stop=args.stop)
+    logits = teacher_logits(teacher, stats, images, logits_path(args.weights, key))
+    targets = distillation_targets(labels, logits)
+    train_dataset, valid_dataset = train_valid_datasets(images, targets, stats.mean, stats.std,
+                                                        batch_size=args.batch_size,
+                                                        validation_split=args.validation_split, cache=True)
+
+    student = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=args.N, k=args.k, dropout=0.0)
+    student.compile(loss=distillation_loss(args.temperature, args.alpha),
+                    optimizer=SGD(lr=args.lr, momentum=0.9, nesterov=False), metrics=[label_accuracy])
+
+    callbacks = [EarlyStopping(monitor='val_loss', patience=4),
+                 Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=1,
+                                          min_delta=0.0001, min_lr=0),
+                 ModelCheckpoint(filepath=args.output, monitor='val_loss', save_best_only=True,
+                                 save_weights_only=True)]
+    student.fit(train_dataset, validation_data=valid_dataset, epochs=args.epochs, verbose=2, callbacks=callbacks)
+
+    # The student takes the images standardized like the teacher, so its stats go next to its weights
+    save_stats(stats_path(args.output, key), stats)
+    student = build_model(args.output, args.N, args.k)
+
+    if args.test:
+        test_images, test_labels = open_images(args.test)
+    else:
+        test_images, test_labels = load_svhn('test')
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    sample = stats.standardize(test_images[:max(batch_sizes)])
+
+    report = {'temperature': args.temperature, 'alpha': args.alpha}
+    for name, model, N, k in [('teacher', teacher, args.teacher_N, args.teacher_k),
+                              ('student', student, args.N, args.k)]:
+        print('Scoring the %s' % name)
+        results = predict(model, stats, test_images, test_labels, verbose=0)
+        results.update(N=N, k=k, params=model.count_params())
+        results['batch_sizes'] = benchmark_batch_sizes(model, sample, batch_sizes)
+        report[name] = results
+
+    print('%-8s %8s %10s %10s' % ('model', 'WRN', 'params', 'accuracy'))
+    for name in ('teacher', 'student'):
+        print('%-8s %8s %10d %10.4f' % (name, '%d-%d' % (6 * report[name]['N'] + 4, report[name]['k']),
+                                        report[name]['params'], report[name].get('accuracy', float('nan'))))
+
+    print('%-8s %10s %14s %14s %14s' % ('model', 'batch size', 'p50 latency ms', 'p99 latency ms', 'images/sec'))
+    for name in ('teacher', 'student'):
+        for result in report[name]['batch_sizes']:
+            print('%-8s %10d %14.2f %14.2f %14.0f' % (name, result['batch_size'], result['latency_p50_ms'],
+                                                     result['latency_p99_ms'], result['images_per_sec']))
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
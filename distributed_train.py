@@ -0,0 +1,201 @@
+# Multi-process data-parallel training of the WRN
+# Every worker process trains a replica of the model on its own shard of the SVHN slice, and the
+# gradients are all-reduced every step with tf.distribute.MultiWorkerMirroredStrategy. The learning
+# rate is scaled linearly with the global batch size, and only the checkpoints of the chief (worker 0) are kept.
+#
+# On one box, --workers launches the worker processes locally:
+#   python distributed_train.py --workers 4 --stop 200000
+# On several nodes, set TF_CONFIG on every node and start each worker with --worker:
+#   TF_CONFIG='{"cluster": {"worker": ["node1:12345", "node2:12345"]}, "task": {"type": "worker", "index": 0}}' \
+#       python distributed_train.py --worker --stop 200000
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+# The learning rate the recipe was tuned with, for a (global) batch size of 128
+BASE_LR = 0.1
+BASE_BATCH_SIZE = 128
+
+
+def cluster_spec(num_workers, port=12345, host='localhost'):
+    return {'worker': ['%s:%d' % (host, port + i) for i in range(num_workers)]}
+
+
+def launch_local(num_workers, worker_args, port=12345):
+    """
+    Starts `num_workers` worker processes of this script on this machine and waits for them
+    Each worker gets its own TF_CONFIG and an equal share of the CPU cores.
+    :return: Exit code, the one of the first worker which failed if any, see wait_workers
+    """
+    cluster = cluster_spec(num_workers, port)
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}})
+        command = [sys.executable, os.path.abspath(__file__), '--worker', '--threads', str(threads)] + worker_args
+        processes.append(subprocess.Popen(command, env=env))
+
+    return wait_workers(processes)
+
+
+def wait_workers(processes, poll_interval=0.5):
+    """
+    Waits for worker processes, and terminates the others as soon as one of them fails
+    A failed worker would leave the others blocked in their next all-reduce.
+    :return: Exit code of the first worker which failed (negative if it was killed by a signal), else 0
+    """
+    running = list(processes)
+    exit_code = 0
+    try:
+        while running:
+            for process in list(running):
+                code = process.poll()
+                if code is None:
+                    continue
+                running.remove(process)
+                if code != 0 and exit_code == 0:
+                    exit_code = code
+                    for other in running:
+                        other.terminate()
+            if running:
+                time.sleep(poll_interval)
+    finally:
+        # Interrupted, e.g. by Ctrl-C, the workers must not be left behind
+        for process in running:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    return exit_code
+
+
+def worker_shard(images, labels, task_index, num_workers, batch_size):
+    """
+    Returns the contiguous block of images of one worker
+    Every worker gets the same number of whole batches, so that they all run the same number of
+    steps and none of them waits forever in an all-reduce.
+    """
+    steps = len(images) // num_workers // batch_size
+    start = task_index * steps * batch_size
+    stop = start + steps * batch_size
+    return images[start:stop], labels[start:stop], steps
+
+
+def train_worker(args):
+    import tensorflow as tf
+
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+
+    # The strategy has to be created before any other TensorFlow op
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    num_workers = strategy.num_replicas_in_sync
+    tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    task_index = tf_config.get('task', {}).get('index', 0)
+    is_chief = task_index == 0
+
+    from keras.callbacks import ModelCheckpoint, EarlyStopping
+    from keras.optimizers import SGD
+
+    from svhn_data import IMAGE_SHAPE, load_svhn, encode_labels
+    from svhn_stats import RunningStats, cached_stats
+    from svhn_input import make_dataset
+    from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau
+
+    if args.synthetic:
+        # Random images, to try out the cluster without the dataset
+        rng = np.random.RandomState(0)
+        list_images = rng.randint(0, 256, (args.stop,) + IMAGE_SHAPE).astype(np.uint8)
+        list_labels = encode_labels(rng.randint(1, 11, args.stop))
+        stats = RunningStats().update(list_images)
+    else:
+        list_images, list_labels = load_svhn('extra', stop=args.stop)
+        list_labels = encode_labels(list_labels)
+        stats = cached_stats(args.checkpoint, 'extra_0_%d' % len(list_images), [(list_images, list_labels)])
+
+    # Same split as ImageDataGenerator(validation_split=0.2), then every worker takes its own shard
+    split = int(len(list_images) * args.validation_split)
+    train_images, train_labels, train_steps = worker_shard(list_images[split:], list_labels[split:],
+                                                           task_index, num_workers, args.batch_size)
+    valid_images, valid_labels, valid_steps = worker_shard(list_images[:split], list_labels[:split],
+                                                           task_index, num_workers, args.batch_size)
+
+    # The datasets are already sharded by worker, so tf.distribute must not shard them again
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    train_dataset = make_dataset(train_images, train_labels, stats.mean, stats.std, args.batch_size,
+                                 shuffle=True, seed=task_index).repeat().with_options(options)
+    valid_dataset = make_dataset(valid_images, valid_labels, stats.mean, stats.std, args.batch_size,
+                                 shuffle=False).repeat().with_options(options)
+
+    # Linear scaling of the learning rate with the global batch size
+    global_batch_size = args.batch_size * num_workers
+    lr = args.lr * global_batch_size / float(BASE_BATCH_SIZE)
+
+    with strategy.scope():
+        model = create_wide_residual_network(train_images.shape[1:], nb_classes=10, N=args.N, k=args.k,
+                                             dropout=args.dropout, verbose=is_chief)
+        compile_wide_residual_network(model, SGD(lr=lr, momentum=0.9, nesterov=False))
+
+    # ModelCheckpoint has to run on every worker, as saving takes part in the collective ops. Under the
+    # strategy, Keras only writes the checkpoint of the chief to the given path, the others go to
+    # temporary directories which are removed straight away
+    callbacks = [EarlyStopping(monitor='val_loss', patience=4),
+                 Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=is_chief,
+                                          min_delta=0.0001, min_lr=0),
+                 ModelCheckpoint(filepath=args.checkpoint, monitor='val_loss', save_best_only=True,
+                                 save_weights_only=True)]
+
+    if is_chief:
+        print('%d workers, global batch size %d, learning rate %g' % (num_workers, global_batch_size, lr))
+
+    model.fit(train_dataset,
+              validation_data=valid_dataset,
+              steps_per_epoch=train_steps,
+              validation_steps=valid_steps,
+              epochs=args.epochs,
+              verbose=2 if is_chief else 0,
+              callbacks=callbacks)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Data-parallel training of the WRN over several processes.')
+    parser.add_argument('--workers', type=int, default=2, help='number of worker processes to launch locally')
+    parser.add_argument('--worker', action='store_true', help='run as one worker, configured by TF_CONFIG')
+    parser.add_argument('--port', type=int, default=12345, help='first port of the locally launched workers')
+    parser.add_argument('--threads', type=int, help='intra-op threads per worker')
+    parser.add_argument('--stop', type=int, default=100000, help='number of extra images to train on')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--dropout', type=float, default=0.0)
+    parser.add_argument('--batch-size', type=int, default=128, help='batch size per worker')
+    parser.add_argument('--lr', type=float, default=BASE_LR, help='learning rate for a global batch size of 128')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--checkpoint', default='weights.best.cnn.hdf5')
+    parser.add_argument('--synthetic', action='store_true', help='train on random images instead of SVHN')
+    args = parser.parse_args(args)
+
+    if args.worker:
+        train_worker(args)
+        return 0
+
+    # Everything but the launcher options is passed on to the workers
+    worker_args = []
+    for name in ('stop', 'validation_split', 'N', 'k', 'dropout', 'batch_size', 'lr', 'epochs', 'checkpoint'):
+        worker_args += ['--' + name.replace('_', '-'), str(getattr(args, name))]
+    if args.synthetic:
+        worker_args.append('--synthetic')
+    return launch_local(args.workers, worker_args, args.port)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
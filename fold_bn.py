@@ -0,0 +1,217 @@
+# Inference graph optimizer for the trained WRN
+# Folds every BatchNormalization that directly follows a Conv2D into that convolution, and removes
+# Dropout and the L2 regularizers, which only matter for training. The WRN blocks are pre-activation
+# (BN -> ReLU -> Conv), so only the BN after a Conv2D can be folded: the BN in initial_conv and
+# expand_conv, and the second BN of every conv block. The BNs applied to the residual sums stay.
+#
+# Example:
+#   python fold_bn.py --weights model_weights.h5 --output model_folded.h5
+
+import argparse
+import json
+import numpy as np
+
+from keras.models import Model
+
+# Layers which are the identity at inference time
+INFERENCE_IDENTITY = ('Dropout', 'SpatialDropout2D', 'GaussianNoise', 'GaussianDropout')
+
+
+def _inbound(layer_config):
+    """Returns the inbound [layer_name, node_index, tensor_index, kwargs] entries of a layer config."""
+    return [entry for node in layer_config['inbound_nodes'] for entry in node]
+
+
+def find_foldable(config):
+    """
+    Finds the BatchNormalization layers which can be folded into the Conv2D before them
+    A BN can be folded if its input comes from a Conv2D, possibly through inference-time identity
+    layers, and nothing else uses the output of that Conv2D.
+    :param config: Model config from model.get_config()
+    :return: dict of BN layer name to Conv2D layer name
+    """
+    layers = dict((layer['name'], layer) for layer in config['layers'])
+    consumers = dict((name, []) for name in layers)
+    for layer in config['layers']:
+        for entry in _inbound(layer):
+            consumers[entry[0]].append(layer['name'])
+
+    folds = {}
+    for name, layer in layers.items():
+        if layer['class_name'] != 'BatchNormalization' or len(_inbound(layer)) != 1:
+            continue
+        axis = layer['config']['axis']
+        if isinstance(axis, (list, tuple)):
+            axis = axis[0] if len(axis) == 1 else None
+        if axis not in (-1, 3):
+            continue
+
+        # Walk back through the identity layers, each of them must only feed the next one
+        producer = _inbound(layer)[0][0]
+        while layers[producer]['class_name'] in INFERENCE_IDENTITY and len(consumers[producer]) == 1:
+            producer = _inbound(layers[producer])[0][0]
+
+        conv = layers[producer]
+        if (conv['class_name'] == 'Conv2D' and len(consumers[producer]) == 1
+                and conv['config'].get('activation', 'linear') == 'linear'
+                and conv['config'].get('data_format', 'channels_last') == 'channels_last'):
+            folds[name] = producer
+    return folds
+
+
+def fold_weights(conv_weights, bn_weights, bn_config):
+    """
+    Returns the kernel and bias of a Conv2D with the BatchNormalization after it folded in
+    :param conv_weights: [kernel] or [kernel, bias] of the Conv2D
+    :param bn_weights: Weights of the BatchNormalization, gamma and beta are only there if
+                       scale and center are True
+    :param bn_config: Config of the BatchNormalization
+    :return: [kernel, bias]
+    """
+    kernel = conv_weights[0].astype(np.float64)
+    bias = conv_weights[1].astype(np.float64) if len(conv_weights) > 1 else np.zeros(kernel.shape[-1])
+
+    bn_weights = list(bn_weights)
+    gamma = bn_weights.pop(0) if bn_config.get('scale', True) else np.ones(kernel.shape[-1])
+    beta = bn_weights.pop(0) if bn_config.get('center', True) else np.zeros(kernel.shape[-1])
+    moving_mean, moving_variance = bn_weights
+
+    scale = gamma / np.sqrt(moving_variance + bn_config['epsilon'])
+    kernel = kernel * scale
+    bias = (bias - moving_mean) * scale + beta
+    return [kernel.astype(np.float32), bias.astype(np.float32)]
+
+
+def optimize_for_inference(model, verbose=1):
+    """
+    Builds an inference model equivalent to a trained model
+    BatchNormalization layers are folded into the Conv2D before them where the graph allows it,
+    inference-time identity layers such as Dropout are removed, and so are the regularizers.
+    :param model: Trained Keras functional model
+    :return: New Keras model with the folded weights
+    """
+    config = model.get_config()
+    folds = find_foldable(config)
+    folded_convs = dict((conv, bn) for bn, conv in folds.items())
+    removed = set(folds)
+    removed.update(layer['name'] for layer in config['layers'] if layer['class_name'] in INFERENCE_IDENTITY)
+
+    # Every removed layer is replaced by its own input
+    replacement = {}
+    for layer in config['layers']:
+        if layer['name'] in removed:
+            replacement[layer['name']] = _inbound(layer)[0]
+
+    def resolve(entry):
+        while entry[0] in replacement:
+            entry = replacement[entry[0]]
+        return entry
+
+    layers = []
+    for layer in config['layers']:
+        if layer['name'] in removed:
+            continue
+        layer_config = layer['config']
+        for key in ('kernel_regularizer', 'bias_regularizer', 'activity_regularizer',
+                    'gamma_regularizer', 'beta_regularizer'):
+            if key in layer_config:
+                layer_config[key] = None
+        if layer['name'] in folded_convs:
+            layer_config['use_bias'] = True
+            layer_config['bias_initializer'] = {'class_name': 'Zeros', 'config': {}}
+
+        layer['inbound_nodes'] = [[list(resolve(entry)[:3]) + list(entry[3:]) for entry in node]
+                                  for node in layer['inbound_nodes']]
+        layers.append(layer)
+
+    config['layers'] = layers
+    config['output_layers'] = [list(resolve(entry)[:3]) for entry in config['output_layers']]
+
+    optimized = Model.from_config(config)
+
+    for layer in optimized.layers:
+        if layer.name in folded_convs:
+            bn = model.get_layer(folded_convs[layer.name])
+            layer.set_weights(fold_weights(model.get_layer(layer.name).get_weights(),
+                                           bn.get_weights(), bn.get_config()))
+        else:
+            layer.set_weights(model.get_layer(layer.name).get_weights())
+
+    if verbose:
+        print('Folded %d of %d BatchNormalization layers, removed %d other inference-time identity layers.'
+              % (len(folds), sum(1 for layer in model.layers if layer.__class__.__name__ == 'BatchNormalization'),
+                 len(removed) - len(folds)))
+    return optimized
+
+
+def check_equivalence(model, optimized, images, stats, chunk_size=10000, batch_size=256, atol=1e-4):
+    """
+    Compares the outputs of the original and the optimized model
+    :param images: (n, 32, 32, 3) uint8 images, e.g. the test set
+    :param stats: RunningStats the model was trained with
+    :param atol: Largest difference allowed between the output probabilities
+    :return: dict with the largest absolute difference and the fraction of identical predictions
+    """
+    max_abs_diff = 0.0
+    same = 0
+    for start in range(0, len(images), chunk_size):
+        x = stats.standardize(images[start:start + chunk_size])
+        expected = model.predict(x, batch_size=batch_size, verbose=0)
+        actual = optimized.predict(x, batch_size=batch_size, verbose=0)
+        max_abs_diff = max(max_abs_diff, float(np.abs(expected - actual).max()))
+        same += int((expected.argmax(axis=1) == actual.argmax(axis=1)).sum())
+
+    results = {'max_abs_diff': max_abs_diff, 'prediction_agreement': same / float(len(images))}
+    if max_abs_diff > atol:
+        raise ValueError('The optimized model differs from the original by up to %g, more than atol=%g.'
+                         % (max_abs_diff, atol))
+    return results
+
+
+def main(args=None):
+    from svhn_data import load_svhn
+    from svhn_stats import load_stats
+    from predict_wrn import open_images, find_stats, build_model, benchmark_batch_sizes
+
+    parser = argparse.ArgumentParser(description='Folds BatchNormalization into Conv2D in the trained WRN.')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--test', help='.mat or .npy test images, defaults to the SVHN test split')
+    parser.add_argument('--output', default='model_folded.h5', help='the optimized model is saved here')
+    parser.add_argument('--atol', type=float, default=1e-4)
+    parser.add_argument('--batch-sizes', default='1,32,128,512')
+    parser.add_argument('--report', help='.json file to write the equivalence check and timings to')
+    args = parser.parse_args(args)
+
+    stats = load_stats(args.stats or find_stats(args.weights))
+    model = build_model(args.weights, args.N, args.k)
+    optimized = optimize_for_inference(model)
+
+    if args.test:
+        test_images, _ = open_images(args.test)
+    else:
+        test_images, _ = load_svhn('test')
+
+    report = check_equivalence(model, optimized, test_images, stats, atol=args.atol)
+    print('Largest output difference: %g, identical predictions: %.4f'
+          % (report['max_abs_diff'], report['prediction_agreement']))
+    optimized.save(args.output)
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    sample = stats.standardize(test_images[:max(batch_sizes)])
+    for name, scorer in [('original', model), ('optimized', optimized)]:
+        report[name] = benchmark_batch_sizes(scorer, sample, batch_sizes)
+        for result in report[name]:
+            print('%-9s batch size %5d: %8.2f ms p50, %8.0f images/sec'
+                  % (name, result['batch_size'], result['latency_p50_ms'], result['images_per_sec']))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# Large-batch training of the WRN
+# Batch 2048 cut the epoch time from 122 s to 85 s in the notes but lost accuracy, and 4096 did not fit
+# in memory. This mode trains with big effective batches the way large-batch papers do it:
+#   - linear scaling of the learning rate with the batch size, reached through a warmup from the
+#     learning rate of batch 128 over the first epochs (Goyal et al., 2017)
+#   - optional LARS layer-wise scaling, every weight tensor gets a step proportional to its norm
+#     (You et al., 2017), BatchNormalization and bias vectors are left out
+#   - gradient accumulation, every effective batch runs through the model in micro-batches whose
+#     gradients are summed, so the activations only ever take the memory of one micro-batch. The
+#     BatchNormalization statistics are computed per micro-batch, as ghost batch norm does.
+#
+# Example, an effective batch of 4096 in the memory of a 512 batch:
+#   python large_batch_wrn.py --batch-size 4096 --micro-batch-size 512 --warmup-epochs 5 --lars
+
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from keras.models import Model
+from keras.callbacks import Callback
+from keras import backend as K
+
+# The learning rate the recipe was tuned with, for a batch size of 128
+BASE_LR = 0.1
+BASE_BATCH_SIZE = 128
+
+
+def scaled_lr(lr, batch_size, base_batch_size=BASE_BATCH_SIZE):
+    """Linear scaling rule: the learning rate grows with the batch size."""
+    return lr * batch_size / float(base_batch_size)
+
+
+class LargeBatchModel(Model):
+    """Model whose training step accumulates the gradients of micro-batches.
+
+    Build it on the inputs and outputs of a functional model, e.g.
+    `LargeBatchModel(model.inputs, model.outputs, accumulation_steps=8)`,
+    and feed it the effective batches.
+
+    # Arguments
+        accumulation_steps: number of micro-batches every batch is split into.
+        lars: whether to scale the gradient of every weight tensor by the
+            LARS trust ratio eta * ||w|| / ||g||.
+        eta: LARS trust coefficient.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.accumulation_steps = kwargs.pop('accumulation_steps', 1)
+        self.lars = kwargs.pop('lars', False)
+        self.eta = kwargs.pop('eta', 0.001)
+        super(LargeBatchModel, self).__init__(*args, **kwargs)
+
+    def train_step(self, data):
+        x, y = data[0], data[1]
+        batch_size = tf.shape(x)[0]
+
+        variables = self.trainable_variables
+        grads = [tf.zeros_like(variable) for variable in variables]
+        for step in range(self.accumulation_steps):
+            # Split as evenly as possible, the micro-batches of a ragged batch differ by one image at most
+            start = step * batch_size // self.accumulation_steps
+            stop = (step + 1) * batch_size // self.accumulation_steps
+            # Every micro-batch counts for its share of the batch
+            weight = tf.cast(stop - start, tf.float32) / tf.cast(batch_size, tf.float32)
+            # A batch smaller than accumulation_steps leaves some micro-batches empty, BatchNormalization
+            # cannot run on those
+            micro_grads = tf.cond(stop > start,
+                                  lambda: self._micro_batch_gradients(x[start:stop], y[start:stop], variables),
+                                  lambda: [tf.zeros_like(variable) for variable in variables])
+            grads = [g + weight * micro for g, micro in zip(grads, micro_grads)]
+
+        if self.lars:
+            grads = [self._trust_ratio(variable, grad) * grad for variable, grad in zip(variables, grads)]
+        self.optimizer.apply_gradients(zip(grads, variables))
+        return dict((metric.name, metric.result()) for metric in self.metrics)
+
+    def _micro_batch_gradients(self, x, y, variables):
+        with tf.GradientTape() as tape:
+            y_pred = self(x, training=True)
+            loss = self.compiled_loss(y, y_pred, regularization_losses=self.losses)
+        self.compiled_metrics.update_state(y, y_pred)
+        return tape.gradient(loss, variables)
+
+    def _trust_ratio(self, variable, grad):
+        if len(variable.shape) < 2:
+            return 1.
+        weight_norm = tf.norm(variable)
+        grad_norm = tf.norm(grad)
+        return tf.where(tf.logical_and(weight_norm > 0, grad_norm > 0),
+                        self.eta * weight_norm / grad_norm, 1.)
+
+
+class LinearWarmup(Callback):
+    """Raises the learning rate linearly every step from `start_lr` to `target_lr`.
+
+    After the warmup the learning rate is left alone, so ReduceLROnPlateau
+    and the like take over from `target_lr`.
+
+    # Arguments
+        start_lr: learning rate of the first step, e.g. the one of batch 128.
+        target_lr: learning rate at the end of the warmup, e.g. from scaled_lr.
+        warmup_epochs: length of the warmup.
+        steps_per_epoch: number of batches per epoch, defaults to the one fit knows.
+    """
+
+    def __init__(self, start_lr, target_lr, warmup_epochs=5, steps_per_epoch=None):
+        super(LinearWarmup, self).__init__()
+        self.start_lr = start_lr
+        self.target_lr = target_lr
+        self.warmup_epochs = warmup_epochs
+        self.steps_per_epoch = steps_per_epoch
+        self.epoch = 0
+
+    def on_train_begin(self, logs=None):
+        if self.steps_per_epoch is None:
+            self.steps_per_epoch = self.params.get('steps')
+        if not self.steps_per_epoch:
+            raise ValueError('LinearWarmup needs steps_per_epoch when fit does not know the number of steps.')
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_batch_begin(self, batch, logs=None):
+        warmup_steps = self.warmup_epochs * self.steps_per_epoch
+        step = self.epoch * self.steps_per_epoch + batch
+        if step < warmup_steps:
+            lr = self.start_lr + (self.target_lr - self.start_lr) * step / float(warmup_steps)
+            K.set_value(self.model.optimizer.lr, lr)
+        elif step == warmup_steps:
+            K.set_value(self.model.optimizer.lr, self.target_lr)
+
+
+def main(args=None):
+    from keras.callbacks import ModelCheckpoint, EarlyStopping
+    from keras.optimizers import SGD
+
+    from svhn_data import IMAGE_SHAPE, encode_labels
+    from svhn_stats import compute_stats
+    from svhn_input import make_dataset
+    from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau
+
+    parser = argparse.ArgumentParser(description='Trains the WRN with large batches.')
+    parser.add_argument('--batch-size', type=int, default=4096, help='effective batch size')
+    parser.add_argument('--micro-batch-size', type=int, default=512, help='batch size which fits in memory')
+    parser.add_argument('--lr', type=float, default=BASE_LR, help='learning rate for a batch size of 128')
+    parser.add_argument('--warmup-epochs', type=int, default=5)
+    parser.add_argument('--lars', action='store_true', help='LARS layer-wise learning rates')
+    parser.add_argument('--eta', type=float, default=0.001, help='LARS trust coefficient')
+    parser.add_argument('--stop', type=int, default=100000, help='number of extra images to train on')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--dropout', type=float, default=0.0)
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--checkpoint', default='weights.best.cnn.hdf5')
+    parser.add_argument('--synthetic', action='store_true', help='train on synthetic images instead of SVHN')
+    args = parser.parse_args(args)
+
+    if args.synthetic:
+        from benchmark_wrn import synthetic_svhn
+        images, labels = synthetic_svhn(args.stop)
+        stats = compute_stats([(images, labels)])
+        labels = encode_labels(labels)
+    else:
+        from svhn_cache import load_preprocessed
+        images, labels, stats = load_preprocessed('extra', stop=args.stop)
+
+    # Same split as ImageDataGenerator(validation_split=0.2), the validation batches only need to fit in memory
+    split = int(len(images) * args.validation_split)
+    train_dataset = make_dataset(images[split:], labels[split:], stats.mean, stats.std, args.batch_size,
+                                 shuffle=True, cache=True)
+    valid_dataset = make_dataset(images[:split], labels[:split], stats.mean, stats.std, args.micro_batch_size,
+                                 shuffle=False, cache=True)
+    steps_per_epoch = int(np.ceil((len(images) - split) / float(args.batch_size)))
+
+    accumulation_steps = max(1, int(np.ceil(args.batch_size / float(args.micro_batch_size))))
+    target_lr = scaled_lr(args.lr, args.batch_size)
+    wrn = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=args.N, k=args.k, dropout=args.dropout)
+    model = LargeBatchModel(wrn.inputs, wrn.outputs, accumulation_steps=accumulation_steps,
+                            lars=args.lars, eta=args.eta)
+    compile_wide_residual_network(model, SGD(lr=args.lr, momentum=0.9, nesterov=False))
+    print('Batch size %d as %d micro-batches of %d, learning rate %g warmed up to %g over %d epochs%s'
+          % (args.batch_size, accumulation_steps, args.micro_batch_size, args.lr, target_lr,
+             args.warmup_epochs, ', LARS' if args.lars else ''))
+
+    callbacks = [LinearWarmup(args.lr, target_lr, args.warmup_epochs, steps_per_epoch),
+                 EarlyStopping(monitor='val_loss', patience=4),
+                 Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=1,
+                                          min_delta=0.0001, min_lr=0),
+                 ModelCheckpoint(filepath=args.checkpoint, monitor='val_loss', save_best_only=True,
+                                 save_weights_only=True)]
+    model.fit(train_dataset, validation_data=valid_dataset, epochs=args.epochs, verbose=2, callbacks=callbacks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# Load generator for the micro-batching prediction server
+# Opens `concurrency` keep-alive connections to serve_wrn.py on localhost, each sending its requests
+# back to back, and measures the latency of every request on the client and the throughput. With no
+# --url, a server is started in this process for every --max-batch-sizes value, so one run compares
+# e.g. one request at a time (max batch size 1) against micro-batches of 64 on the same machine.
+# The server metrics (queue wait, inference time, batch fill) are read from /metrics after every run.
+#
+# Example:
+#   python loadgen_wrn.py --max-batch-sizes 1,16,64 --concurrency 64 --requests 5000
+#   python loadgen_wrn.py --url localhost:8500 --concurrency 64
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+import numpy as np
+
+from serve_wrn import IMAGE_BYTES
+
+
+async def http_request(reader, writer, method, path, body=b''):
+    """Sends one request on a keep-alive connection, returns the status and the decoded JSON answer."""
+    writer.write(b'%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/octet-stream\r\n'
+                 b'Content-Length: %d\r\n\r\n' % (method.encode(), path.encode(), len(body)) + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, payloads, num_requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in range(num_requests):
+            start = time.time()
+            status, _ = await http_request(reader, writer, 'POST', '/predict', payloads[i % len(payloads)])
+            if status == 200:
+                latencies.append(time.time() - start)
+            else:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def fetch(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return (await http_request(reader, writer, 'GET', path))[1]
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, payloads, concurrency, num_requests, warmup_requests=0):
+    """
+    Sends num_requests requests over concurrency connections
+    :return: dict of the client latencies, throughput and the server metrics of the run
+    """
+    if warmup_requests:
+        await asyncio.gather(*[client(host, port, payloads, max(1, warmup_requests // concurrency), [], [])
+                               for _ in range(concurrency)])
+    await fetch(host, port, '/metrics?reset=1')
+
+    latencies, errors = [], []
+    per_client = [num_requests // concurrency + (i < num_requests % concurrency) for i in range(concurrency)]
+    start = time.time()
+    await asyncio.gather(*[client(host, port, payloads, n, latencies, errors) for n in per_client if n])
+    elapsed = time.time() - start
+
+    latencies = np.asarray(latencies) * 1000
+    images_per_request = len(payloads[0]) // IMAGE_BYTES
+    results = {'concurrency': concurrency, 'requests': len(latencies), 'errors': len(errors),
+               'seconds': elapsed, 'requests_per_sec': len(latencies) / elapsed,
+               'images_per_sec': len(latencies) * images_per_request / elapsed,
+               'client_latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+               'client_latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None}
+    results['server'] = await fetch(host, port, '/metrics')
+    return results
+
+
+class BackgroundServer(object):
+    """Runs a PredictionServer on its own event loop in a background thread, on a free localhost port."""
+
+    def __init__(self, server, host='127.0.0.1'):
+        self.server = server
+        self.host = host
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        self.port = asyncio.run_coroutine_threadsafe(self.server.start(self.host, 0), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the WRN prediction server on localhost.')
+    parser.add_argument('--url', help='host:port of a running serve_wrn.py, by default servers are started '
+                                      'in this process')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, defaults to the '
+                                        'stats file saved next to the weights, else the stats of the payloads')
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--max-batch-sizes', default='1,64', help='comma-separated max batch sizes of the servers')
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=64, help='number of concurrent connections')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup-requests', type=int, default=200)
+    parser.add_argument('--images-per-request', type=int, default=1)
+    parser.add_argument('--report', help='.json file to write the results to')
+    args = parser.parse_args(args)
+
+    from benchmark_wrn import synthetic_svhn
+
+    images, _ = synthetic_svhn(max(256, args.images_per_request))
+    payloads = [images[i:i + args.images_per_request].tobytes()
+                for i in range(0, len(images) - args.images_per_request + 1, args.images_per_request)]
+
+    reports = []
+    if args.url:
+        host, _, port = args.url.rpartition(':')
+        results = asyncio.run(run_load(host or '127.0.0.1', int(port), payloads, args.concurrency,
+                                       args.requests, args.warmup_requests))
+        reports.append(results)
+    else:
+        from predict_wrn import find_stats
+        from svhn_stats import load_stats, compute_stats
+        from serve_wrn import build_server
+
+        if args.stats:
+            stats = load_stats(args.stats)
+        else:
+            try:
+                stats = load_stats(find_stats(args.weights, compute=False))
+            except ValueError:
+                # Only the timings matter here, the predictions are of synthetic images anyway
+                print('No stats file next to %s, standardizing with the stats of the payloads' % args.weights)
+                stats = compute_stats([(images, np.zeros(len(images)))])
+
+        for max_batch_size in [int(b) for b in args.max_batch_sizes.split(',')]:
+            server = build_server(args.weights, stats, args.N, args.k, max_batch_size, args.max_wait_ms,
+                                  args.workers)
+            with BackgroundServer(server) as background:
+                results = asyncio.run(run_load(background.host, background.port, payloads, args.concurrency,
+                                               args.requests, args.warmup_requests))
+            reports.append(results)
+
+    print('%14s %10s %10s %14s %14s %12s %10s' % ('max batch size', 'requests/s', 'images/s', 'p50 latency ms',
+                                                  'p99 latency ms', 'mean batch', 'batch fill'))
+    for results in reports:
+        server = results['server']
+        print('%14d %10.0f %10.0f %14.2f %14.2f %12.1f %10.2f'
+              % (server['max_batch_size'], results['requests_per_sec'], results['images_per_sec'],
+                 results['client_latency_p50_ms'], results['client_latency_p99_ms'],
+                 server.get('mean_batch_size', 0.), server.get('batch_fill', 0.)))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,408 +2,220 @@
 
 import random
 import numpy as np
-import scipy.io
 import matplotlib.pyplot as plt
 import os
 
 # %matplotlib inline
 
 import keras
-from keras.models import Model
-from keras.utils import to_categorical, get_file
-from keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau, Callback
-from keras.preprocessing.image import ImageDataGenerator
+from keras.utils import get_file
+from keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
 from keras.optimizers import SGD
 import sklearn.model_selection
 
-from keras.layers import Input, Add, Activation, Dropout, Flatten, Dense
-from keras.layers.convolutional import Conv2D, MaxPooling2D, AveragePooling2D
-from keras.layers.normalization import BatchNormalization
-from keras.regularizers import l2
 from keras import backend as K
 
 # Loading the files - 1393553986B = 1.30GB
+# The .mat files are converted once into uint8 NHWC arrays and memory-mapped on later runs
 
-train_mat = keras.utils.get_file("extra_32x32.mat", "http://ufldl.stanford.edu/housenumbers/extra_32x32.mat")
-test_mat = keras.utils.get_file("test_32x32.mat", "https://s3-ap-southeast-1.amazonaws.com/deeplearning-iap-material/test_32x32.mat")
+from svhn_data import load_svhn, encode_labels
+from svhn_cache import load_preprocessed
+from svhn_shards import make_shards, ShardScheduler
+from svhn_stats import cached_stats, save_stats, stats_path
+from svhn_input import train_valid_datasets
+from svhn_augment import make_augment
 
-# Loading the files
-train_array = scipy.io.loadmat(train_mat)
-num_images = train_array["X"].shape[-1]
+# Train on the whole train + extra set (~604k images) out-of-core instead of the first 100k extra images
+# Only buffer_shards * shard_size images are held in memory at a time, whatever the size of the dataset
+full_dataset = False
+shard_size = 20000
+buffer_shards = 2
 
-# Take the first 200k labels
-list_labels = train_array["y"][:100000].reshape((num_images-431131))
-list_images = []
+# Augment the training batches of the 100k slice
+augment_training = False
 
-# Do the same for images
-for i in range(num_images-431131):
-    image = train_array["X"][:,:,:,i].reshape((32,32,3))
-    list_images.append(image)
+if full_dataset:
+    sources = [load_svhn('train'), load_svhn('extra')]
+    list_images = sources[0][0]
 
-# Formatting the images
-list_labels = np.asarray(list_labels, dtype='int32')
-list_images = np.asarray(list_images)
+else:
+    # Take the first 100k images and labels, with class indices 0-9 kept as int8 instead of a float
+    # one-hot matrix, and the featurewise mean and sd of the images as ImageDataGenerator.fit computed them
+    # The finished slice is cached under a hash of the source file and the preprocessing, so later runs
+    # memory-map it straight away - see svhn_cache.py
+    list_images, list_labels, stats = load_preprocessed('extra', stop=100000, workers=os.cpu_count())
 
-# One-hot encoding
-list_labels = to_categorical(list_labels)
-
-# Take out the extra column which one-hot encoding introduced 
-# This is because to_categorical starts from index 0 while labels start from index 1
-list_labels = np.delete(list_labels, np.s_[0], axis=1)   
-
-print(list_images.shape, list_labels.shape)
+    print(list_images.shape, list_labels.shape)
 
 # Create WRN model - https://github.com/titu1994/Wide-Residual-Networks/blob/master/wide_residual_network.py
 # Credits to Sergey Zagoruyko and Nikos Komodakis for the research and titu1994 for the implementation 
 
-weight_decay = 0.0005
-
-def initial_conv(input):
-    x = Conv2D(16, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(input)
-
-    channel_axis = 1 if K.image_data_format() == "channels_first" else -1
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-    return x
-
-
-def expand_conv(init, base, k, strides=(1, 1)):
-    x = Conv2D(base * k, (3, 3), padding='same', strides=strides, kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(init)
-
-    channel_axis = 1 if K.image_data_format() == "channels_first" else -1
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-
-    x = Conv2D(base * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
-
-    skip = Conv2D(base * k, (1, 1), padding='same', strides=strides, kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(init)
-
-    m = Add()([x, skip])
-
-    return m
-
-
-def conv1_block(input, k=1, dropout=0.0):
-    init = input
-
-    channel_axis = 1 if K.image_data_format() == "channels_first" else -1
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(input)
-    x = Activation('relu')(x)
-    x = Conv2D(16 * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
-
-    if dropout > 0.0: x = Dropout(dropout)(x)
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-    x = Conv2D(16 * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
-
-    m = Add()([init, x])
-    return m
-
-def conv2_block(input, k=1, dropout=0.0):
-    init = input
-
-    channel_axis = 1 if K.image_dim_ordering() == "th" else -1
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(input)
-    x = Activation('relu')(x)
-    x = Conv2D(32 * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
-
-    if dropout > 0.0: x = Dropout(dropout)(x)
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-    x = Conv2D(32 * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
-
-    m = Add()([init, x])
-    return m
-
-def conv3_block(input, k=1, dropout=0.0):
-    init = input
-
-    channel_axis = 1 if K.image_dim_ordering() == "th" else -1
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(input)
-    x = Activation('relu')(x)
-    x = Conv2D(64 * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
-
-    if dropout > 0.0: x = Dropout(dropout)(x)
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-    x = Conv2D(64 * k, (3, 3), padding='same', kernel_initializer='he_normal',
-                      kernel_regularizer=l2(weight_decay),
-                      use_bias=False)(x)
+from wide_resnet import create_wide_residual_network, compile_wide_residual_network
 
-    m = Add()([init, x])
-    return m
-
-def create_wide_residual_network(input_dim, nb_classes=100, N=2, k=1, dropout=0.0, verbose=1):
-
-    channel_axis = 1 if K.image_data_format() == "channels_first" else -1
-
-    ip = Input(shape=input_dim)
-
-    x = initial_conv(ip)
-    nb_conv = 4
-
-    x = expand_conv(x, 16, k)
-    nb_conv += 2
-
-    for i in range(N - 1):
-        x = conv1_block(x, k, dropout)
-        nb_conv += 2
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-
-    x = expand_conv(x, 32, k, strides=(2, 2))
-    nb_conv += 2
-
-    for i in range(N - 1):
-        x = conv2_block(x, k, dropout)
-        nb_conv += 2
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-
-    x = expand_conv(x, 64, k, strides=(2, 2))
-    nb_conv += 2
-
-    for i in range(N - 1):
-        x = conv3_block(x, k, dropout)
-        nb_conv += 2
-
-    x = BatchNormalization(axis=channel_axis, momentum=0.1, epsilon=1e-5, gamma_initializer='uniform')(x)
-    x = Activation('relu')(x)
-
-    x = AveragePooling2D((8, 8))(x)
-    x = Flatten()(x)
-
-    x = Dense(nb_classes, kernel_regularizer=l2(weight_decay), activation='softmax')(x)
-
-    model = Model(ip, x)
-
-    if verbose: print("Wide Residual Network-%d-%d created." % (nb_conv, k))
-    return model
+# Compile the training and prediction steps with XLA - see bench_xla.py for the step times with and without
+jit_compile = False
 
 # get image shape
 init = list_images[0].shape
 
 # Instantiate model
-model = create_wide_residual_network(init, nb_classes=10, N=2, k=2, dropout=0.0)
-"""
-Creates a Wide Residual Network with specified parameters
-:param input: Input Keras object
-:param nb_classes: Number of output classes
-:param N: Depth of the network. Compute N = (n - 4) / 6.
-          Example : For a depth of 16, n = 16, N = (16 - 4) / 6 = 2
-          Example2: For a depth of 28, n = 28, N = (28 - 4) / 6 = 4
-          Example3: For a depth of 40, n = 40, N = (40 - 4) / 6 = 6
-:param k: Width of the network.
-:param dropout: Adds dropout if value is greater than 0.0
-:param verbose: Debug info to describe created WRN
-:return:
-wrn_28_10
-"""
+dropout = 0.0
+model = create_wide_residual_network(init, nb_classes=10, N=2, k=2, dropout=dropout)
 
-# Instantiate optimizer
+# Instantiate optimizer - SGD with momentum, as used for the final results
 sgd = SGD(lr=0.1, momentum=0.9, nesterov=False)
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+compile_wide_residual_network(model, sgd, jit_compile=jit_compile)
 
 model.summary()
 
-# Customise ReduceLROnPlateau callback to load model weights after reducing LR 
-# Copied from source code - https://github.com/keras-team/keras/blob/master/keras/callbacks.py
-# Added code at the bottom
-
-class Custom_ReduceLROnPlateau(Callback):
-    """Reduce learning rate when a metric has stopped improving.
-    Models often benefit from reducing the learning rate by a factor
-    of 2-10 once learning stagnates. This callback monitors a
-    quantity and if no improvement is seen for a 'patience' number
-    of epochs, the learning rate is reduced.
-    # Example
-    ```python
-    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.2,
-                                  patience=5, min_lr=0.001)
-    model.fit(X_train, Y_train, callbacks=[reduce_lr])
-    ```
-    # Arguments
-        monitor: quantity to be monitored.
-        factor: factor by which the learning rate will
-            be reduced. new_lr = lr * factor
-        patience: number of epochs with no improvement
-            after which learning rate will be reduced.
-        verbose: int. 0: quiet, 1: update messages.
-        mode: one of {auto, min, max}. In `min` mode,
-            lr will be reduced when the quantity
-            monitored has stopped decreasing; in `max`
-            mode it will be reduced when the quantity
-            monitored has stopped increasing; in `auto`
-            mode, the direction is automatically inferred
-            from the name of the monitored quantity.
-        min_delta: threshold for measuring the new optimum,
-            to only focus on significant changes.
-        cooldown: number of epochs to wait before resuming
-            normal operation after lr has been reduced.
-        min_lr: lower bound on the learning rate.
-    """
-
-    def __init__(self, monitor='val_loss', factor=0.1, patience=10,
-                 verbose=0, mode='auto', min_delta=1e-4, cooldown=0, min_lr=0,
-                 **kwargs):
-        super(Custom_ReduceLROnPlateau, self).__init__()
-
-        self.monitor = monitor
-        if factor >= 1.0:
-            raise ValueError('ReduceLROnPlateau '
-                             'does not support a factor >= 1.0.')
-        if 'epsilon' in kwargs:
-            min_delta = kwargs.pop('epsilon')
-            warnings.warn('`epsilon` argument is deprecated and '
-                          'will be removed, use `min_delta` instead.')
-        self.factor = factor
-        self.min_lr = min_lr
-        self.min_delta = min_delta
-        self.patience = patience
-        self.verbose = verbose
-        self.cooldown = cooldown
-        self.cooldown_counter = 0  # Cooldown counter.
-        self.wait = 0
-        self.best = 0
-        self.mode = mode
-        self.monitor_op = None
-        self._reset()
-
-    def _reset(self):
-        """Resets wait counter and cooldown counter.
-        """
-        if self.mode not in ['auto', 'min', 'max']:
-            warnings.warn('Learning Rate Plateau Reducing mode %s is unknown, '
-                          'fallback to auto mode.' % (self.mode),
-                          RuntimeWarning)
-            self.mode = 'auto'
-        if (self.mode == 'min' or
-           (self.mode == 'auto' and 'acc' not in self.monitor)):
-            self.monitor_op = lambda a, b: np.less(a, b - self.min_delta)
-            self.best = np.Inf
-        else:
-            self.monitor_op = lambda a, b: np.greater(a, b + self.min_delta)
-            self.best = -np.Inf
-        self.cooldown_counter = 0
-        self.wait = 0
-
-    def on_train_begin(self, logs=None):
-        self._reset()
-
-    def on_epoch_end(self, epoch, logs=None):
-        logs = logs or {}
-        logs['lr'] = K.get_value(self.model.optimizer.lr)
-        current = logs.get(self.monitor)
-        if current is None:
-            warnings.warn(
-                'Reduce LR on plateau conditioned on metric `%s` '
-                'which is not available. Available metrics are: %s' %
-                (self.monitor, ','.join(list(logs.keys()))), RuntimeWarning
-            )
-
-        else:
-            if self.in_cooldown():
-                self.cooldown_counter -= 1
-                self.wait = 0
-
-            if self.monitor_op(current, self.best):
-                self.best = current
-                self.wait = 0
-            elif not self.in_cooldown():
-                self.wait += 1
-                if self.wait >= self.patience:
-                    old_lr = float(K.get_value(self.model.optimizer.lr))
-                    if old_lr > self.min_lr:
-                        new_lr = old_lr * self.factor
-                        new_lr = max(new_lr, self.min_lr)
-                        K.set_value(self.model.optimizer.lr, new_lr)
-                        
-                        # Load weights
-                        model.load_weights(checkpoint_path)
-                        
-                        if self.verbose > 0:
-                            print('\nEpoch %05d: ReduceLROnPlateau reducing '
-                                  'learning rate to %s.' % (epoch + 1, new_lr))
-                        self.cooldown_counter = self.cooldown
-                        self.wait = 0
-
-    def in_cooldown(self):
-        return self.cooldown_counter > 0
+# Customise ReduceLROnPlateau callback to restore the best model weights after reducing LR
+# The best weights are kept in memory, so nothing is read back from the checkpoint file
+
+from wrn_callbacks import Custom_ReduceLROnPlateau
 
 # Set up checkpoint path
+# Custom_ReduceLROnPlateau does not need the checkpoint file, so it is only written to keep the best weights
 checkpoint_path = 'weights.best.cnn.hdf5'
+save_checkpoints = True
 
 # Instantiate callbacks
-# custom_reducelronplateau = Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=1, min_delta=0.0001, min_lr=0)
+# custom_reducelronplateau = Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=1, min_delta=0.0001, min_lr=0, restore_optimizer=False)
 custom_reducelronplateau = ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=1, min_delta=0.0001, min_lr=0)
 
-callbacks = [EarlyStopping(monitor='val_loss', patience=4),
-             ModelCheckpoint(filepath=checkpoint_path, monitor='val_loss', save_best_only=True),
-             custom_reducelronplateau]
-
-# Instantiate ImageDataGenerator to normalize image and split dataset into train and validation sets
-train_datagen = ImageDataGenerator(featurewise_center=True, 
-                                   featurewise_std_normalization=True,
-                                   samplewise_center=False, 
-                                   samplewise_std_normalization=False, 
-                                   validation_split=0.2)
-
-# fit the generator to the dataset to calculate dataset mean and sd
-train_datagen.fit(list_images)
-
-# Point the generator to the dataset
-train_generator = train_datagen.flow(list_images, list_labels, batch_size=128, subset='training')
-valid_generator = train_datagen.flow(list_images, list_labels, batch_size=128, subset='validation')
+# Learning rate schedule - 'plateau' waits for the val_loss to stop improving as above, 'onecycle' and
+# 'cosine' (with warm restarts) fix the learning rate of every step over schedule_epochs epochs
+# swa_epochs more epochs at a constant learning rate are then averaged, and the BatchNormalization
+# statistics of the averaged weights recomputed on the training set - 0 for no averaging
+# See schedule_wrn.py for the epochs and time each schedule takes to reach 96% and 97% test accuracy
+lr_schedule = 'plateau'
+schedule_epochs = 15
+swa_epochs = 5
+
+if lr_schedule == 'plateau':
+    epochs = 100
+    callbacks = [EarlyStopping(monitor='val_loss', patience=4),
+                 custom_reducelronplateau]
+
+else:
+    from wrn_callbacks import SCHEDULES
+    epochs = schedule_epochs + swa_epochs
+    callbacks = [SCHEDULES[lr_schedule](0.1, schedule_epochs)]
+
+# Break every epoch into input, training, validation and checkpoint time, see wrn_profiler.py
+# Set profile_dir to also trace a few steps with the TF profiler for per-layer op times
+profile_training = False
+profile_dir = None
+
+if profile_training:
+    from wrn_profiler import TrainingProfiler
+    profiler = TrainingProfiler('training_profile.jsonl', batch_size=128, profile_dir=profile_dir)
+    callbacks.insert(0, profiler)
+
+if save_checkpoints:
+    checkpoint = ModelCheckpoint(filepath=checkpoint_path, monitor='val_loss', save_best_only=True)
+    callbacks.insert(1, profiler.wrap(checkpoint, 'checkpoint') if profile_training else checkpoint)
+
+# Save the whole training state (weights, optimizer, lr, epoch, callback counters, RNG and data position)
+# after every epoch on a background thread, and set resume_training to resume from it after a previous
+# run was stopped. A state saved with other settings than the ones below is refused
+from wrn_checkpoint import TrainingStateCheckpoint
+state_path = 'training_state.npz'
+resume_training = False
+
+if full_dataset:
+    # Hold out 20% of the shards for validation, the split is the same on every run
+    shards = make_shards(sources, shard_size)
+    shards = [shards[i] for i in np.random.RandomState(0).permutation(len(shards))]
+    num_valid = int(len(shards) * 0.2)
+
+    # Featurewise mean and sd of the training shards, computed in chunks and saved next to the weights
+    stats = cached_stats(checkpoint_path, 'train_extra_%d_valid%d' % (shard_size, num_valid), sources, shards[num_valid:], workers=os.cpu_count())
+    mean, std = stats.mean, stats.std
+
+    train_generator = ShardScheduler(sources, shards[num_valid:], mean, std, batch_size=128, buffer_shards=buffer_shards)
+    valid_generator = ShardScheduler(sources, shards[:num_valid], mean, std, batch_size=128, buffer_shards=buffer_shards, shuffle=False)
+
+else:
+    # Saved next to the weights, where predict_wrn.py and the other tools look for them
+    save_stats(stats_path(checkpoint_path, 'extra_0_100000'), stats)
+    mean, std = stats.mean, stats.std
+
+    # tf.data pipelines which split the dataset into train and validation sets the same way as
+    # ImageDataGenerator(validation_split=0.2), and standardize the batches in parallel ahead of the model
+    # Random shift, rotation, scale and cutout of the training batches in the background threads of
+    # tf.data, see svhn_augment.py for its cost against no augmentation
+    augment = make_augment() if augment_training else None
+    train_dataset, valid_dataset = train_valid_datasets(list_images, list_labels, mean, std,
+                                                        batch_size=128, validation_split=0.2, cache=True,
+                                                        augment=augment)
+
+# Validate on a stratified 5k subsample of the validation set every epoch, and on all of it only every
+# 5 epochs or when the subsample val_loss could be a new best, at a batch size of 1024 - see wrn_validation.py
+# The shards of the full dataset are still validated in full every epoch
+subsample_validation = False
+
+if subsample_validation and not full_dataset:
+    from wrn_validation import ValidationScheduler
+    split = int(len(list_images) * 0.2)
+    # First, so that the callbacks which monitor val_loss find it in the logs
+    callbacks.insert(0, ValidationScheduler(list_images[:split], list_labels[:split], mean, std,
+                                            subsample_size=5000, full_every=5, batch_size=1024, verbose=1))
+    valid_dataset = None
+
+if lr_schedule != 'plateau' and swa_epochs:
+    from wrn_callbacks import StochasticWeightAveraging
+    swa_data = (lambda scheduler=train_generator: scheduler.epoch_batches(0)) if full_dataset else train_dataset
+    callbacks.append(StochasticWeightAveraging(schedule_epochs, swa_data, swa_lr=0.01, verbose=1))
+
+state_config = {'data': 'train_extra_%d' % shard_size if full_dataset else 'extra_0_100000', 'N': 2, 'k': 2,
+                'dropout': dropout, 'batch_size': 128, 'buffer_shards': buffer_shards, 'jit_compile': jit_compile,
+                'lr_schedule': lr_schedule, 'schedule_epochs': schedule_epochs, 'swa_epochs': swa_epochs,
+                'epochs': epochs, 'augment': augment_training, 'subsample_validation': subsample_validation,
+                'profile': profile_training, 'save_checkpoints': save_checkpoints}
+state_checkpoint = TrainingStateCheckpoint(state_path, callbacks=callbacks,
+                                           data=[train_generator] if full_dataset else [], config=state_config)
+callbacks.append(state_checkpoint)
+initial_epoch = state_checkpoint.restore(model) if resume_training else 0
 
 # Train the model
-model_log = model.fit_generator(train_generator, 
-                        validation_data=valid_generator, 
-                        steps_per_epoch=len(train_generator), 
-                        validation_steps=len(valid_generator), 
-                        epochs=100,
-                        verbose=2,
-                        callbacks=callbacks)
+if full_dataset:
+    train_steps = len(train_generator)
+    if profile_training:
+        # Time the waits on the shard buffers. The tf.data pipeline below stays in the graph, so there
+        # the input time is part of the train phase
+        train_generator = profiler.time_input(train_generator)
+
+    model_log = model.fit_generator(train_generator, 
+                            validation_data=valid_generator, 
+                            steps_per_epoch=train_steps, 
+                            validation_steps=len(valid_generator), 
+                            epochs=epochs,
+                            initial_epoch=initial_epoch,
+                            verbose=2,
+                            callbacks=callbacks)
+
+else:
+    model_log = model.fit(train_dataset,
+                          validation_data=valid_dataset,
+                          epochs=epochs,
+                          initial_epoch=initial_epoch,
+                          verbose=2,
+                          callbacks=callbacks)
 
 # Plot graphs
 
-plt.plot(model_log.history['acc'])
-plt.plot(model_log.history['val_acc'])
+# Keras 2.3 on names the accuracy 'accuracy' in the history, older versions 'acc'
+history = model_log.history
+plt.plot(history.get('accuracy', history.get('acc')))
+plt.plot(history.get('val_accuracy', history.get('val_acc')))
 plt.title('Accuracy (Higher Better)')
 plt.ylabel('Accuracy')
 plt.xlabel('Epoch')
 plt.legend(['train', 'validation'], loc='upper left')
 plt.show()
 
-plt.plot(model_log.history['loss'])
-plt.plot(model_log.history['val_loss'])
+plt.plot(history['loss'])
+plt.plot(history['val_loss'])
 plt.title('Loss (Lower Better)')
 plt.ylabel('Loss')
 plt.xlabel('Epoch')
@@ -414,38 +226,21 @@ plt.show()
 
 from sklearn.metrics import accuracy_score
 
-test_array = scipy.io.loadmat(test_mat)
-print(test_array.keys())
+test_images, test_labels = load_svhn('test')
 
 print("Test set has the following shape:")
-test_array["X"].shape, test_array["y"].shape
+test_images.shape, test_labels.shape
 
-num_images = test_array["y"].shape[0]
+test_labels = encode_labels(test_labels)
 
-test_labels = test_array["y"].reshape((num_images))
-test_images = []
-
-for i in range(num_images):
-    image = test_array["X"][:,:,:,i].reshape((32,32,3))
-    test_images.append(image)
-    
-test_labels = np.asarray(test_labels, dtype='int32')
-test_images = np.asarray(test_images)
-
-# Preprocessing - standardization
-test_images = (test_images - train_datagen.mean) / train_datagen.std
+# Preprocessing - standardization, in float32 with the training stats
+test_images = stats.standardize(test_images)
 
 print("test_images:", test_images.shape)
 
-test_labels = to_categorical(test_labels)
-
-# Preprocessing - removal of the empty column
-test_labels = np.delete(test_labels, np.s_[0], axis=1) 
-
-test_labels_index = np.argmax(test_labels, axis=1)
 test_preds = model.predict(test_images)
 test_preds_class = np.argmax(test_preds,axis=1)
-print("Test set accuracy score:", accuracy_score(test_labels_index, test_preds_class))
+print("Test set accuracy score:", accuracy_score(test_labels, test_preds_class))
 
 
 '''
@@ -601,3 +396,5 @@ SGDm with nev: 0.9556699446834666, 62s, 38ep, 1reduced - takes 15 epoch to reach
 >100k, leads to unnoticable difference - when k increases, hopefully test acc can match the val acc
 
 Using adam optimiser, accuracy increased from 93.8 to 94.4, time per epoch dropped from 53s to 49s
+
+'''
@@ -0,0 +1,208 @@
+# Batch inference with the trained WRN
+# Scores image sets of any size in bounded memory: the images are memory-mapped and standardized
+# one chunk at a time in float32, and the predictions, accuracy and confusion matrix are written out
+# as the chunks go. Nothing from the training script is imported.
+#
+# Example:
+#   python predict_wrn.py test_32x32.mat --weights model_weights.h5 --output test_preds.npy
+#   python predict_wrn.py crops.npy --stats model_weights.extra_0_200000.stats.npz --batch-sizes 1,32,128,512
+
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+
+from svhn_data import IMAGE_SHAPE, load_svhn, open_mat, classes_to_digits
+from svhn_stats import cached_stats, load_stats, stats_path
+
+# The weights shipped with the repository come without their stats, they were trained on the first
+# 100k extra images
+DEFAULT_WEIGHTS = 'model_weights.h5'
+DEFAULT_STOP = 100000
+
+
+def open_images(path, labels_path=None):
+    """
+    Memory-maps a set of images to score
+    :param path: SVHN .mat file (converted once and then memory-mapped), or (n, 32, 32, 3) .npy file
+    :param labels_path: Optional .npy file of SVHN labels (1-10), found automatically for .mat files
+                        and for the .images.npy files they are converted into
+    :return: (images, labels) - labels are None if there are none
+    """
+    if path.endswith('.mat'):
+        return open_mat(path)
+
+    images = np.load(path, mmap_mode='r')
+    if images.shape[1:] != IMAGE_SHAPE:
+        raise ValueError('Expected images of shape (n, 32, 32, 3), got %s from %s.' % (images.shape, path))
+
+    if labels_path is None and path.endswith('.images.npy'):
+        sidecar = path[:-len('.images.npy')] + '.labels.npy'
+        if os.path.exists(sidecar):
+            labels_path = sidecar
+    labels = np.load(labels_path, mmap_mode='r') if labels_path else None
+    return images, labels
+
+
+def find_stats(weights_path, compute=True):
+    """
+    Returns the only stats file saved next to the weights
+    The shipped model_weights.h5 has none, the stats of the slice it was trained on are computed and
+    saved next to it on first use instead.
+    :param compute: Computes the missing stats of the shipped weights, which downloads the extra split
+    """
+    paths = glob.glob('%s.*.stats.npz' % glob.escape(os.path.splitext(weights_path)[0]))
+    if len(paths) == 1:
+        return paths[0]
+    key = 'extra_0_%d' % DEFAULT_STOP
+    if not paths and compute and os.path.basename(weights_path) == DEFAULT_WEIGHTS:
+        print('No stats file next to %s, computing the stats of the first %d extra images it was trained on'
+              % (weights_path, DEFAULT_STOP))
+        cached_stats(weights_path, key, [load_svhn('extra', stop=DEFAULT_STOP)], workers=os.cpu_count())
+        return stats_path(weights_path, key)
+    raise ValueError('Found %d stats files next to %s, pass the one the weights were trained with using --stats. '
+                     'Only for %s are the missing stats computed, over the first %d extra images.'
+                     % (len(paths), weights_path, DEFAULT_WEIGHTS, DEFAULT_STOP))
+
+
+def build_model(weights_path, N=2, k=2, jit_compile=False):
+    from wide_resnet import create_wide_residual_network, check_jit_compile
+
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=N, k=k, dropout=0.0, verbose=0)
+    model.load_weights(weights_path)
+    if jit_compile:
+        check_jit_compile()
+        # The prediction step is compiled with XLA, no loss or optimizer is needed for that
+        model.compile(jit_compile=True)
+    return model
+
+
+def benchmark_batch_sizes(model, images, batch_sizes, repeats=20):
+    """
+    Measures the latency and throughput of the model for each batch size
+    :param images: Standardized float32 images, batches are taken from the start of them
+    :return: List of dicts with the batch size, median and p99 latency in ms, and images per second
+    """
+    results = []
+    for batch_size in batch_sizes:
+        batch = np.resize(images, (batch_size,) + images.shape[1:])
+
+        # The first calls build the graph for this batch size
+        model.predict_on_batch(batch)
+
+        timings = []
+        for _ in range(repeats):
+            start = time.time()
+            model.predict_on_batch(batch)
+            timings.append(time.time() - start)
+
+        timings = np.asarray(timings)
+        results.append({'batch_size': batch_size,
+                        'latency_p50_ms': float(np.percentile(timings, 50) * 1000),
+                        'latency_p99_ms': float(np.percentile(timings, 99) * 1000),
+                        'images_per_sec': float(batch_size / np.median(timings))})
+    return results
+
+
+def predict(model, stats, images, labels=None, output_path=None, chunk_size=10000, batch_size=256,
+            save_probs=False, verbose=1):
+    """
+    Scores images a chunk at a time
+    :param model: Keras model
+    :param stats: RunningStats the model was trained with
+    :param images: (n, 32, 32, 3) uint8 array or memmap
+    :param labels: Optional SVHN labels (1-10), enables the accuracy and confusion matrix
+    :param output_path: .npy file the predicted digits are written to as they are computed, the class
+                        probabilities go to <output>.probs.npy if save_probs is True
+    :param chunk_size: Number of images standardized at a time, bounds the memory used
+    :param batch_size: Batch size of model.predict
+    :return: dict with the number of images, time taken, accuracy and confusion matrix (true digit x predicted digit)
+    """
+    num_images = len(images)
+    preds = probs = None
+    if output_path is not None:
+        preds = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.int8, shape=(num_images,))
+        if save_probs:
+            probs = np.lib.format.open_memmap(os.path.splitext(output_path)[0] + '.probs.npy', mode='w+',
+                                              dtype=np.float32, shape=(num_images, 10))
+
+    confusion = np.zeros((10, 10), dtype=np.int64)
+    start_time = time.time()
+    for start in range(0, num_images, chunk_size):
+        stop = min(start + chunk_size, num_images)
+        chunk_probs = model.predict(stats.standardize(images[start:stop]), batch_size=batch_size, verbose=0)
+        chunk_preds = classes_to_digits(np.argmax(chunk_probs, axis=1))
+
+        if preds is not None:
+            preds[start:stop] = chunk_preds
+        if probs is not None:
+            probs[start:stop] = chunk_probs
+
+        if labels is not None:
+            # Labels are 1-10 where 10 is the digit 0
+            true_digits = np.asarray(labels[start:stop], dtype=np.int64).reshape(-1) % 10
+            confusion += np.bincount(true_digits * 10 + chunk_preds,
+                                     minlength=100).reshape((10, 10))
+
+        if verbose:
+            message = '%d/%d images, %.0f images/sec' % (stop, num_images, stop / (time.time() - start_time))
+            if labels is not None:
+                message += ', accuracy so far: %.4f' % (np.trace(confusion) / float(confusion.sum()))
+            print(message)
+
+    for output in (preds, probs):
+        if output is not None:
+            output.flush()
+
+    results = {'num_images': num_images, 'seconds': time.time() - start_time}
+    if labels is not None:
+        results['accuracy'] = float(np.trace(confusion) / float(confusion.sum()))
+        results['confusion_matrix'] = confusion.tolist()
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Scores SVHN-style 32x32 digit crops with the trained WRN.')
+    parser.add_argument('images', help='.mat file, or .npy file of (n, 32, 32, 3) uint8 images')
+    parser.add_argument('--labels', help='.npy file of SVHN labels (1-10) of the images')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--N', type=int, default=2, help='depth of the WRN, N = (n - 4) / 6')
+    parser.add_argument('--k', type=int, default=2, help='width of the WRN')
+    parser.add_argument('--output', help='.npy file to write the predicted digits to')
+    parser.add_argument('--save-probs', action='store_true', help='also write the class probabilities')
+    parser.add_argument('--report', help='.json file to write the accuracy, confusion matrix and timings to')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--batch-sizes', help='comma-separated batch sizes to report latency and throughput for')
+    parser.add_argument('--jit-compile', action='store_true', help='compile the prediction step with XLA')
+    args = parser.parse_args(args)
+
+    images, labels = open_images(args.images, args.labels)
+    stats = load_stats(args.stats or find_stats(args.weights))
+    model = build_model(args.weights, args.N, args.k, args.jit_compile)
+
+    report = {'images': args.images, 'weights': args.weights}
+    if args.batch_sizes:
+        sample = stats.standardize(images[:max(int(b) for b in args.batch_sizes.split(','))])
+        report['batch_sizes'] = benchmark_batch_sizes(model, sample, [int(b) for b in args.batch_sizes.split(',')])
+        for result in report['batch_sizes']:
+            print('batch size %(batch_size)5d: %(latency_p50_ms)8.2f ms p50, %(latency_p99_ms)8.2f ms p99, '
+                  '%(images_per_sec)8.0f images/sec' % result)
+
+    report.update(predict(model, stats, images, labels, args.output, args.chunk_size, args.batch_size,
+                          args.save_probs))
+    if 'accuracy' in report:
+        print("Test set accuracy score:", report['accuracy'])
+        print(np.asarray(report['confusion_matrix']))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
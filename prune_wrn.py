@@ -0,0 +1,284 @@
+# Structured channel pruning of the trained WRN
+# Removes whole filters from the convolutions and rebuilds a physically smaller model, so the dense
+# convolutions get cheaper on CPU, unlike sparse weight masks. Channels are pruned by group: the
+# channels of every convolution inside a block form a group, and all the convolutions which are
+# summed by the residual Add layers of a stage (the expand_conv and skip convs and the last conv of
+# every block) form one group too, as the channels of the sum must line up. Within a group, channels
+# are ranked by the L1 norm of their filters or by the |gamma| of the BatchNormalizations reading them.
+# Every pruned model is fine-tuned briefly, and the FLOPs, parameters, latency and test accuracy of
+# each pruning ratio make a tradeoff curve.
+#
+# Example:
+#   python prune_wrn.py --ratios 0.25,0.5,0.75 --criterion bn --finetune-epochs 3 --report pruning.json --plot pruning.png
+
+import argparse
+import json
+import numpy as np
+
+from keras import backend as K
+from keras.models import Model
+
+from fold_bn import INFERENCE_IDENTITY, _inbound
+
+# Layers which keep the channels of their input
+CHANNELWISE = ('BatchNormalization', 'Activation', 'ReLU', 'AveragePooling2D', 'MaxPooling2D',
+               'GlobalAveragePooling2D') + INFERENCE_IDENTITY
+
+CRITERIA = ('l1', 'bn')
+
+# 'all' prunes every group, 'internal' leaves the residual streams of the stages whole
+SCOPES = ('all', 'internal')
+
+
+def find_channel_groups(model):
+    """
+    Finds the groups of channels which have to be pruned together
+    :param model: Keras functional model
+    :return: (groups, input_group, positions) - groups maps the group name to a dict with the Conv2D
+             'producers' of its channels, the 'bn' layers reading them, 'residual' if it goes through
+             an Add, and 'prunable'. input_group maps every layer to the group of its input, and
+             positions to the number of spatial positions a Flatten spread these channels over.
+    """
+    config = model.get_config()
+    parent = {}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    output_group = {}
+    input_group = {}
+    positions = {}
+    input_positions = {}
+    residual = set()
+    for layer in config['layers']:
+        name, class_name = layer['name'], layer['class_name']
+        inputs = [entry[0] for entry in _inbound(layer)]
+        if inputs:
+            input_group[name] = output_group[inputs[0]]
+            input_positions[name] = positions[inputs[0]]
+            positions[name] = positions[inputs[0]]
+
+        if class_name in ('InputLayer', 'Conv2D', 'Dense'):
+            parent[name] = name
+            output_group[name] = name
+            positions[name] = 1
+        elif class_name == 'Add':
+            for other in inputs[1:]:
+                parent[find(output_group[other])] = find(output_group[inputs[0]])
+            output_group[name] = output_group[inputs[0]]
+            residual.add(output_group[inputs[0]])
+        elif class_name in CHANNELWISE:
+            output_group[name] = output_group[inputs[0]]
+        elif class_name == 'Flatten':
+            output_group[name] = output_group[inputs[0]]
+            positions[name] = int(np.prod(K.int_shape(model.get_layer(inputs[0]).output)[1:-1]))
+        else:
+            raise ValueError('Cannot prune through the %s layer %s.' % (class_name, name))
+
+    output_group = dict((name, find(group)) for name, group in output_group.items())
+    input_group = dict((name, find(group)) for name, group in input_group.items())
+    residual = set(find(group) for group in residual)
+
+    groups = {}
+    for layer in config['layers']:
+        name, class_name = layer['name'], layer['class_name']
+        group = groups.setdefault(output_group[name], {'producers': [], 'bn': [], 'prunable': True})
+        if class_name == 'Conv2D':
+            group['producers'].append(name)
+        elif class_name in ('InputLayer', 'Dense'):
+            # The input channels and the classes stay
+            group['prunable'] = False
+        elif class_name == 'BatchNormalization':
+            group['bn'].append(name)
+    for name, group in groups.items():
+        group['residual'] = name in residual
+    return groups, input_group, input_positions
+
+
+def channel_scores(model, group, criterion='l1'):
+    """Scores the channels of a group, the lowest scores are pruned first."""
+    if criterion == 'bn':
+        gammas = [np.abs(K.get_value(model.get_layer(name).gamma)) for name in group['bn']
+                  if model.get_layer(name).scale]
+        if gammas:
+            return np.sum(gammas, axis=0)
+
+    # L1 norm of the filters, scaled per convolution so that every producer counts the same
+    scores = 0.
+    for name in group['producers']:
+        norms = np.abs(model.get_layer(name).get_weights()[0]).sum(axis=(0, 1, 2))
+        scores = scores + norms / (norms.mean() + 1e-12)
+    return scores
+
+
+def prune_model(model, ratio, criterion='l1', scope='all'):
+    """
+    Builds a smaller copy of a model with a fraction of the channels of every group removed
+    :param model: Trained Keras functional model, e.g. from create_wide_residual_network
+    :param ratio: Fraction of the channels of every group to remove
+    :param criterion: One of CRITERIA
+    :param scope: One of SCOPES
+    :return: New Keras model with the weights of the kept channels
+    """
+    if criterion not in CRITERIA:
+        raise ValueError('criterion must be one of %s, got %s.' % (', '.join(CRITERIA), criterion))
+    if scope not in SCOPES:
+        raise ValueError('scope must be one of %s, got %s.' % (', '.join(SCOPES), scope))
+
+    groups, input_group, positions = find_channel_groups(model)
+    keep = {}
+    for name, group in groups.items():
+        if not group['prunable'] or not group['producers'] or (scope == 'internal' and group['residual']):
+            continue
+        scores = channel_scores(model, group, criterion)
+        num_keep = max(1, int(round(len(scores) * (1. - ratio))))
+        keep[name] = np.sort(np.argsort(-scores, kind='stable')[:num_keep])
+
+    config = model.get_config()
+    owner = {}
+    for name, group in groups.items():
+        for producer in group['producers']:
+            owner[producer] = name
+    for layer in config['layers']:
+        if layer['class_name'] == 'Conv2D' and owner[layer['name']] in keep:
+            layer['config']['filters'] = len(keep[owner[layer['name']]])
+    pruned = Model.from_config(config)
+
+    def input_index(name):
+        index = keep.get(input_group[name])
+        if index is None or positions[name] == 1:
+            return index
+        # Flatten lays the channels out position by position
+        channels = K.int_shape(model.get_layer(name).input)[-1] // positions[name]
+        return (np.arange(positions[name])[:, None] * channels + index[None, :]).reshape(-1)
+
+    for layer in pruned.layers:
+        weights = model.get_layer(layer.name).get_weights()
+        class_name = layer.__class__.__name__
+        if class_name in ('Conv2D', 'Dense'):
+            index = input_index(layer.name)
+            if index is not None:
+                weights[0] = np.take(weights[0], index, axis=-2)
+            index = keep.get(owner.get(layer.name))
+            if index is not None:
+                weights = [np.take(w, index, axis=-1) for w in weights]
+        elif class_name == 'BatchNormalization':
+            index = keep.get(input_group[layer.name])
+            if index is not None:
+                weights = [w[index] for w in weights]
+        layer.set_weights(weights)
+    return pruned
+
+
+def count_flops(model):
+    """Multiply-adds of the Conv2D and Dense layers for one image, counted twice as in FLOPs."""
+    flops = 0
+    for layer in model.layers:
+        class_name = layer.__class__.__name__
+        if class_name == 'Conv2D':
+            kernel = layer.get_weights()[0]
+            output_shape = K.int_shape(layer.output)
+            flops += 2 * int(np.prod(kernel.shape)) * output_shape[1] * output_shape[2]
+        elif class_name == 'Dense':
+            flops += 2 * int(np.prod(layer.get_weights()[0].shape))
+    return flops
+
+
+def main(args=None):
+    from keras.callbacks import EarlyStopping
+    from keras.optimizers import SGD
+
+    from svhn_data import load_svhn
+    from svhn_cache import load_preprocessed
+    from svhn_stats import load_stats
+    from svhn_input import train_valid_datasets
+    from wide_resnet import compile_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau
+    from predict_wrn import open_images, find_stats, build_model, benchmark_batch_sizes, predict
+
+    parser = argparse.ArgumentParser(description='Prunes channels of the trained WRN and fine-tunes the smaller models.')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--ratios', default='0.25,0.5,0.75', help='comma-separated fractions of channels to remove')
+    parser.add_argument('--criterion', default='l1', choices=CRITERIA)
+    parser.add_argument('--scope', default='all', choices=SCOPES)
+    parser.add_argument('--stop', type=int, default=100000, help='number of extra images to fine-tune on')
+    parser.add_argument('--finetune-epochs', type=int, default=3)
+    parser.add_argument('--lr', type=float, default=0.01, help='learning rate of the fine-tuning')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--test', help='.mat or .npy test images, defaults to the SVHN test split')
+    parser.add_argument('--batch-sizes', default='1,128')
+    parser.add_argument('--output-prefix', default='model_pruned', help='pruned models are saved as <prefix>_<ratio>.h5')
+    parser.add_argument('--report', default='pruning_report.json')
+    parser.add_argument('--plot', help='.png file to plot the tradeoff curve to')
+    args = parser.parse_args(args)
+
+    stats = load_stats(args.stats or find_stats(args.weights))
+    model = build_model(args.weights, args.N, args.k)
+
+    images, labels, _ = load_preprocessed('extra', stop=args.stop)
+    train_dataset, valid_dataset = train_valid_datasets(images, labels, stats.mean, stats.std,
+                                                        batch_size=args.batch_size, cache=True)
+    if args.test:
+        test_images, test_labels = open_images(args.test)
+    else:
+        test_images, test_labels = load_svhn('test')
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    sample = stats.standardize(test_images[:max(batch_sizes)])
+
+    curve = []
+    for ratio in [0.] + [float(r) for r in args.ratios.split(',')]:
+        if ratio:
+            pruned = prune_model(model, ratio, args.criterion, args.scope)
+            compile_wide_residual_network(pruned, SGD(lr=args.lr, momentum=0.9, nesterov=False))
+            pruned.fit(train_dataset, validation_data=valid_dataset, epochs=args.finetune_epochs, verbose=2,
+                       callbacks=[EarlyStopping(monitor='val_loss', patience=2),
+                                  Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=1,
+                                                           min_delta=0.0001, min_lr=0)])
+            pruned.save('%s_%.2f.h5' % (args.output_prefix, ratio))
+        else:
+            pruned = model
+
+        print('Scoring the model pruned by %.2f' % ratio)
+        point = predict(pruned, stats, test_images, test_labels, verbose=0)
+        point.pop('confusion_matrix', None)
+        point.update(ratio=ratio, params=pruned.count_params(), flops=count_flops(pruned),
+                     batch_sizes=benchmark_batch_sizes(pruned, sample, batch_sizes))
+        curve.append(point)
+
+    print('%6s %10s %12s %10s %s' % ('ratio', 'params', 'MFLOPs', 'accuracy',
+                                     ' '.join('%14s' % ('bs%d p50 ms' % b) for b in batch_sizes)))
+    for point in curve:
+        print('%6.2f %10d %12.1f %10.4f %s' % (point['ratio'], point['params'], point['flops'] / 1e6,
+                                               point.get('accuracy', float('nan')),
+                                               ' '.join('%14.2f' % r['latency_p50_ms'] for r in point['batch_sizes'])))
+
+    with open(args.report, 'w') as f:
+        json.dump({'criterion': args.criterion, 'scope': args.scope, 'curve': curve}, f, indent=2)
+
+    if args.plot and 'accuracy' in curve[0]:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 4))
+        accuracy = [point['accuracy'] for point in curve]
+        ax1.plot([point['flops'] / 1e6 for point in curve], accuracy, 'o-')
+        ax1.set_xlabel('MFLOPs per image')
+        ax1.set_ylabel('Test accuracy')
+        ax2.plot([point['batch_sizes'][-1]['latency_p50_ms'] for point in curve], accuracy, 'o-')
+        ax2.set_xlabel('p50 latency (ms), batch size %d' % batch_sizes[-1])
+        for point in curve:
+            ax1.annotate('%.2f' % point['ratio'], (point['flops'] / 1e6, point['accuracy']))
+        fig.suptitle('Channel pruning (%s, %s)' % (args.criterion, args.scope))
+        fig.savefig(args.plot)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Post-training int8 quantization of the trained WRN
+# Converts the Keras model into a TFLite model with int8 weights and activations, calibrated on a
+# slice of the SVHN training images, then scores both models on the test set and reports their
+# accuracy, size and per-batch CPU latency side by side.
+#
+# Example:
+#   python quantize_wrn.py --weights model_weights.h5 --test test_32x32.mat --output model_int8.tflite
+
+import argparse
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from svhn_data import load_svhn
+from svhn_stats import load_stats
+from predict_wrn import DEFAULT_STOP, open_images, find_stats, build_model, benchmark_batch_sizes, predict
+
+
+def representative_dataset(images, stats, num_images=500, seed=0):
+    """
+    Returns the calibration data generator TFLiteConverter.representative_dataset expects
+    :param images: (n, 32, 32, 3) uint8 training images, e.g. a memory-mapped slice of the extra set
+    :param stats: RunningStats the model was trained with
+    :param num_images: Number of images the activation ranges are calibrated on
+    """
+    index = np.sort(np.random.RandomState(seed).choice(len(images), min(num_images, len(images)), replace=False))
+
+    def generator():
+        for i in index:
+            yield [stats.standardize(images[i:i + 1])]
+    return generator
+
+
+def quantize(model, representative_data):
+    """
+    Converts a Keras model into a fully int8 quantized TFLite model
+    The input and output stay float32, so the model is a drop-in replacement for the Keras one.
+    :return: The TFLite flatbuffer as bytes
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_data
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+class TFLitePredictor(object):
+    """Runs a TFLite model with the predict / predict_on_batch interface of a Keras model.
+
+    # Arguments
+        model_content: TFLite flatbuffer as bytes.
+        num_threads: number of CPU threads the interpreter uses.
+    """
+
+    def __init__(self, model_content, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def predict_on_batch(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if len(x) != self.batch_size:
+            # Reallocating is only needed when the batch size changes
+            self.interpreter.resize_tensor_input(self.input_index, x.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(x)
+        self.interpreter.set_tensor(self.input_index, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+    def predict(self, x, batch_size=256, verbose=0):
+        return np.concatenate([self.predict_on_batch(x[start:start + batch_size])
+                               for start in range(0, len(x), batch_size)])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Exports the trained WRN as an int8 TFLite model.')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--calibration-split', default='extra', help='SVHN split the calibration images are taken from')
+    parser.add_argument('--calibration-stop', type=int, default=DEFAULT_STOP,
+                        help='calibrate on the images of the split before this index, by default the slice the '
+                             'shipped weights were trained on, 0 for the whole split')
+    parser.add_argument('--calibration-images', type=int, default=500)
+    parser.add_argument('--test', help='.mat or .npy test images, defaults to the SVHN test split')
+    parser.add_argument('--output', default='model_int8.tflite')
+    parser.add_argument('--report', default='quantization_report.json')
+    parser.add_argument('--batch-sizes', default='1,32,128,512')
+    parser.add_argument('--num-threads', type=int)
+    args = parser.parse_args(args)
+
+    stats = load_stats(args.stats or find_stats(args.weights))
+    model = build_model(args.weights, args.N, args.k)
+
+    # Calibrate on the slice of the training set the model was trained on. The split is memory-mapped, so
+    # only the sampled calibration images are read
+    calibration_images, _ = load_svhn(args.calibration_split, stop=args.calibration_stop or None)
+    tflite_model = quantize(model, representative_dataset(calibration_images, stats, args.calibration_images))
+    with open(args.output, 'wb') as f:
+        f.write(tflite_model)
+
+    if args.test:
+        test_images, test_labels = open_images(args.test)
+    else:
+        test_images, test_labels = load_svhn('test')
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    sample = stats.standardize(test_images[:max(batch_sizes)])
+
+    report = {}
+    for name, scorer, path in [('float32', model, args.weights),
+                               ('int8', TFLitePredictor(tflite_model, args.num_threads), args.output)]:
+        print('Scoring the %s model' % name)
+        results = predict(scorer, stats, test_images, test_labels, verbose=0)
+        results['size_bytes'] = os.path.getsize(path)
+        results['batch_sizes'] = benchmark_batch_sizes(scorer, sample, batch_sizes)
+        report[name] = results
+
+    print('%-8s %10s %12s' % ('model', 'accuracy', 'size (KB)'))
+    for name in ('float32', 'int8'):
+        print('%-8s %10.4f %12.0f' % (name, report[name].get('accuracy', float('nan')), report[name]['size_bytes'] / 1024.))
+
+    print('%-8s %10s %14s %14s' % ('model', 'batch size', 'p50 latency ms', 'images/sec'))
+    for name in ('float32', 'int8'):
+        for result in report[name]['batch_sizes']:
+            print('%-8s %10d %14.2f %14.0f' % (name, result['batch_size'], result['latency_p50_ms'], result['images_per_sec']))
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# Time to test accuracy of the learning rate schedules
+# The plateau recipe of model_3_wide_resnet.py (ReduceLROnPlateau with patience 2 and EarlyStopping with
+# patience 4) took 22-44 epochs in the notes, a good part of them spent waiting for plateaus. This trains
+# the same WRN from the same initial weights with every schedule and records the epoch and training time
+# at which the test accuracy first reaches each target:
+#   - plateau, the baseline recipe
+#   - onecycle, one-cycle over --epochs epochs
+#   - cosine, cosine annealing with 3 warm restarts over --epochs epochs
+# followed for the fixed schedules by --swa-epochs epochs of stochastic weight averaging at --swa-lr,
+# whose averaged weights get their BatchNormalization statistics recomputed on the training set.
+# The test set is scored after every epoch, its time is left out of the training time.
+#
+# Example:
+#   python schedule_wrn.py --schedules plateau,onecycle,cosine --epochs 15 --swa-epochs 5 --targets 0.96,0.97
+
+import argparse
+import json
+import time
+import numpy as np
+
+from keras.callbacks import Callback
+
+
+class TimeToAccuracy(Callback):
+    """Scores the test set after every epoch and records when each target accuracy is first reached.
+
+    # Arguments
+        images: standardized test images.
+        labels: class indices of the test images.
+        targets: test accuracies to time.
+        batch_size: batch size of the predictions.
+    """
+
+    def __init__(self, images, labels, targets, batch_size=512):
+        super(TimeToAccuracy, self).__init__()
+        self.images = images
+        self.labels = labels
+        self.targets = sorted(targets)
+        self.batch_size = batch_size
+        self.reached = {}
+        self.history = []
+
+    def score(self):
+        preds = self.model.predict(self.images, batch_size=self.batch_size, verbose=0)
+        return float(np.mean(np.argmax(preds, axis=1) == self.labels))
+
+    def train_time(self):
+        """Training time so far, without the time spent scoring the test set."""
+        return time.time() - self.start - self.scoring
+
+    def record(self, epochs, accuracy):
+        self.history.append({'epochs': epochs, 'train_sec': self.train_time(), 'test_accuracy': accuracy})
+        for target in self.targets:
+            if accuracy >= target and target not in self.reached:
+                self.reached[target] = {'epochs': epochs, 'train_sec': self.train_time()}
+
+    def on_train_begin(self, logs=None):
+        self.start = time.time()
+        self.scoring = 0.
+        self.reached = {}
+        self.history = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        start = time.time()
+        accuracy = self.score()
+        self.scoring += time.time() - start
+        self.record(epoch + 1, accuracy)
+        if logs is not None:
+            logs['test_accuracy'] = accuracy
+
+
+def run_schedule(name, args, weights, train_dataset, valid_dataset, test_images, test_labels):
+    """Trains the WRN from the given initial weights with one schedule, returns its results as a dict."""
+    from keras.callbacks import EarlyStopping
+    from keras.optimizers import SGD
+
+    from svhn_data import IMAGE_SHAPE
+    from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau, StochasticWeightAveraging, SCHEDULES
+
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=args.N, k=args.k, dropout=0.0, verbose=0)
+    model.set_weights(weights)
+    compile_wide_residual_network(model, SGD(lr=args.lr, momentum=0.9, nesterov=False))
+
+    timer = TimeToAccuracy(test_images, test_labels, [float(t) for t in args.targets.split(',')])
+    swa = None
+    if name == 'plateau':
+        epochs = args.max_epochs
+        callbacks = [timer, EarlyStopping(monitor='val_loss', patience=4),
+                     Custom_ReduceLROnPlateau(monitor='val_loss', factor=0.1, patience=2, verbose=1,
+                                              min_delta=0.0001, min_lr=0)]
+    else:
+        epochs = args.epochs + args.swa_epochs
+        callbacks = [timer, SCHEDULES[name](args.lr, args.epochs)]
+        if args.swa_epochs:
+            swa = StochasticWeightAveraging(args.epochs, train_dataset, swa_lr=args.swa_lr, verbose=1)
+            # After the timer, so that it scores the last epoch before the weights are averaged
+            callbacks.append(swa)
+
+    log = model.fit(train_dataset, validation_data=valid_dataset, epochs=epochs, verbose=2, callbacks=callbacks)
+    results = {'schedule': name, 'epochs': len(log.history['loss'])}
+    if swa is not None and swa.swa_count:
+        # The averaged weights were set and recalibrated at the end of training
+        results['swa_averaged'] = swa.swa_count
+        timer.record(results['epochs'], timer.score())
+    results['train_sec'] = timer.train_time()
+    results['test_accuracy'] = timer.history[-1]['test_accuracy']
+    results['best_test_accuracy'] = max(h['test_accuracy'] for h in timer.history)
+    results['history'] = timer.history
+    for target in timer.targets:
+        reached = timer.reached.get(target)
+        results['epochs_to_%g' % target] = reached['epochs'] if reached else None
+        results['time_to_%g_sec' % target] = reached['train_sec'] if reached else None
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compares the time to test accuracy of learning rate schedules.')
+    parser.add_argument('--schedules', default='plateau,onecycle,cosine',
+                        help="comma-separated schedules among 'plateau', 'onecycle' and 'cosine'")
+    parser.add_argument('--epochs', type=int, default=15, help='epochs of the fixed schedules')
+    parser.add_argument('--swa-epochs', type=int, default=5, help='averaged epochs after the fixed schedules, 0 for no SWA')
+    parser.add_argument('--swa-lr', type=float, default=0.01)
+    parser.add_argument('--max-epochs', type=int, default=100, help='maximum epochs of the plateau baseline')
+    parser.add_argument('--lr', type=float, default=0.1, help='initial learning rate, the peak of the fixed schedules')
+    parser.add_argument('--targets', default='0.96,0.97', help='test accuracies to time')
+    parser.add_argument('--stop', type=int, default=100000, help='number of extra images to train on')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--synthetic', action='store_true', help='train and test on synthetic images instead of SVHN')
+    parser.add_argument('--report', default='schedule_report.json')
+    args = parser.parse_args(args)
+
+    import tensorflow as tf
+    from svhn_data import IMAGE_SHAPE, load_svhn, encode_labels
+    from svhn_stats import compute_stats
+    from svhn_input import train_valid_datasets
+    from wide_resnet import create_wide_residual_network
+
+    np.random.seed(args.seed)
+    tf.random.set_seed(args.seed)
+    if args.synthetic:
+        from benchmark_wrn import synthetic_svhn
+        images, labels = synthetic_svhn(args.stop, args.seed)
+        stats = compute_stats([(images, labels)])
+        labels = encode_labels(labels)
+        test_images, test_labels = synthetic_svhn(max(args.stop // 4, 1), args.seed + 1)
+    else:
+        from svhn_cache import load_preprocessed
+        images, labels, stats = load_preprocessed('extra', stop=args.stop)
+        test_images, test_labels = load_svhn('test')
+    test_images = stats.standardize(test_images)
+    test_labels = encode_labels(test_labels)
+
+    train_dataset, valid_dataset = train_valid_datasets(images, labels, stats.mean, stats.std,
+                                                        batch_size=args.batch_size, validation_split=0.2,
+                                                        cache=True, seed=args.seed)
+
+    # Every schedule starts from the same weights
+    weights = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=args.N, k=args.k, verbose=0).get_weights()
+
+    report = {'config': vars(args), 'results': []}
+    for name in args.schedules.split(','):
+        print('Training with the %s schedule' % name)
+        report['results'].append(run_schedule(name, args, weights, train_dataset, valid_dataset,
+                                               test_images, test_labels))
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    targets = sorted(float(t) for t in args.targets.split(','))
+    baseline = next((r for r in report['results'] if r['schedule'] == 'plateau'), None)
+    header = '%-10s %7s %10s %9s' % ('schedule', 'epochs', 'train sec', 'test acc')
+    for target in targets:
+        header += ' %14s %9s' % ('epochs to %g' % target, 'sec')
+    print(header)
+    for result in report['results']:
+        line = '%-10s %7d %10.0f %9.4f' % (result['schedule'], result['epochs'], result['train_sec'],
+                                          result['test_accuracy'])
+        for target in targets:
+            epochs, seconds = result['epochs_to_%g' % target], result['time_to_%g_sec' % target]
+            if epochs is None:
+                line += ' %14s %9s' % ('-', '-')
+                continue
+            line += ' %14d %9.0f' % (epochs, seconds)
+            if baseline is not None and result is not baseline and baseline['time_to_%g_sec' % target]:
+                result['speedup_to_%g' % target] = baseline['time_to_%g_sec' % target] / seconds
+                line += ' (x%.2f)' % result['speedup_to_%g' % target]
+        print(line)
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
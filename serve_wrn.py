@@ -0,0 +1,337 @@
+# Micro-batching prediction server for the trained WRN
+# Classifying house-number crops one request at a time leaves the convolutions nearly idle, as a batch
+# of 64 takes little longer than a batch of 1. This asyncio HTTP server queues the concurrent requests
+# and runs them through the model together:
+#   - a batch is closed when it holds max_batch_size images, or max_wait_ms after its first request
+#     arrived, whichever comes first
+#   - the batches run in a pool of inference threads, so the event loop keeps accepting and batching
+#     requests while the model works, and a batch only starts collecting once a thread is free for it
+#   - request latency, queue wait, inference time and batch fill are kept over the last requests
+#
+# Endpoints:
+#   POST /predict   body of one or more 32x32x3 uint8 images (raw bytes, NHWC), answers with
+#                   {"digits": [...], "confidence": [...]}
+#   GET  /metrics   p50 / p99 latencies in ms, batch sizes and fill, counters - /metrics?reset=1 clears them
+#   GET  /health
+#
+# Example:
+#   python serve_wrn.py --weights model_weights.h5 --port 8500 --max-batch-size 64 --max-wait-ms 5
+#   python loadgen_wrn.py --url localhost:8500 --concurrency 64
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from svhn_data import IMAGE_SHAPE, classes_to_digits
+
+IMAGE_BYTES = int(np.prod(IMAGE_SHAPE))
+
+# Number of recent requests and batches the percentiles are computed over
+METRICS_WINDOW = 10000
+
+
+class ServerMetrics(object):
+    """Counters and sliding windows of the timings of the last requests and batches."""
+
+    def __init__(self, max_batch_size, window=METRICS_WINDOW):
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.requests = 0
+        self.images = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=self.window)
+        self.queue_waits = collections.deque(maxlen=self.window)
+        self.inference_times = collections.deque(maxlen=self.window)
+        self.batch_sizes = collections.deque(maxlen=self.window)
+
+    def record_batch(self, size, queue_waits, inference_time):
+        self.batches += 1
+        self.batch_sizes.append(size)
+        self.queue_waits.extend(queue_waits)
+        self.inference_times.append(inference_time)
+
+    def record_request(self, num_images, latency):
+        self.requests += 1
+        self.images += num_images
+        self.latencies.append(latency)
+
+    def snapshot(self):
+        def percentiles(name, values):
+            if not values:
+                return {}
+            values = np.asarray(values) * 1000
+            return {name + '_p50_ms': float(np.percentile(values, 50)),
+                    name + '_p99_ms': float(np.percentile(values, 99))}
+
+        elapsed = time.time() - self.start
+        result = {'requests': self.requests, 'images': self.images, 'batches': self.batches,
+                  'errors': self.errors, 'seconds': elapsed,
+                  'requests_per_sec': self.requests / elapsed if elapsed else 0.,
+                  'max_batch_size': self.max_batch_size}
+        result.update(percentiles('latency', self.latencies))
+        result.update(percentiles('queue_wait', self.queue_waits))
+        result.update(percentiles('inference', self.inference_times))
+        if self.batch_sizes:
+            sizes = np.asarray(self.batch_sizes, dtype=np.float64)
+            result['mean_batch_size'] = float(sizes.mean())
+            # Fraction of the batch capacity used, 1 when every batch is full
+            result['batch_fill'] = float(np.mean(np.minimum(sizes / self.max_batch_size, 1.)))
+        return result
+
+
+def make_predict(model, stats):
+    """
+    Returns a thread-safe function taking (n, 32, 32, 3) uint8 images to their (n, 10) class probabilities
+    The model runs in inference mode in one graph traced for any batch size, so batches of
+    different sizes from different threads never retrace it.
+    """
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec((None,) + IMAGE_SHAPE, tf.float32)])
+    def infer(x):
+        return model(x, training=False)
+
+    def predict(images):
+        return infer(stats.standardize(images)).numpy()
+
+    # Trace the graph before the first request, tracing is not thread-safe
+    predict(np.zeros((1,) + IMAGE_SHAPE, dtype=np.uint8))
+    return predict
+
+
+class MicroBatcher(object):
+    """Groups concurrent requests into batches which run in a pool of inference threads.
+
+    # Arguments
+        predict: function taking a batch of images to their predictions, e.g. from make_predict.
+        max_batch_size: largest number of images of a batch. A request with more
+            images than that runs as a batch of its own.
+        max_wait_ms: longest time a batch waits for more requests after its first one arrived.
+        workers: number of inference threads, and of batches running at the same time.
+        metrics: ServerMetrics the batches are recorded in.
+    """
+
+    def __init__(self, predict, max_batch_size=64, max_wait_ms=5., workers=2, metrics=None):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.workers = workers
+        self.metrics = metrics or ServerMetrics(max_batch_size)
+        self._queue = None
+        self._task = None
+        self._executor = None
+        # The event loop only keeps weak references to tasks, the running batches are held here
+        self._tasks = set()
+
+    def start(self):
+        """Starts collecting batches, call it from the event loop."""
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='inference')
+        self._task = asyncio.ensure_future(self._collect())
+
+    async def stop(self):
+        """Stops collecting batches, and waits for the running ones to answer their requests."""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, images):
+        """Queues (n, 32, 32, 3) uint8 images and waits for their predictions."""
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((images, future, time.time()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_event_loop()
+        pending = None
+        while True:
+            # A batch only starts once a thread is free to run it, the requests queue up meanwhile
+            await self._slots.acquire()
+            first = pending if pending is not None else await self._queue.get()
+            pending = None
+            batch, size = [first], len(first[0])
+            deadline = first[2] + self.max_wait
+
+            while size < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if size + len(item[0]) > self.max_batch_size:
+                    pending = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            task = loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        loop = asyncio.get_event_loop()
+        try:
+            start = time.time()
+            images = np.concatenate([images for images, _, _ in batch]) if len(batch) > 1 else batch[0][0]
+            try:
+                outputs = await loop.run_in_executor(self._executor, self.predict, images)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.metrics.record_batch(len(images), [start - arrival for _, _, arrival in batch],
+                                      time.time() - start)
+
+            offset = 0
+            for item_images, future, _ in batch:
+                if not future.done():
+                    future.set_result(outputs[offset:offset + len(item_images)])
+                offset += len(item_images)
+        finally:
+            self._slots.release()
+
+
+class PredictionServer(object):
+    """HTTP/1.1 server with keep-alive connections answering predictions from a MicroBatcher.
+
+    # Arguments
+        batcher: MicroBatcher the images of the requests are predicted by.
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.metrics = batcher.metrics
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8500):
+        """Starts listening, returns the port, e.g. the one picked for port 0."""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def _route(self, method, path, body):
+        path, _, query = path.partition('?')
+        if path == '/predict' and method == 'POST':
+            if not body or len(body) % IMAGE_BYTES:
+                return 400, {'error': 'the body must hold n * %d bytes of 32x32x3 uint8 images' % IMAGE_BYTES}
+            images = np.frombuffer(body, dtype=np.uint8).reshape((-1,) + IMAGE_SHAPE)
+            start = time.time()
+            probs = await self.batcher.submit(images)
+            self.metrics.record_request(len(images), time.time() - start)
+            return 200, {'digits': classes_to_digits(np.argmax(probs, axis=1)).tolist(),
+                         'confidence': np.max(probs, axis=1).round(6).tolist()}
+        if path == '/metrics' and method == 'GET':
+            result = self.metrics.snapshot()
+            if 'reset=1' in query.split('&'):
+                self.metrics.reset()
+            return 200, result
+        if path == '/health' and method == 'GET':
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'unknown endpoint %s %s' % (method, path)}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, result = await self._route(method, path, body)
+                except Exception as e:
+                    self.metrics.errors += 1
+                    status, result = 500, {'error': str(e)}
+                payload = json.dumps(result).encode()
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                             % (status, b'OK' if status == 200 else b'Error', len(payload)) + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def build_server(weights_path='model_weights.h5', stats=None, N=2, k=2, max_batch_size=64, max_wait_ms=5.,
+                 workers=2):
+    """
+    Loads the WRN and wraps it in a PredictionServer
+    :param stats: RunningStats the weights were trained with, defaults to the stats file saved next to them
+    """
+    from predict_wrn import build_model, find_stats
+    from svhn_stats import load_stats
+
+    if stats is None:
+        stats = load_stats(find_stats(weights_path))
+    predict = make_predict(build_model(weights_path, N, k), stats)
+    return PredictionServer(MicroBatcher(predict, max_batch_size, max_wait_ms, workers))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serves WRN digit predictions over HTTP, in micro-batches.')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--workers', type=int, default=2, help='inference threads')
+    args = parser.parse_args(args)
+
+    from svhn_stats import load_stats
+
+    stats = load_stats(args.stats) if args.stats else None
+    server = build_server(args.weights, stats, args.N, args.k, args.max_batch_size, args.max_wait_ms, args.workers)
+
+    async def serve():
+        port = await server.start(args.host, args.port)
+        print('Serving %s on http://%s:%d, batches of up to %d images or %g ms'
+              % (args.weights, args.host, port, args.max_batch_size, args.max_wait_ms))
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
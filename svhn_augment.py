@@ -0,0 +1,123 @@
+# Batch augmentation of the SVHN digits
+# ImageDataGenerator augmented one image at a time in Python, which made augmentation too slow to
+# use. Here every transform works on a whole batch at once with TF ops, as a map stage of the tf.data
+# pipeline, so it runs in the background threads of tf.data while the model trains on earlier batches.
+#   - random shift, small rotation and scale, as a single per-image affine transform, the pixels
+#     shifted in from outside the image are filled with the nearest edge pixels
+#   - cutout, a random square of every image set to the mean (0 after standardization)
+# There is no flip, as flipped digits are other digits or no digit at all.
+
+import math
+import tensorflow as tf
+
+
+def affine_transforms(batch_size, height, width, max_shift=4, max_rotation=10., max_scale=0.1):
+    """
+    Draws one random shift, rotation and scale per image
+    :return: (batch_size, 8) projective transforms mapping output to input coordinates, as
+             ImageProjectiveTransformV3 takes them
+    """
+    shift = tf.random.uniform((batch_size, 2), -max_shift, max_shift)
+    angle = tf.random.uniform((batch_size,), -max_rotation, max_rotation) * (math.pi / 180.)
+    scale = tf.random.uniform((batch_size,), 1. - max_scale, 1. + max_scale)
+
+    # Rotate and scale about the centre of the image, then shift
+    cos = tf.cos(angle) / scale
+    sin = tf.sin(angle) / scale
+    cx = (tf.cast(width, tf.float32) - 1.) / 2.
+    cy = (tf.cast(height, tf.float32) - 1.) / 2.
+    ox = cx + shift[:, 0]
+    oy = cy + shift[:, 1]
+    zeros = tf.zeros((batch_size,))
+    return tf.stack([cos, sin, cx - cos * ox - sin * oy,
+                     -sin, cos, cy + sin * ox - cos * oy,
+                     zeros, zeros], axis=1)
+
+
+def cutout(x, size=8):
+    """Sets a random size x size square of every image of a (n, h, w, c) float batch to 0."""
+    shape = tf.shape(x)
+    batch_size, height, width = shape[0], shape[1], shape[2]
+    # Centres can be near the border, so that parts of squares fall outside the image, as in the paper
+    cy = tf.random.uniform((batch_size, 1, 1), 0, tf.cast(height, tf.float32))
+    cx = tf.random.uniform((batch_size, 1, 1), 0, tf.cast(width, tf.float32))
+    rows = tf.reshape(tf.range(height, dtype=tf.float32), (1, -1, 1))
+    cols = tf.reshape(tf.range(width, dtype=tf.float32), (1, 1, -1))
+    inside = tf.logical_and(tf.abs(rows + 0.5 - cy) < size / 2., tf.abs(cols + 0.5 - cx) < size / 2.)
+    return x * tf.cast(tf.logical_not(inside), x.dtype)[..., None]
+
+
+def make_augment(max_shift=4, max_rotation=10., max_scale=0.1, cutout_size=8):
+    """
+    Returns a function augmenting standardized (x, y) batches, for Dataset.map
+    :param max_shift: Largest shift in pixels, 0 for no shift
+    :param max_rotation: Largest rotation in degrees, 0 for no rotation
+    :param max_scale: Largest relative change of scale, 0 for no scaling
+    :param cutout_size: Side of the cutout squares in pixels, 0 for no cutout
+    """
+    def augment(x, y):
+        if max_shift or max_rotation or max_scale:
+            shape = tf.shape(x)
+            transforms = affine_transforms(shape[0], shape[1], shape[2], max_shift, max_rotation, max_scale)
+            x = tf.raw_ops.ImageProjectiveTransformV3(images=x, transforms=transforms,
+                                                      output_shape=shape[1:3], fill_value=0.,
+                                                      interpolation='BILINEAR', fill_mode='NEAREST')
+        if cutout_size:
+            x = cutout(x, cutout_size)
+        return x, y
+    return augment
+
+
+def main(args=None):
+    import argparse
+    import time
+    from keras.optimizers import SGD
+
+    from benchmark_wrn import synthetic_svhn
+    from svhn_data import IMAGE_SHAPE, encode_labels
+    from svhn_stats import compute_stats
+    from svhn_input import make_dataset
+    from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+
+    parser = argparse.ArgumentParser(description='Measures the cost of the batch augmentation on synthetic images.')
+    parser.add_argument('--num-images', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--N', type=int, default=2)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=50, help='training steps timed with and without augmentation')
+    args = parser.parse_args(args)
+
+    images, labels = synthetic_svhn(args.num_images)
+    labels = encode_labels(labels)
+    stats = compute_stats([(images, labels)])
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=args.N, k=args.k, verbose=0)
+    compile_wide_residual_network(model, SGD(lr=0.1, momentum=0.9, nesterov=False))
+
+    results = {}
+    for name, augment in (('baseline', None), ('augmented', make_augment())):
+        dataset = make_dataset(images, labels, stats.mean, stats.std, args.batch_size, cache=True,
+                               augment=augment)
+        # Input pipeline on its own, after a first epoch which fills the cache
+        for _ in dataset:
+            pass
+        start = time.time()
+        num_images = sum(int(x.shape[0]) for x, y in dataset)
+        input_rate = num_images / (time.time() - start)
+
+        # Training steps fed by the pipeline, so the augmentation overlaps with the model
+        batches = iter(dataset.repeat())
+        for _ in range(3):
+            model.train_on_batch(*next(batches))
+        start = time.time()
+        for _ in range(args.steps):
+            model.train_on_batch(*next(batches))
+        train_rate = args.steps * args.batch_size / (time.time() - start)
+        results[name] = (input_rate, train_rate)
+        print('%-10s input %8.0f images/sec, training %8.0f images/sec' % (name, input_rate, train_rate))
+
+    overhead = results['baseline'][1] / results['augmented'][1] - 1
+    print('Training time overhead of the augmentation: %.1f%%' % (overhead * 100))
+
+
+if __name__ == '__main__':
+    main()
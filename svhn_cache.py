@@ -0,0 +1,245 @@
+# Content-addressed cache of preprocessed SVHN slices
+# Every run used to locate the .mat file, slice it, encode the labels and compute the normalization
+# stats again. Here the finished arrays of a slice are stored once, in a directory named after a
+# hash of the contents of the source file, the slice bounds, the label encoding and the
+# normalization, so any change to one of them gives a new entry and a stale entry is never used.
+# Entries are memory-mapped by later runs and sweep trials, and the least recently used ones are
+# evicted when the cache grows over its size budget.
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+from svhn_data import get_mat, open_mat, encode_labels
+from svhn_stats import RunningStats, compute_stats, save_stats, load_stats
+
+# Default location and size budget of the cache
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.keras', 'svhn_cache')
+MAX_BYTES = 10 * 1024 ** 3
+
+# 'class' gives the class indices 0-9 of encode_labels, 'raw' keeps the SVHN labels 1-10
+LABEL_ENCODINGS = ('class', 'raw')
+
+# 'none' keeps uint8 images, which the input pipelines standardize with the stored stats on the fly,
+# 'featurewise' stores the standardized float32 images, 4 times bigger but ready to train on
+NORMALIZATIONS = ('none', 'featurewise')
+
+
+def file_digest(path, cache_dir=CACHE_DIR, chunk_size=1 << 24):
+    """
+    Returns the SHA-256 of a file
+    Hashing the 1.3 GB extra split takes a while, so the digest is remembered in the cache directory
+    along with the size and modification time of the file, and only computed again when they change.
+    """
+    stat = os.stat(path)
+    digests_path = os.path.join(cache_dir, 'digests.json')
+    digests = {}
+    if os.path.exists(digests_path):
+        with open(digests_path) as f:
+            digests = json.load(f)
+
+    path = os.path.abspath(path)
+    known = digests.get(path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+
+    digests[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    _write_json(digests_path, digests)
+    return sha256.hexdigest()
+
+
+def cache_key(source_digest, start, stop, label_encoding, normalization, stats_axis):
+    """Hash of everything the preprocessed arrays depend on."""
+    description = {'source': source_digest, 'start': start, 'stop': stop, 'labels': label_encoding,
+                   'normalization': normalization, 'stats_axis': stats_axis}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def _write_json(path, value):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class DatasetCache(object):
+    """Directory of preprocessed arrays, evicted least recently used first.
+
+    Every entry is a directory with images.npy, labels.npy, stats.npz and
+    meta.json. The modification time of meta.json is the last time the entry
+    was used.
+
+    # Arguments
+        cache_dir: directory of the entries.
+        max_bytes: size budget of the cache, the least recently used entries
+            are removed when it is exceeded.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Memory-maps an entry and marks it as used
+        :return: (images, labels, stats), or None if there is no such entry
+        """
+        path = self.entry_path(key)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        os.utime(meta_path, None)
+        return (np.load(os.path.join(path, 'images.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'labels.npy'), mmap_mode='r'),
+                load_stats(os.path.join(path, 'stats.npz')))
+
+    def put(self, key, images, labels, stats, meta, chunk_size=10000):
+        """
+        Stores an entry, then evicts the least recently used entries over the size budget
+        The images are copied a chunk at a time, so they can be a memmap bigger than memory.
+        :return: (images, labels, stats) of the stored entry, memory-mapped
+        """
+        path = self.entry_path(key)
+        # Written to a temporary directory first so that a partial entry is never picked up
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        os.makedirs(tmp_path)
+        try:
+            stored = np.lib.format.open_memmap(os.path.join(tmp_path, 'images.npy'), mode='w+',
+                                               dtype=images.dtype, shape=images.shape)
+            for start in range(0, len(images), chunk_size):
+                stored[start:start + chunk_size] = images[start:start + chunk_size]
+            stored.flush()
+            del stored
+            np.save(os.path.join(tmp_path, 'labels.npy'), labels)
+            save_stats(os.path.join(tmp_path, 'stats.npz'), stats)
+            _write_json(os.path.join(tmp_path, 'meta.json'), meta)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # Another process stored the same entry in the meantime
+                shutil.rmtree(tmp_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+        return self.get(key)
+
+    def entries(self):
+        """Returns (last_used, size, key) of every entry, least recently used first."""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, 'meta.json')
+            if os.path.exists(meta_path):
+                entries.append((os.path.getmtime(meta_path), _dir_size(self.entry_path(key)), key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache fits its size budget."""
+        entries = self.entries()
+        total = sum(size for last_used, size, key in entries)
+        for last_used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            # Processes which memory-mapped the entry keep reading their open files
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total -= size
+
+
+def load_preprocessed(name, start=0, stop=None, label_encoding='class', normalization='none',
+                      stats_axis='channel', cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, workers=1):
+    """
+    Memory-maps a preprocessed SVHN slice, preprocessing and caching it on first use
+    :param name: One of 'train', 'extra' or 'test'
+    :param start: Index of the first image to take
+    :param stop: Index after the last image to take, None for all of them
+    :param label_encoding: One of LABEL_ENCODINGS
+    :param normalization: One of NORMALIZATIONS
+    :param stats_axis: 'channel' or 'pixel', see svhn_stats.RunningStats
+    :param cache_dir: Directory of the cache
+    :param max_bytes: Size budget of the cache
+    :param workers: Number of processes computing the stats of a new entry
+    :return: (images, labels, stats) - stats are the normalization stats of the slice, which the
+             input pipelines take as mean and std when normalization is 'none'. With 'featurewise' the
+             images are standardized already and the stats are the identity (mean 0, sd 1), so passing
+             them on leaves the images as they are - the stats of the slice, e.g. for the test images,
+             come with normalization='none'
+    """
+    if label_encoding not in LABEL_ENCODINGS:
+        raise ValueError('label_encoding must be one of %s, got %s.' % (', '.join(LABEL_ENCODINGS), label_encoding))
+    if normalization not in NORMALIZATIONS:
+        raise ValueError('normalization must be one of %s, got %s.' % (', '.join(NORMALIZATIONS), normalization))
+
+    mat_path = get_mat(name)
+    key = cache_key(file_digest(mat_path, cache_dir), start, stop, label_encoding, normalization, stats_axis)
+    cache = DatasetCache(cache_dir, max_bytes)
+    entry = cache.get(key)
+    if entry is None:
+        entry = _preprocess(cache, key, name, mat_path, start, stop, label_encoding, normalization, stats_axis,
+                            workers)
+    if normalization == 'featurewise':
+        images, labels, stats = entry
+        return images, labels, _identity_stats(stats)
+    return entry
+
+
+def _preprocess(cache, key, name, mat_path, start, stop, label_encoding, normalization, stats_axis, workers):
+    """Preprocesses a slice of the .mat file and stores it in the cache under the key."""
+    images, labels = open_mat(mat_path, start=start, stop=stop)
+    stats = compute_stats([(images, labels)], axis=stats_axis, workers=workers)
+    if label_encoding == 'class':
+        labels = encode_labels(labels)
+    else:
+        labels = np.array(labels)
+    if normalization == 'featurewise':
+        images = _StandardizedImages(images, stats)
+
+    meta = {'name': name, 'source': os.path.basename(mat_path), 'start': start, 'stop': stop,
+            'num_images': len(labels), 'label_encoding': label_encoding, 'normalization': normalization,
+            'stats_axis': stats_axis}
+    return cache.put(key, images, labels, stats, meta)
+
+
+def _identity_stats(stats):
+    """Stats shaped like the given ones whose standardize leaves already standardized images as they are."""
+    identity = RunningStats(stats.axis)
+    identity.count = 1
+    identity.mean_ = np.zeros_like(stats.mean_)
+    identity.m2 = np.ones_like(stats.m2)
+    return identity
+
+
+class _StandardizedImages(object):
+    """Standardizes the slices of an images memmap as DatasetCache.put copies them."""
+
+    def __init__(self, images, stats):
+        self.images = images
+        self.stats = stats
+        self.shape = images.shape
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        return self.stats.standardize(self.images[index])
@@ -0,0 +1,130 @@
+# SVHN dataset loading
+# The .mat files store images as (32, 32, 3, N), so every run used to loadmat the whole file and
+# copy the images out one at a time. Instead, each .mat file is converted once into an uint8 NHWC
+# .npy file with a label sidecar, and later runs simply memory-map it.
+
+import os
+import numpy as np
+
+# Dataset source: http://ufldl.stanford.edu/housenumbers/ - Format 2, Cropped Digits
+SVHN_URLS = {
+    'train': "http://ufldl.stanford.edu/housenumbers/train_32x32.mat",
+    'extra': "http://ufldl.stanford.edu/housenumbers/extra_32x32.mat",
+    'test': "https://s3-ap-southeast-1.amazonaws.com/deeplearning-iap-material/test_32x32.mat",
+}
+
+IMAGE_SHAPE = (32, 32, 3)
+
+
+def get_mat(name):
+    """
+    Downloads (or locates the already downloaded) .mat file of a SVHN split
+    :param name: One of 'train', 'extra' or 'test'
+    :return: Path to the .mat file
+    """
+    from keras.utils import get_file
+
+    return get_file("%s_32x32.mat" % name, SVHN_URLS[name])
+
+
+def cache_paths(mat_path, cache_dir=None):
+    """
+    Returns the paths of the images array and the label sidecar of a converted .mat file
+    :param mat_path: Path to the .mat file
+    :param cache_dir: Directory of the converted arrays, defaults to the directory of the .mat file
+    :return: (images_path, labels_path)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(mat_path))
+    base = os.path.splitext(os.path.basename(mat_path))[0]
+    return (os.path.join(cache_dir, base + '.images.npy'),
+            os.path.join(cache_dir, base + '.labels.npy'))
+
+
+def convert_mat(mat_path, cache_dir=None, chunk_size=10000):
+    """
+    Converts a SVHN .mat file into an uint8 NHWC images array and an uint8 labels array
+    The layout change is done chunk by chunk straight into the memory-mapped output file,
+    so no float or per-image copy of the dataset is ever made.
+    :param mat_path: Path to the .mat file
+    :param cache_dir: Directory of the converted arrays, defaults to the directory of the .mat file
+    :param chunk_size: Number of images transposed at a time
+    :return: (images_path, labels_path)
+    """
+    import scipy.io
+
+    images_path, labels_path = cache_paths(mat_path, cache_dir)
+    if not os.path.isdir(os.path.dirname(images_path)):
+        os.makedirs(os.path.dirname(images_path))
+
+    mat = scipy.io.loadmat(mat_path)
+    X = mat["X"]
+    y = mat["y"].reshape(-1)
+    num_images = X.shape[-1]
+
+    # Write to temporary files first so that an interrupted conversion is never picked up as a cache
+    images_tmp = images_path + '.tmp.npy'
+    labels_tmp = labels_path + '.tmp.npy'
+
+    images = np.lib.format.open_memmap(images_tmp, mode='w+', dtype=np.uint8,
+                                       shape=(num_images,) + IMAGE_SHAPE)
+    for start in range(0, num_images, chunk_size):
+        stop = min(start + chunk_size, num_images)
+        images[start:stop] = np.moveaxis(X[..., start:stop], -1, 0)
+    images.flush()
+    del images
+
+    np.save(labels_tmp, y.astype(np.uint8))
+
+    os.replace(images_tmp, images_path)
+    os.replace(labels_tmp, labels_path)
+    return images_path, labels_path
+
+
+def open_mat(mat_path, cache_dir=None, start=0, stop=None):
+    """
+    Memory-maps the converted arrays of a SVHN .mat file, converting it first if needed
+    :param mat_path: Path to the .mat file
+    :param cache_dir: Directory of the converted arrays, defaults to the directory of the .mat file
+    :param start: Index of the first image to take
+    :param stop: Index after the last image to take, None for all of them
+    :return: (images, labels) - images is a read-only (n, 32, 32, 3) uint8 memmap, labels are 1-10
+    """
+    images_path, labels_path = cache_paths(mat_path, cache_dir)
+    if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+        convert_mat(mat_path, cache_dir)
+
+    # Slicing a memmap returns a view, nothing is read until the images are used
+    images = np.load(images_path, mmap_mode='r')[start:stop]
+    labels = np.load(labels_path, mmap_mode='r')[start:stop]
+    return images, labels
+
+
+def encode_labels(labels, dtype=np.int8):
+    """
+    Converts SVHN labels (1-10, where 10 is the digit 0) into class indices
+    Class i is the label i + 1, which is the column order of the old one-hot encoding with its
+    empty first column removed, so the class indices match the shipped model_weights.h5
+    :param labels: Array of labels
+    :param dtype: Integer dtype of the class indices
+    :return: Array of class indices 0-9
+    """
+    return np.asarray(labels, dtype=dtype) - 1
+
+
+def classes_to_digits(classes):
+    """Converts class indices predicted by the model back into the digits 0-9."""
+    return (np.asarray(classes) + 1) % 10
+
+
+def load_svhn(name, cache_dir=None, start=0, stop=None):
+    """
+    Memory-maps a SVHN split, downloading and converting it on first use
+    :param name: One of 'train', 'extra' or 'test'
+    :param cache_dir: Directory of the converted arrays, defaults to the keras datasets directory
+    :param start: Index of the first image to take
+    :param stop: Index after the last image to take, None for all of them
+    :return: (images, labels) - images is a read-only (n, 32, 32, 3) uint8 memmap, labels are 1-10
+    """
+    mat_path = get_mat(name)
+    return open_mat(mat_path, cache_dir, start, stop)
@@ -0,0 +1,108 @@
+# tf.data input pipeline for the memory-mapped SVHN splits
+# Replaces ImageDataGenerator.flow, which builds and standardizes every batch in NumPy float64 on a
+# single Python thread while the model waits. Here the batches are gathered and standardized by
+# parallel map calls in float32 and prefetched, so they are ready before the model asks for them.
+
+import numpy as np
+import tensorflow as tf
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+def _label_dtype(labels):
+    """Class indices are fed as int32, any other targets (e.g. teacher logits) as float32."""
+    return np.int32 if np.issubdtype(labels.dtype, np.integer) else np.float32
+
+
+def _gather(images, labels):
+    """Returns a function taking a batch of indices to the uint8 images and labels at those indices."""
+    label_dtype = _label_dtype(labels)
+
+    def gather(index):
+        # Sorted reads are sequential on a memmap, the order within a batch does not matter
+        index = np.sort(index)
+        return np.asarray(images[index], dtype=np.uint8), np.asarray(labels[index], dtype=label_dtype)
+    return gather
+
+
+def make_dataset(images, labels, mean, std, batch_size=128, shuffle=True, cache=False,
+                 seed=0, num_parallel_calls=AUTOTUNE, prefetch=AUTOTUNE, augment=None):
+    """
+    Builds a dataset of standardized (x, y) batches
+    :param images: (n, 32, 32, 3) uint8 array or memmap
+    :param labels: (n,) class indices, or (n, ...) float targets
+    :param mean: Featurewise mean subtracted from the images
+    :param std: Featurewise standard deviation the images are divided by
+    :param batch_size: Number of images per batch
+    :param shuffle: Reshuffles the images every epoch if True
+    :param cache: Keeps the uint8 images in memory after the first epoch if True, so later epochs
+                  do not read the memmap again
+    :param seed: Seed of the shuffles
+    :param num_parallel_calls: Number of batches gathered and standardized in parallel
+    :param prefetch: Number of batches prepared ahead of the model
+    :param augment: Function augmenting the standardized (x, y) batches, e.g. from
+                    svhn_augment.make_augment, None for no augmentation
+    :return: tf.data.Dataset
+    """
+    num_images = len(images)
+    image_shape = tuple(images.shape[1:])
+    gather = _gather(images, labels)
+
+    label_dtype = tf.as_dtype(_label_dtype(labels))
+    label_shape = tuple(labels.shape[1:])
+
+    def load(index):
+        x, y = tf.numpy_function(gather, [index], [tf.uint8, label_dtype])
+        x.set_shape((None,) + image_shape)
+        y.set_shape((None,) + label_shape)
+        return x, y
+
+    mean = tf.constant(np.asarray(mean, dtype=np.float32))
+    scale = tf.constant(1.0 / (np.asarray(std, dtype=np.float32) + 1e-6))
+
+    def standardize(x, y):
+        # Same as ImageDataGenerator's featurewise_center and featurewise_std_normalization
+        return (tf.cast(x, tf.float32) - mean) * scale, y
+
+    if cache:
+        # Read the images once in order, then shuffle the cached uint8 images
+        dataset = tf.data.Dataset.range(num_images).batch(1024)
+        dataset = dataset.map(load, num_parallel_calls=num_parallel_calls)
+        dataset = dataset.unbatch().cache()
+        if shuffle:
+            dataset = dataset.shuffle(num_images, seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        # unbatch loses the number of batches, which fit and the per-step learning rate schedules need
+        num_batches = int(np.ceil(num_images / float(batch_size)))
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(num_batches))
+    else:
+        # Shuffle the indices only and read the images of every batch straight from the memmap
+        dataset = tf.data.Dataset.range(num_images)
+        if shuffle:
+            dataset = dataset.shuffle(num_images, seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(load, num_parallel_calls=num_parallel_calls)
+
+    dataset = dataset.map(standardize, num_parallel_calls=num_parallel_calls)
+    if augment is not None:
+        # After the cache, so every epoch sees new transforms
+        dataset = dataset.map(augment, num_parallel_calls=num_parallel_calls)
+    return dataset.prefetch(prefetch)
+
+
+def train_valid_datasets(images, labels, mean, std, batch_size=128, validation_split=0.2,
+                         cache=False, seed=0, augment=None):
+    """
+    Splits the images into training and validation datasets
+    The split is the same as ImageDataGenerator.flow with validation_split: the first
+    int(n * validation_split) images are the validation set and the rest are the training set.
+    Only the training set is augmented.
+    :return: (train_dataset, valid_dataset)
+    """
+    split = int(len(images) * validation_split)
+
+    train_dataset = make_dataset(images[split:], labels[split:], mean, std, batch_size,
+                                 shuffle=True, cache=cache, seed=seed, augment=augment)
+    valid_dataset = make_dataset(images[:split], labels[:split], mean, std, batch_size,
+                                 shuffle=False, cache=cache)
+    return train_dataset, valid_dataset
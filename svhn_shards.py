@@ -0,0 +1,146 @@
+# Out-of-core training over the memory-mapped SVHN splits
+# The splits are cut into fixed-size shards. Every epoch the shards are visited in a reproducible
+# random order, a few shards at a time, so peak memory depends on the shard settings and not on the
+# size of the dataset.
+
+import numpy as np
+
+from svhn_data import encode_labels
+
+
+def make_shards(sources, shard_size=20000):
+    """
+    Cuts memory-mapped splits into shards of contiguous images
+    :param sources: List of (images, labels) pairs, e.g. from svhn_data.load_svhn
+    :param shard_size: Number of images per shard, the last shard of every split may be smaller
+    :return: List of (source_index, start, stop)
+    """
+    shards = []
+    for source_index, (images, labels) in enumerate(sources):
+        num_images = len(images)
+        for start in range(0, num_images, shard_size):
+            shards.append((source_index, start, min(start + shard_size, num_images)))
+    return shards
+
+
+class ShardScheduler(object):
+    """Streams standardized batches from memory-mapped splits in bounded memory.
+
+    Shards are read from disk `buffer_shards` at a time. Within that shuffle buffer the images are
+    shuffled, and the buffer is released before the next one is read, so at most `buffer_shards`
+    shards (plus the leftover of one batch) are held in memory. The shard order and the shuffle of
+    every buffer only depend on `seed` and the epoch, so runs are reproducible.
+
+    # Example
+    ```python
+    sources = [load_svhn('train'), load_svhn('extra')]
+    shards = make_shards(sources, shard_size=20000)
+    stats = compute_stats(sources, shards)
+    train_scheduler = ShardScheduler(sources, shards, stats.mean, stats.std, batch_size=128)
+    model.fit_generator(train_scheduler, steps_per_epoch=len(train_scheduler), epochs=100)
+    ```
+    # Arguments
+        sources: list of (images, labels) pairs.
+        shards: list of (source_index, start, stop), from make_shards.
+        mean: featurewise mean subtracted from the images.
+        std: featurewise standard deviation the images are divided by.
+        batch_size: number of images per batch.
+        buffer_shards: number of shards held and shuffled together in memory.
+        shuffle: whether to shuffle the shard order and the images within a buffer.
+        seed: seed of the per-epoch shard order and shuffles.
+    """
+
+    def __init__(self, sources, shards, mean, std, batch_size=128, buffer_shards=2,
+                 shuffle=True, seed=0):
+        if buffer_shards < 1:
+            raise ValueError('ShardScheduler needs a buffer of at least 1 shard.')
+        self.sources = sources
+        self.shards = list(shards)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.std = np.asarray(std, dtype=np.float32)
+        self.batch_size = batch_size
+        self.buffer_shards = buffer_shards
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_images = sum(stop - start for _, start, stop in self.shards)
+        self.epoch = 0
+        self._batches = None
+
+    def __len__(self):
+        return int(np.ceil(self.num_images / float(self.batch_size)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Keras pulls `len(self)` batches per epoch out of a generator which never ends
+        if self._batches is None:
+            self._batches = self.epoch_batches(self.epoch)
+        try:
+            return next(self._batches)
+        except StopIteration:
+            self.epoch += 1
+            self._batches = self.epoch_batches(self.epoch)
+            return next(self._batches)
+
+    next = __next__
+
+    def set_epoch(self, epoch):
+        """Starts the next batch at the beginning of the given epoch, e.g. to resume training."""
+        self.epoch = epoch
+        self._batches = None
+
+    def shard_order(self, epoch):
+        """Returns the shards in the order they are visited in the given epoch."""
+        if not self.shuffle:
+            return list(self.shards)
+        order = np.random.RandomState([self.seed, epoch]).permutation(len(self.shards))
+        return [self.shards[i] for i in order]
+
+    def _load_buffer(self, shards, epoch, buffer_index):
+        images = np.concatenate([self.sources[s][0][start:stop] for s, start, stop in shards])
+        labels = np.concatenate([self.sources[s][1][start:stop] for s, start, stop in shards])
+
+        # Shuffle through an index rather than in place, so the buffer is never copied again
+        if self.shuffle:
+            index = np.random.RandomState([self.seed, epoch, buffer_index]).permutation(len(images))
+        else:
+            index = np.arange(len(images))
+        return images, labels, index
+
+    def _standardize(self, images, labels):
+        x = (images.astype(np.float32) - self.mean) / (self.std + 1e-6)
+        return x, encode_labels(labels)
+
+    def epoch_batches(self, epoch):
+        """Yields the standardized (x, y) batches of one epoch."""
+        order = self.shard_order(epoch)
+        leftover_images = leftover_labels = None
+
+        for buffer_index, first in enumerate(range(0, len(order), self.buffer_shards)):
+            images, labels, index = self._load_buffer(order[first:first + self.buffer_shards],
+                                               epoch, buffer_index)
+            offset = 0
+            if leftover_images is not None:
+                # Top up the batch left over from the previous buffer
+                offset = min(self.batch_size - len(leftover_images), len(images))
+                leftover_images = np.concatenate([leftover_images, images[index[:offset]]])
+                leftover_labels = np.concatenate([leftover_labels, labels[index[:offset]]])
+                if len(leftover_images) < self.batch_size:
+                    continue
+                yield self._standardize(leftover_images, leftover_labels)
+                leftover_images = leftover_labels = None
+
+            # Full batches only, the remainder is carried over into the next buffer
+            num_full = offset + (len(images) - offset) // self.batch_size * self.batch_size
+            for start in range(offset, num_full, self.batch_size):
+                batch = index[start:start + self.batch_size]
+                yield self._standardize(images[batch], labels[batch])
+
+            if num_full < len(images):
+                leftover_images = images[index[num_full:]]
+                leftover_labels = labels[index[num_full:]]
+            del images, labels, index
+
+        if leftover_images is not None:
+            yield self._standardize(leftover_images, leftover_labels)
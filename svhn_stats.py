@@ -0,0 +1,183 @@
+# Streaming featurewise statistics of the memory-mapped SVHN splits
+# ImageDataGenerator.fit made a float copy of the whole training set just to get its mean and sd.
+# Here the images are read a chunk at a time, the per-chunk statistics are merged with the parallel
+# variant of Welford's algorithm, and the chunks can be spread over worker processes.
+# The results are saved next to the model weights so later runs load them instead.
+
+import os
+import multiprocessing
+import numpy as np
+
+# Axes reduced over for per-channel stats (like ImageDataGenerator) and per-pixel stats
+REDUCE_AXES = {
+    'channel': (0, 1, 2),
+    'pixel': (0,),
+}
+
+
+class RunningStats(object):
+    """Running count, mean and sum of squared deviations of a stream of image batches.
+
+    # Arguments
+        axis: 'channel' for one mean and sd per colour channel, as ImageDataGenerator computes
+            them, or 'pixel' for one mean and sd per pixel and channel.
+    """
+
+    def __init__(self, axis='channel'):
+        if axis not in REDUCE_AXES:
+            raise ValueError('RunningStats axis must be one of %s, got %s.'
+                             % (', '.join(REDUCE_AXES), axis))
+        self.axis = axis
+        self.count = 0
+        self.mean_ = None
+        self.m2 = None
+
+    def update(self, images):
+        """Adds a batch of images to the statistics."""
+        x = np.asarray(images, dtype=np.float64)
+        reduce_axes = REDUCE_AXES[self.axis]
+        count = int(np.prod([x.shape[a] for a in reduce_axes]))
+        if count == 0:
+            return self
+        mean = x.mean(axis=reduce_axes)
+        m2 = np.square(x - mean).sum(axis=reduce_axes)
+        return self._merge(count, mean, m2)
+
+    def merge(self, other):
+        """Adds the statistics of another RunningStats computed over different images."""
+        if other.axis != self.axis:
+            raise ValueError('Cannot merge %s stats into %s stats.' % (other.axis, self.axis))
+        if other.count == 0:
+            return self
+        return self._merge(other.count, other.mean_, other.m2)
+
+    def _merge(self, count, mean, m2):
+        if self.count == 0:
+            self.count, self.mean_, self.m2 = count, mean, m2
+            return self
+        total = self.count + count
+        delta = mean - self.mean_
+        self.mean_ = self.mean_ + delta * (count / float(total))
+        self.m2 = self.m2 + m2 + np.square(delta) * (self.count * float(count) / total)
+        self.count = total
+        return self
+
+    @property
+    def mean(self):
+        """Mean as float32, shaped to broadcast against (n, 32, 32, 3) images."""
+        return self._broadcastable(self.mean_)
+
+    @property
+    def std(self):
+        """Population standard deviation (like np.std), shaped like the mean."""
+        return self._broadcastable(np.sqrt(self.m2 / self.count))
+
+    def _broadcastable(self, value):
+        if self.axis == 'channel':
+            value = value.reshape((1, 1, -1))
+        return value.astype(np.float32)
+
+    def standardize(self, images):
+        """Standardizes images in float32, the same way as the training pipelines."""
+        return (np.asarray(images, dtype=np.float32) - self.mean) / (self.std + 1e-6)
+
+
+# Images of the sources, inherited by the forked worker processes instead of being pickled
+_worker_images = None
+
+
+def _range_stats(task):
+    source_index, start, stop, axis, chunk_size = task
+    images = _worker_images[source_index]
+    stats = RunningStats(axis)
+    for chunk_start in range(start, stop, chunk_size):
+        stats.update(images[chunk_start:min(chunk_start + chunk_size, stop)])
+    return stats
+
+
+def compute_stats(sources, ranges=None, axis='channel', chunk_size=4096, workers=1):
+    """
+    Computes the statistics of memory-mapped images in bounded memory
+    :param sources: List of (images, labels) pairs, e.g. from svhn_data.load_svhn
+    :param ranges: List of (source_index, start, stop) to compute the stats over, e.g. the shards
+                   from svhn_shards.make_shards, defaults to all of the images of every source
+    :param axis: 'channel' or 'pixel', see RunningStats
+    :param chunk_size: Number of images read at a time by each process
+    :param workers: Number of worker processes, ranges are spread over them
+    :return: RunningStats
+    """
+    global _worker_images
+
+    if ranges is None:
+        ranges = [(i, 0, len(images)) for i, (images, labels) in enumerate(sources)]
+
+    # Split the ranges into chunk-aligned tasks so that the workers stay busy
+    task_size = chunk_size * 4
+    tasks = []
+    for source_index, start, stop in ranges:
+        for task_start in range(start, stop, task_size):
+            tasks.append((source_index, task_start, min(task_start + task_size, stop), axis, chunk_size))
+
+    _worker_images = [images for images, labels in sources]
+    try:
+        if workers > 1:
+            # Forked workers share the memory maps, nothing but the small results is copied
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            try:
+                results = pool.map(_range_stats, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_range_stats(task) for task in tasks]
+    finally:
+        _worker_images = None
+
+    stats = RunningStats(axis)
+    for result in results:
+        stats.merge(result)
+    return stats
+
+
+def stats_path(weights_path, key):
+    """
+    Returns the path of the stats saved next to model weights
+    :param weights_path: Path to the model weights, e.g. 'model_weights.h5'
+    :param key: Name of the dataset slice the stats were computed over, e.g. 'extra_0_100000'
+    :return: e.g. 'model_weights.extra_0_100000.stats.npz'
+    """
+    return '%s.%s.stats.npz' % (os.path.splitext(weights_path)[0], key)
+
+
+def save_stats(path, stats):
+    # Written to a temporary file first, so that other processes never load a partial file
+    tmp_path = '%s.%d.tmp.npz' % (path, os.getpid())
+    np.savez(tmp_path, axis=stats.axis, count=stats.count, mean=stats.mean_, m2=stats.m2)
+    os.replace(tmp_path, path)
+
+
+def load_stats(path):
+    with np.load(path) as data:
+        stats = RunningStats(str(data['axis']))
+        stats.count = int(data['count'])
+        stats.mean_ = data['mean']
+        stats.m2 = data['m2']
+    return stats
+
+
+def cached_stats(weights_path, key, sources, ranges=None, axis='channel', workers=1):
+    """
+    Loads the stats saved next to the model weights, or computes and saves them
+    :param weights_path: Path to the model weights
+    :param key: Name of the dataset slice, it must change whenever sources or ranges change
+    :return: RunningStats
+    """
+    path = stats_path(weights_path, key)
+    if os.path.exists(path):
+        stats = load_stats(path)
+        if stats.axis == axis:
+            return stats
+
+    stats = compute_stats(sources, ranges, axis=axis, workers=workers)
+    save_stats(path, stats)
+    return stats
@@ -0,0 +1,25 @@
+# Wide Residual Networks on SVHN
+# The package groups the modules of the repository by role:
+#   svhn_wrn.data       loading, stats, caches and tf.data input pipelines
+#   svhn_wrn.model      create_wide_residual_network and its blocks, inference-time rewrites
+#   svhn_wrn.callbacks  Custom_ReduceLROnPlateau, schedules, SWA, checkpoints, validation, profiling
+#   svhn_wrn.train      the training recipe of model_3_wide_resnet.py as a function and a CLI
+#   svhn_wrn.inference  batch scoring, evaluation and the prediction server
+# Nothing heavy is imported until it is used, e.g. `from svhn_wrn import load_stats` loads numpy only,
+# and Keras is imported by the first model or callback asked for.
+#
+# Console entry points (see pyproject.toml): svhn-wrn-train, svhn-wrn-eval, svhn-wrn-predict,
+# svhn-wrn-serve and svhn-wrn-benchmark.
+
+from svhn_wrn._lazy import lazy_exports
+# These submodules only import the standard library until their names are used, svhn_wrn.train is
+# imported on first use so that `python -m svhn_wrn.train` runs it only once
+from svhn_wrn import data, model, callbacks, inference
+
+_EXPORTS = {}
+for _module in (data, model, callbacks, inference):
+    _EXPORTS.update((name, _module.__name__) for name in _module.__all__)
+del _module
+
+__all__ = sorted(_EXPORTS) + ['data', 'model', 'callbacks', 'train', 'inference']
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS, submodules=('train',))
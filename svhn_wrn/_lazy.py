@@ -0,0 +1,27 @@
+# Lazy attributes of the package modules
+# Every name the package exports is imported from its module on first use only (PEP 562), so importing
+# svhn_wrn or one of its modules costs nothing, and a process only imports the dependencies it uses.
+
+import importlib
+
+
+def lazy_exports(namespace, exports, submodules=()):
+    """
+    Returns the module __getattr__ and __dir__ which import every exported name from its module on first use
+    :param namespace: globals() of the package module, the imported names are cached in it
+    :param exports: Dict of exported name to the module it is imported from
+    :param submodules: Names of submodules of a package imported on first use as well
+    :return: (__getattr__, __dir__)
+    """
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module('%s.%s' % (namespace['__name__'], name))
+        if name not in exports:
+            raise AttributeError('module %r has no attribute %r' % (namespace['__name__'], name))
+        value = getattr(importlib.import_module(exports[name]), name)
+        namespace[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(exports) | set(submodules))
+    return __getattr__, __dir__
@@ -0,0 +1,16 @@
+# Training callbacks: learning rate control, weight averaging, checkpoints, validation and profiling
+# Importing any of them imports Keras
+
+from svhn_wrn._lazy import lazy_exports
+
+_EXPORTS = dict(
+    [(name, 'wrn_callbacks') for name in ('Custom_ReduceLROnPlateau', 'LearningRateSchedule', 'OneCycleLR',
+                                          'CosineAnnealingWarmRestarts', 'SCHEDULES',
+                                          'StochasticWeightAveraging', 'recalibrate_batch_norm')] +
+    [('LinearWarmup', 'large_batch_wrn'),
+     ('TrainingStateCheckpoint', 'wrn_checkpoint'),
+     ('ValidationScheduler', 'wrn_validation'),
+     ('TrainingProfiler', 'wrn_profiler')])
+
+__all__ = sorted(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS)
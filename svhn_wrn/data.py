@@ -0,0 +1,18 @@
+# SVHN loading, normalization stats, caches and input pipelines
+# numpy-only, except make_dataset, train_valid_datasets and the augmentation, which import TensorFlow
+
+from svhn_wrn._lazy import lazy_exports
+
+_EXPORTS = dict(
+    [(name, 'svhn_data') for name in ('SVHN_URLS', 'IMAGE_SHAPE', 'get_mat', 'cache_paths', 'convert_mat',
+                                      'open_mat', 'encode_labels', 'classes_to_digits', 'load_svhn')] +
+    [(name, 'svhn_stats') for name in ('RunningStats', 'compute_stats', 'stats_path', 'save_stats',
+                                       'load_stats', 'cached_stats')] +
+    [(name, 'svhn_cache') for name in ('DatasetCache', 'load_preprocessed', 'file_digest')] +
+    [(name, 'svhn_shards') for name in ('make_shards', 'ShardScheduler')] +
+    [(name, 'svhn_input') for name in ('make_dataset', 'train_valid_datasets')] +
+    [(name, 'svhn_augment') for name in ('make_augment', 'cutout')] +
+    [('synthetic_svhn', 'benchmark_wrn')])
+
+__all__ = sorted(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS)
@@ -0,0 +1,58 @@
+# Scoring, evaluation and serving of trained weights
+# The entry points only import Keras and TensorFlow once their arguments are parsed, so --help and bad
+# arguments return at once, and a scoring job starts with numpy loaded only.
+
+import argparse
+import json
+
+from svhn_wrn._lazy import lazy_exports
+
+_EXPORTS = dict(
+    [(name, 'predict_wrn') for name in ('open_images', 'find_stats', 'build_model', 'benchmark_batch_sizes',
+                                        'predict')] +
+    [(name, 'serve_wrn') for name in ('make_predict', 'MicroBatcher', 'PredictionServer', 'build_server')] +
+    [('TFLitePredictor', 'quantize_wrn')])
+
+__all__ = sorted(_EXPORTS) + ['evaluate_main', 'predict_main', 'serve_main']
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS)
+
+
+def evaluate_main(args=None):
+    parser = argparse.ArgumentParser(description='Scores trained WRN weights on the SVHN test split.')
+    parser.add_argument('--weights', default='model_weights.h5')
+    parser.add_argument('--stats', help='normalization stats the weights were trained with, '
+                                        'defaults to the stats file saved next to the weights')
+    parser.add_argument('--N', type=int, default=2, help='depth of the WRN, N = (n - 4) / 6')
+    parser.add_argument('--k', type=int, default=2, help='width of the WRN')
+    parser.add_argument('--split', default='test', help="SVHN split to score, 'test', 'train' or 'extra'")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--report', help='.json file to write the accuracy and confusion matrix to')
+    args = parser.parse_args(args)
+
+    import numpy as np
+    from svhn_data import load_svhn
+    from svhn_stats import load_stats
+    from predict_wrn import find_stats, build_model, predict
+
+    images, labels = load_svhn(args.split)
+    stats = load_stats(args.stats or find_stats(args.weights))
+    model = build_model(args.weights, args.N, args.k)
+    results = predict(model, stats, images, labels, batch_size=args.batch_size, verbose=0)
+    print('%s set accuracy score: %.4f (%d images, %.1f s)'
+          % (args.split.capitalize(), results['accuracy'], results['num_images'], results['seconds']))
+    print(np.asarray(results['confusion_matrix']))
+
+    if args.report:
+        results.update(weights=args.weights, split=args.split)
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def predict_main(args=None):
+    from predict_wrn import main
+    return main(args)
+
+
+def serve_main(args=None):
+    from serve_wrn import main
+    return main(args)
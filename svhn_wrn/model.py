@@ -0,0 +1,15 @@
+# The Wide Residual Network, its blocks and its inference-time rewrites
+# Importing any of them imports Keras
+
+from svhn_wrn._lazy import lazy_exports
+
+_EXPORTS = dict(
+    [(name, 'wide_resnet') for name in ('initial_conv', 'expand_conv', 'conv1_block', 'conv2_block',
+                                        'conv3_block', 'create_wide_residual_network',
+                                        'compile_wide_residual_network')] +
+    [(name, 'fold_bn') for name in ('optimize_for_inference', 'check_equivalence')] +
+    [(name, 'prune_wrn') for name in ('prune_model', 'count_flops')] +
+    [('LargeBatchModel', 'large_batch_wrn')])
+
+__all__ = sorted(_EXPORTS)
+__getattr__, __dir__ = lazy_exports(globals(), _EXPORTS)
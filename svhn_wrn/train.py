@@ -0,0 +1,187 @@
+# Training recipe of model_3_wide_resnet.py as a function and a CLI
+# The notebook script runs everything at import and needs matplotlib and sklearn for its plots and
+# test score. train() runs the same recipe on the flags of the script given as arguments, and imports
+# Keras, TensorFlow and the data modules only when it is called:
+#   - the first 100k extra images (cached by svhn_cache.py) split 80/20, or the whole train + extra set
+#     streamed in shards with --full-dataset
+#   - WRN-16-2 trained with SGD with momentum from lr 0.1, ReduceLROnPlateau(patience=2) and
+#     EarlyStopping(patience=4), or a fixed schedule with optional SWA
+#   - the best weights saved to the checkpoint with their stats next to them, the whole training state
+#     saved every epoch so an interrupted run resumes with --resume, and the test set scored at the end
+#
+# Example:
+#   svhn-wrn-train --checkpoint weights.best.cnn.hdf5
+#   svhn-wrn-train --checkpoint weights.best.cnn.hdf5 --resume
+#   svhn-wrn-train --schedule onecycle --schedule-epochs 15 --swa-epochs 5 --subsample-validation
+
+import argparse
+import json
+import os
+
+
+def train(checkpoint_path='weights.best.cnn.hdf5', full_dataset=False, stop=100000, shard_size=20000,
+          buffer_shards=2, N=2, k=2, dropout=0.0, lr=0.1, batch_size=128, epochs=100, schedule='plateau',
+          schedule_epochs=15, swa_epochs=0, swa_lr=0.01, restore_best_weights=False, augment=False,
+          subsample_validation=False, state_path='training_state.npz', resume=False, profile=False,
+          jit_compile=False, test=True, verbose=2):
+    """
+    Trains the WRN on SVHN with the recipe of model_3_wide_resnet.py
+    :param checkpoint_path: File the best weights are saved to, the stats go next to it
+    :param full_dataset: Trains on the whole train + extra set streamed in shards instead of a slice of extra
+    :param stop: Number of extra images of the slice
+    :param schedule: 'plateau' for ReduceLROnPlateau and EarlyStopping, else a key of wrn_callbacks.SCHEDULES
+    :param swa_epochs: Epochs averaged by StochasticWeightAveraging after a fixed schedule, 0 for none
+    :param restore_best_weights: Reduces the lr with Custom_ReduceLROnPlateau, which goes back to the best weights
+    :param state_path: File the training state is saved to every epoch, None to not save it
+    :param resume: Resumes from the training state in state_path if there is one, a state saved with other
+                   settings raises ValueError
+    :param profile: Writes the input / train / validation / checkpoint time of every epoch to training_profile.jsonl
+    :param test: Scores the SVHN test split at the end
+    :return: (model, history, results) - results hold the epochs, stats path and test accuracy
+    """
+    import numpy as np
+    from keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+    from keras.optimizers import SGD
+
+    from svhn_data import IMAGE_SHAPE, load_svhn, encode_labels
+    from svhn_stats import cached_stats, save_stats, stats_path
+    from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+    from wrn_callbacks import Custom_ReduceLROnPlateau, SCHEDULES, StochasticWeightAveraging
+    from wrn_checkpoint import TrainingStateCheckpoint
+
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=N, k=k, dropout=dropout, verbose=0)
+    compile_wide_residual_network(model, SGD(lr=lr, momentum=0.9, nesterov=False), jit_compile=jit_compile)
+
+    if schedule == 'plateau':
+        reduce_lr = Custom_ReduceLROnPlateau if restore_best_weights else ReduceLROnPlateau
+        callbacks = [EarlyStopping(monitor='val_loss', patience=4),
+                     reduce_lr(monitor='val_loss', factor=0.1, patience=2, verbose=1, min_delta=0.0001, min_lr=0)]
+    else:
+        epochs = schedule_epochs + swa_epochs
+        callbacks = [SCHEDULES[schedule](lr, schedule_epochs)]
+
+    profiler = None
+    if profile:
+        from wrn_profiler import TrainingProfiler
+        profiler = TrainingProfiler('training_profile.jsonl', batch_size=batch_size)
+        callbacks.insert(0, profiler)
+    checkpoint = ModelCheckpoint(filepath=checkpoint_path, monitor='val_loss', save_best_only=True)
+    callbacks.append(profiler.wrap(checkpoint, 'checkpoint') if profiler else checkpoint)
+
+    valid_data = None
+    if full_dataset:
+        from svhn_shards import make_shards, ShardScheduler
+
+        sources = [load_svhn('train'), load_svhn('extra')]
+        shards = make_shards(sources, shard_size)
+        shards = [shards[i] for i in np.random.RandomState(0).permutation(len(shards))]
+        num_valid = int(len(shards) * 0.2)
+        key = 'train_extra_%d_valid%d' % (shard_size, num_valid)
+        stats = cached_stats(checkpoint_path, key, sources, shards[num_valid:], workers=os.cpu_count())
+        train_data = ShardScheduler(sources, shards[num_valid:], stats.mean, stats.std, batch_size=batch_size,
+                                    buffer_shards=buffer_shards)
+        valid_data = ShardScheduler(sources, shards[:num_valid], stats.mean, stats.std, batch_size=batch_size,
+                                    buffer_shards=buffer_shards, shuffle=False)
+        swa_data = lambda scheduler=train_data: scheduler.epoch_batches(0)
+    else:
+        from svhn_cache import load_preprocessed
+        from svhn_input import train_valid_datasets
+
+        images, labels, stats = load_preprocessed('extra', stop=stop, workers=os.cpu_count())
+        key = 'extra_0_%d' % stop
+        save_stats(stats_path(checkpoint_path, key), stats)
+        augment_fn = None
+        if augment:
+            from svhn_augment import make_augment
+            augment_fn = make_augment()
+        train_data, valid_data = train_valid_datasets(images, labels, stats.mean, stats.std, batch_size=batch_size,
+                                                      validation_split=0.2, cache=True, augment=augment_fn)
+        swa_data = train_data
+        if subsample_validation:
+            from wrn_validation import ValidationScheduler
+            split = int(len(images) * 0.2)
+            # First, so that the callbacks which monitor val_loss find it in the logs
+            callbacks.insert(0, ValidationScheduler(images[:split], labels[:split], stats.mean, stats.std,
+                                                    verbose=1))
+            valid_data = None
+
+    if schedule != 'plateau' and swa_epochs:
+        callbacks.append(StochasticWeightAveraging(schedule_epochs, swa_data, swa_lr=swa_lr, verbose=1))
+
+    initial_epoch = 0
+    if state_path:
+        # Everything the saved callback counters, optimizer slots and data position depend on
+        config = {'data': key, 'N': N, 'k': k, 'dropout': dropout, 'lr': lr, 'batch_size': batch_size,
+                  'epochs': epochs, 'schedule': schedule, 'schedule_epochs': schedule_epochs,
+                  'swa_epochs': swa_epochs, 'swa_lr': swa_lr, 'restore_best_weights': restore_best_weights,
+                  'augment': augment, 'subsample_validation': subsample_validation, 'profile': profile,
+                  'buffer_shards': buffer_shards, 'jit_compile': jit_compile}
+        state_checkpoint = TrainingStateCheckpoint(state_path, callbacks=callbacks,
+                                                   data=[train_data] if full_dataset else [], config=config)
+        callbacks.append(state_checkpoint)
+        if resume:
+            initial_epoch = state_checkpoint.restore(model)
+
+    fit_kwargs = {}
+    if full_dataset:
+        fit_kwargs.update(steps_per_epoch=len(train_data), validation_steps=len(valid_data))
+        if profiler:
+            train_data = profiler.time_input(train_data)
+    history = model.fit(train_data, validation_data=valid_data, epochs=epochs, initial_epoch=initial_epoch,
+                        verbose=verbose, callbacks=callbacks, **fit_kwargs)
+
+    results = {'epochs': len(history.history.get('loss', [])), 'checkpoint': checkpoint_path,
+               'stats': stats_path(checkpoint_path, key)}
+    if test:
+        test_images, test_labels = load_svhn('test')
+        test_labels = encode_labels(test_labels)
+        preds = model.predict(stats.standardize(test_images), batch_size=256, verbose=0)
+        results['test_accuracy'] = float(np.mean(np.argmax(preds, axis=1) == test_labels))
+        print('Test set accuracy score:', results['test_accuracy'])
+    return model, history, results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Trains the WRN on SVHN with the recipe of model_3_wide_resnet.py.')
+    parser.add_argument('--checkpoint', default='weights.best.cnn.hdf5', help='file the best weights are saved to')
+    parser.add_argument('--full-dataset', action='store_true', help='stream the whole train + extra set in shards')
+    parser.add_argument('--stop', type=int, default=100000, help='number of extra images to train on')
+    parser.add_argument('--shard-size', type=int, default=20000)
+    parser.add_argument('--buffer-shards', type=int, default=2)
+    parser.add_argument('--N', type=int, default=2, help='depth of the WRN, N = (n - 4) / 6')
+    parser.add_argument('--k', type=int, default=2, help='width of the WRN')
+    parser.add_argument('--dropout', type=float, default=0.0)
+    parser.add_argument('--lr', type=float, default=0.1)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--epochs', type=int, default=100, help='maximum epochs of the plateau schedule')
+    parser.add_argument('--schedule', default='plateau', choices=['plateau', 'onecycle', 'cosine'])
+    parser.add_argument('--schedule-epochs', type=int, default=15, help='epochs of the onecycle and cosine schedules')
+    parser.add_argument('--swa-epochs', type=int, default=0, help='epochs averaged after a fixed schedule')
+    parser.add_argument('--swa-lr', type=float, default=0.01)
+    parser.add_argument('--restore-best-weights', action='store_true',
+                        help='go back to the best weights whenever the lr is reduced')
+    parser.add_argument('--augment', action='store_true', help='augment the training batches, see svhn_augment.py')
+    parser.add_argument('--subsample-validation', action='store_true',
+                        help='validate on a subsample and on the full set every 5 epochs or on a new best')
+    parser.add_argument('--state', default='training_state.npz', help='training state saved every epoch')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume from the training state, which must have been saved with the same settings')
+    parser.add_argument('--profile', action='store_true', help='write the time of every phase to training_profile.jsonl')
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--no-test', action='store_true', help='do not score the test split at the end')
+    parser.add_argument('--report', help='.json file to write the epochs, test accuracy and history to')
+    args = parser.parse_args(args)
+
+    _, history, results = train(args.checkpoint, args.full_dataset, args.stop, args.shard_size, args.buffer_shards,
+                                args.N, args.k, args.dropout, args.lr, args.batch_size, args.epochs, args.schedule,
+                                args.schedule_epochs, args.swa_epochs, args.swa_lr, args.restore_best_weights,
+                                args.augment, args.subsample_validation, args.state, args.resume,
+                                args.profile, args.jit_compile, not args.no_test)
+    if args.report:
+        results['history'] = dict((key, [float(v) for v in values]) for key, values in history.history.items())
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
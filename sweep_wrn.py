@@ -0,0 +1,325 @@
+# Parallel hyperparameter sweeps of the WRN with early pruning
+# Every trial trains create_wide_residual_network with the callbacks of the script (EarlyStopping and
+# Custom_ReduceLROnPlateau) in its own process, with a limited number of threads. Trials are pruned
+# with asynchronous successive halving (ASHA): at every rung (epochs min_epochs * eta^i) a trial only
+# goes on if its val_loss is in the best 1/eta of the trials which reached that rung so far.
+# Configs, per-epoch metrics, rung values and wall times are all kept in a local SQLite database,
+# which is also how the trial processes see each other's results.
+#
+# The search space is a JSON file of parameter name to list of values, e.g.
+#   {"batch_size": [128, 512], "k": [2, 4], "dropout": [0.0, 0.2], "optimizer": ["sgd", "adam"],
+#    "lr": [0.1, 0.01], "patience": [4], "reduce_patience": [2], "dataset_size": [100000]}
+#
+# Example:
+#   python sweep_wrn.py space.json --workers 4 --threads-per-trial 4 --max-epochs 30 --db sweeps.db
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+import traceback
+
+# Values of the parameters a search space leaves out, the recipe of the script
+DEFAULTS = {
+    'N': 2,
+    'k': 2,
+    'dropout': 0.0,
+    'batch_size': 128,
+    'optimizer': 'sgd',
+    'lr': 0.1,
+    'patience': 4,
+    'reduce_patience': 2,
+    'reduce_factor': 0.1,
+    'dataset_size': 100000,
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep TEXT NOT NULL,
+    config TEXT NOT NULL,
+    status TEXT NOT NULL,
+    epochs INTEGER,
+    best_val_loss REAL,
+    best_val_accuracy REAL,
+    wall_time REAL,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS epochs (
+    trial_id INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    loss REAL,
+    accuracy REAL,
+    val_loss REAL,
+    val_accuracy REAL,
+    lr REAL,
+    seconds REAL,
+    PRIMARY KEY (trial_id, epoch)
+);
+CREATE TABLE IF NOT EXISTS rungs (
+    sweep TEXT NOT NULL,
+    rung INTEGER NOT NULL,
+    trial_id INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (sweep, rung, trial_id)
+);
+'''
+
+
+def connect(db_path):
+    # Trials write from several processes, wait for the lock instead of failing
+    connection = sqlite3.connect(db_path, timeout=60)
+    connection.executescript(SCHEMA)
+    # Databases of earlier sweeps have no error column yet
+    if 'error' not in [row[1] for row in connection.execute('PRAGMA table_info(trials)')]:
+        with connection:
+            connection.execute('ALTER TABLE trials ADD COLUMN error TEXT')
+    return connection
+
+
+def requeue_trials(connection, sweep):
+    """
+    Puts the trials a stopped run of the sweep left running back in the queue, without their epochs
+    :return: List of (trial_id, config) of the queued trials of the sweep
+    """
+    with connection:
+        stale = [row[0] for row in connection.execute(
+            "SELECT id FROM trials WHERE sweep = ? AND status = 'running'", (sweep,))]
+        for trial_id in stale:
+            connection.execute('DELETE FROM epochs WHERE trial_id = ?', (trial_id,))
+            connection.execute('DELETE FROM rungs WHERE sweep = ? AND trial_id = ?', (sweep, trial_id))
+            connection.execute("UPDATE trials SET status = 'queued', started = NULL WHERE id = ?", (trial_id,))
+    return [(trial_id, json.loads(config)) for trial_id, config in connection.execute(
+        "SELECT id, config FROM trials WHERE sweep = ? AND status = 'queued' ORDER BY id", (sweep,))]
+
+
+def expand_space(space, num_trials=None, seed=0):
+    """
+    Turns a search space into trial configs
+    :param space: dict of parameter name to list of values
+    :param num_trials: Number of configs sampled at random from the grid, None for the whole grid
+    :return: List of config dicts, completed with DEFAULTS
+    """
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+    if num_trials is not None and num_trials < len(grid):
+        grid = random.Random(seed).sample(grid, num_trials)
+
+    configs = []
+    for values in grid:
+        config = dict(DEFAULTS)
+        config.update(values)
+        configs.append(config)
+    return configs
+
+
+def rung_epochs(min_epochs, eta, max_epochs):
+    """Epochs at which trials are compared: min_epochs, min_epochs * eta, min_epochs * eta^2, ..."""
+    epochs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        epochs.append(epoch)
+        epoch *= eta
+    return epochs
+
+
+def is_promotable(connection, sweep, rung, trial_id, value, eta):
+    """
+    Records the val_loss of a trial at a rung and decides whether the trial goes on
+    Like ASHA, a trial goes on if it is in the best 1/eta of the trials that reached the rung so far,
+    and the first trials at a rung only go on if they are the best one.
+    """
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO rungs (sweep, rung, trial_id, value) VALUES (?, ?, ?, ?)',
+                           (sweep, rung, trial_id, value))
+    values = sorted(row[0] for row in connection.execute(
+        'SELECT value FROM rungs WHERE sweep = ? AND rung = ?', (sweep, rung)))
+    num_promoted = max(1, len(values) // eta)
+    return value <= values[num_promoted - 1]
+
+
+def load_data(config):
+    """Returns (images, labels, stats) of the dataset of a trial."""
+    if config.get('synthetic'):
+        from benchmark_wrn import synthetic_svhn
+        from svhn_data import encode_labels
+        from svhn_stats import compute_stats
+        images, labels = synthetic_svhn(config['dataset_size'])
+        return images, encode_labels(labels), compute_stats([(images, labels)])
+
+    # Every trial with the same dataset size memory-maps the same preprocessed slice
+    from svhn_cache import load_preprocessed
+    return load_preprocessed('extra', stop=config['dataset_size'])
+
+
+def run_trial(task):
+    """Trains one trial, returns (trial_id, status)."""
+    trial_id, sweep, config, db_path, threads, max_epochs, rungs, eta = task
+
+    connection = connect(db_path)
+    start = time.time()
+    with connection:
+        connection.execute("UPDATE trials SET status = 'running', started = ? WHERE id = ?", (start, trial_id))
+
+    # A failed trial is recorded as such, with its error, and must not stop the rest of the sweep
+    # An interrupted one is left running, for a restart of the sweep to queue it again
+    status, error = 'running', None
+    try:
+        # Thread limits have to be set before TensorFlow starts its thread pools
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+
+        from keras.callbacks import Callback, EarlyStopping
+        from keras.optimizers import SGD, Adam
+
+        from svhn_input import train_valid_datasets
+        from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+        from wrn_callbacks import Custom_ReduceLROnPlateau
+
+        images, labels, stats = load_data(config)
+        train_dataset, valid_dataset = train_valid_datasets(images, labels, stats.mean, stats.std,
+                                                            batch_size=config['batch_size'], cache=True)
+
+        model = create_wide_residual_network(images.shape[1:], nb_classes=10, N=config['N'], k=config['k'],
+                                             dropout=config['dropout'], verbose=0)
+        if config['optimizer'] == 'adam':
+            optimizer = Adam(lr=config['lr'])
+        else:
+            optimizer = SGD(lr=config['lr'], momentum=0.9, nesterov=config['optimizer'] == 'nesterov')
+        compile_wide_residual_network(model, optimizer)
+
+        class ASHAPruner(Callback):
+            """Records every epoch in the store and stops the trial when it is pruned at a rung."""
+
+            def on_epoch_begin(self, epoch, logs=None):
+                self.epoch_start = time.time()
+
+            def on_epoch_end(self, epoch, logs=None):
+                logs = logs or {}
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO epochs (trial_id, epoch, loss, accuracy, val_loss, val_accuracy, lr, seconds) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (trial_id, epoch + 1, logs.get('loss'), logs.get('accuracy', logs.get('acc')),
+                         logs.get('val_loss'), logs.get('val_accuracy', logs.get('val_acc')),
+                         float(logs['lr']) if 'lr' in logs else None, time.time() - self.epoch_start))
+
+                if epoch + 1 in rungs and logs.get('val_loss') is not None:
+                    if not is_promotable(connection, sweep, epoch + 1, trial_id, float(logs['val_loss']), eta):
+                        self.model.stop_training = True
+                        self.pruned = True
+
+        pruner = ASHAPruner()
+        pruner.pruned = False
+        callbacks = [EarlyStopping(monitor='val_loss', patience=config['patience']),
+                     Custom_ReduceLROnPlateau(monitor='val_loss', factor=config['reduce_factor'],
+                                              patience=config['reduce_patience'], min_delta=0.0001, min_lr=0),
+                     pruner]
+
+        model.fit(train_dataset, validation_data=valid_dataset, epochs=max_epochs, verbose=0, callbacks=callbacks)
+        status = 'pruned' if pruner.pruned else 'completed'
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+        print(error)
+    finally:
+        best = connection.execute('SELECT COUNT(*), MIN(val_loss), MAX(val_accuracy) FROM epochs WHERE trial_id = ?',
+                                  (trial_id,)).fetchone()
+        finished = time.time()
+        with connection:
+            connection.execute('UPDATE trials SET status = ?, epochs = ?, best_val_loss = ?, best_val_accuracy = ?, '
+                               'wall_time = ?, finished = ?, error = ? WHERE id = ?',
+                               (status, best[0], best[1], best[2], finished - start, finished, error, trial_id))
+        connection.close()
+    return trial_id, status
+
+
+def run_sweep(space, sweep, db_path='sweeps.db', workers=2, threads_per_trial=None, max_epochs=100,
+              min_epochs=2, eta=3, num_trials=None, synthetic=False, seed=0):
+    """
+    Runs the trials of a search space in a process pool
+    :return: List of the trial rows of the sweep, best val_loss first
+    """
+    if threads_per_trial is None:
+        threads_per_trial = max(1, (os.cpu_count() or 1) // workers)
+    rungs = rung_epochs(min_epochs, eta, max_epochs)
+
+    configs = expand_space(space, num_trials, seed)
+    if not synthetic:
+        # Preprocess every dataset size once, before the trials memory-map it
+        from svhn_cache import load_preprocessed
+        for dataset_size in sorted(set(config['dataset_size'] for config in configs)):
+            load_preprocessed('extra', stop=dataset_size, workers=os.cpu_count())
+
+    connection = connect(db_path)
+    if connection.execute('SELECT COUNT(*) FROM trials WHERE sweep = ?', (sweep,)).fetchone()[0]:
+        # A restarted sweep runs the trials it did not finish, the ones a stopped run left running start over
+        queued = requeue_trials(connection, sweep)
+    else:
+        queued = []
+        for config in configs:
+            config['synthetic'] = synthetic
+            with connection:
+                cursor = connection.execute("INSERT INTO trials (sweep, config, status) VALUES (?, ?, 'queued')",
+                                            (sweep, json.dumps(config, sort_keys=True)))
+            queued.append((cursor.lastrowid, config))
+    tasks = [(trial_id, sweep, config, db_path, threads_per_trial, max_epochs, rungs, eta)
+             for trial_id, config in queued]
+
+    print('Sweep %s: %d trials, %d at a time with %d threads each, rungs at epochs %s'
+          % (sweep, len(tasks), workers, threads_per_trial, rungs))
+
+    # A new process per trial, so that every trial starts with fresh TensorFlow state
+    pool = multiprocessing.get_context('spawn').Pool(workers, maxtasksperchild=1)
+    try:
+        for trial_id, status in pool.imap_unordered(run_trial, tasks):
+            print('Trial %d %s' % (trial_id, status))
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = connection.execute('SELECT id, status, epochs, best_val_loss, best_val_accuracy, wall_time, config '
+                              'FROM trials WHERE sweep = ? ORDER BY best_val_loss IS NULL, best_val_loss',
+                              (sweep,)).fetchall()
+    connection.close()
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Runs a pruned hyperparameter sweep of the WRN.')
+    parser.add_argument('space', help='JSON file of parameter name to list of values')
+    parser.add_argument('--sweep', help='name of the sweep, defaults to the name of the space file and the time. '
+                                        'The unfinished trials of an existing sweep are run again')
+    parser.add_argument('--db', default='sweeps.db')
+    parser.add_argument('--workers', type=int, default=2, help='number of trials run at a time')
+    parser.add_argument('--threads-per-trial', type=int)
+    parser.add_argument('--max-epochs', type=int, default=100)
+    parser.add_argument('--min-epochs', type=int, default=2, help='epochs of the first rung')
+    parser.add_argument('--eta', type=int, default=3, help='only the best 1/eta of the trials go on at every rung')
+    parser.add_argument('--num-trials', type=int, help='number of configs sampled from the grid, defaults to all')
+    parser.add_argument('--synthetic', action='store_true', help='train on synthetic images instead of SVHN')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    with open(args.space) as f:
+        space = json.load(f)
+    sweep = args.sweep or '%s-%s' % (os.path.splitext(os.path.basename(args.space))[0], time.strftime('%Y%m%d-%H%M%S'))
+
+    rows = run_sweep(space, sweep, args.db, args.workers, args.threads_per_trial, args.max_epochs,
+                     args.min_epochs, args.eta, args.num_trials, args.synthetic, args.seed)
+
+    print('\n%5s %10s %6s %10s %10s %9s  %s' % ('trial', 'status', 'epochs', 'val_loss', 'val_acc', 'time (s)', 'config'))
+    for trial_id, status, epochs, val_loss, val_accuracy, wall_time, config in rows:
+        print('%5d %10s %6s %10.4f %10.4f %9.0f  %s' % (trial_id, status, epochs, val_loss or float('nan'),
+                                                       val_accuracy or float('nan'), wall_time or 0, config))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import json
+
+from benchmark_wrn import compare, lower_is_better
+
+
+def record(metrics, **config):
+    base = {'N': 2, 'k': 2, 'batch_size': 128, 'dataset_size': 20000, 'data': 'synthetic',
+            'jit_compile': False, 'augment': False}
+    base.update(config)
+    return {'config': base, 'metrics': metrics}
+
+
+def test_lower_is_better_matches_emitted_metrics():
+    for metric in ('data_load_sec', 'peak_rss_mb', 'predict_bs32_latency_p50_ms', 'predict_bs1_latency_p99_ms',
+                   'train_sec', 'sec_per_epoch', 'epochs', 'epochs_to_0.95', 'time_to_0.95_sec'):
+        assert lower_is_better(metric), metric
+    for metric in ('train_images_per_sec', 'input_images_per_sec_epoch1', 'predict_bs32_images_per_sec'):
+        assert not lower_is_better(metric), metric
+
+
+def test_compare_flags_slowdown(tmp_path):
+    baseline = record({'predict_bs32_latency_p50_ms': 10., 'train_sec': 100., 'sec_per_epoch': 10.,
+                       'epochs': 10, 'epochs_to_0.95': 5, 'time_to_0.95_sec': 50., 'train_images_per_sec': 1000.})
+    slower = record({'predict_bs32_latency_p50_ms': 20., 'train_sec': 200., 'sec_per_epoch': 20.,
+                     'epochs': 20, 'epochs_to_0.95': 10, 'time_to_0.95_sec': 100., 'train_images_per_sec': 500.})
+    path = tmp_path / 'baseline.jsonl'
+    path.write_text(json.dumps(baseline) + '\n')
+
+    assert compare([slower], str(path)) == 7
+    assert compare([baseline], str(path)) == 0
+
+
+def test_compare_ignores_improvements(tmp_path):
+    baseline = record({'predict_bs32_latency_p50_ms': 20., 'train_sec': 200., 'train_images_per_sec': 500.})
+    faster = record({'predict_bs32_latency_p50_ms': 10., 'train_sec': 100., 'train_images_per_sec': 1000.})
+    path = tmp_path / 'baseline.jsonl'
+    path.write_text(json.dumps(baseline) + '\n')
+
+    assert compare([faster], str(path)) == 0
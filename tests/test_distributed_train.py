@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import time
+
+from distributed_train import wait_workers
+
+
+def start(code):
+    return subprocess.Popen([sys.executable, '-c', code])
+
+
+def test_wait_workers_succeeds():
+    assert wait_workers([start('pass'), start('import time; time.sleep(0.2)')], poll_interval=0.05) == 0
+
+
+def test_wait_workers_terminates_the_others_on_a_failure():
+    hanging = start('import time; time.sleep(60)')
+    began = time.time()
+    assert wait_workers([hanging, start('import sys; sys.exit(3)')], poll_interval=0.05) == 3
+    assert time.time() - began < 30
+    assert hanging.returncode is not None
+
+
+def test_wait_workers_reports_a_signal():
+    killed = start('import os, signal; os.kill(os.getpid(), signal.SIGKILL)')
+    assert wait_workers([start('import time; time.sleep(60)'), killed], poll_interval=0.05) == -9
@@ -0,0 +1,34 @@
+import importlib
+import os
+import re
+
+import pytest
+
+PYPROJECT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pyproject.toml')
+
+
+def console_scripts():
+    with open(PYPROJECT) as f:
+        section = f.read().split('[project.scripts]')[1].split('\n[')[0]
+    return re.findall(r'^([\w-]+) = "([\w.]+):(\w+)"$', section, re.MULTILINE)
+
+
+def test_there_are_entry_points():
+    assert len(console_scripts()) == 5
+
+
+@pytest.mark.parametrize('name, module, function', console_scripts())
+def test_entry_point_help(name, module, function, capsys):
+    main = getattr(importlib.import_module(module), function)
+    with pytest.raises(SystemExit) as exit_info:
+        main(['--help'])
+    assert exit_info.value.code == 0
+    assert capsys.readouterr().out.startswith('usage:')
+
+
+def test_build_model():
+    pytest.importorskip('tensorflow')
+    from svhn_wrn import IMAGE_SHAPE, create_wide_residual_network
+
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=2, k=2, verbose=0)
+    assert tuple(model.output_shape) == (None, 10)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from keras.layers import Input, Dense, BatchNormalization, Flatten
+from keras.models import Model
+from keras.optimizers import SGD
+
+from large_batch_wrn import LargeBatchModel
+
+
+def build(accumulation_steps, batch_norm=False):
+    inputs = Input((4, 4, 3))
+    x = Flatten()(inputs)
+    if batch_norm:
+        x = BatchNormalization()(x)
+    outputs = Dense(10, activation='softmax')(x)
+    model = LargeBatchModel(inputs, outputs, accumulation_steps=accumulation_steps)
+    model.compile(SGD(1.), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def batch(size, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.rand(size, 4, 4, 3).astype(np.float32), rng.randint(0, 10, size).astype(np.int8)
+
+
+@pytest.mark.parametrize('batch_size', [42, 5])
+def test_ragged_batch_with_batch_norm(batch_size):
+    model = build(accumulation_steps=8, batch_norm=True)
+    x, y = batch(batch_size)
+    loss, _ = model.train_on_batch(x, y)
+    assert np.isfinite(loss)
+    for weights in model.get_weights():
+        assert np.all(np.isfinite(weights))
+
+
+def test_ragged_batch_gradient_matches_full_batch():
+    accumulated, full = build(accumulation_steps=8), build(accumulation_steps=1)
+    full.set_weights(accumulated.get_weights())
+    x, y = batch(42)
+    accumulated.train_on_batch(x, y)
+    full.train_on_batch(x, y)
+    for a, b in zip(accumulated.get_weights(), full.get_weights()):
+        np.testing.assert_allclose(a, b, rtol=1e-4, atol=1e-6)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import predict_wrn
+from svhn_stats import load_stats
+
+
+@pytest.fixture
+def extra(monkeypatch):
+    images = np.random.RandomState(0).randint(0, 256, (64, 32, 32, 3)).astype(np.uint8)
+    calls = []
+
+    def load_svhn(name, stop=None):
+        calls.append((name, stop))
+        return images[:stop], np.ones(len(images[:stop]), dtype=np.uint8)
+
+    monkeypatch.setattr(predict_wrn, 'load_svhn', load_svhn)
+    return images, calls
+
+
+def test_find_stats_computes_the_stats_of_the_shipped_weights(tmp_path, extra):
+    images, calls = extra
+    weights_path = str(tmp_path / 'model_weights.h5')
+
+    path = predict_wrn.find_stats(weights_path)
+    assert path == str(tmp_path / 'model_weights.extra_0_100000.stats.npz')
+    assert calls == [('extra', 100000)]
+    np.testing.assert_allclose(load_stats(path).mean.ravel(), images.mean(axis=(0, 1, 2)), rtol=1e-5)
+
+    # Found next to the weights from then on
+    assert predict_wrn.find_stats(weights_path) == path
+    assert len(calls) == 1
+
+
+def test_find_stats_of_other_weights_raises(tmp_path, extra):
+    with pytest.raises(ValueError, match='--stats'):
+        predict_wrn.find_stats(str(tmp_path / 'student_weights.h5'))
+    with pytest.raises(ValueError, match='--stats'):
+        predict_wrn.find_stats(str(tmp_path / 'model_weights.h5'), compute=False)
+    assert extra[1] == []
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from serve_wrn import MicroBatcher
+
+
+def images(n):
+    return np.zeros((n, 32, 32, 3), dtype=np.uint8)
+
+
+def test_requests_are_batched():
+    sizes = []
+
+    def predict(batch):
+        sizes.append(len(batch))
+        return np.ones((len(batch), 10), dtype=np.float32)
+
+    async def run():
+        batcher = MicroBatcher(predict, max_batch_size=8, max_wait_ms=50., workers=1)
+        batcher.start()
+        outputs = await asyncio.gather(*[batcher.submit(images(1)) for _ in range(8)])
+        await batcher.stop()
+        return outputs
+
+    outputs = asyncio.run(run())
+    assert [len(output) for output in outputs] == [1] * 8
+    assert sum(sizes) == 8 and max(sizes) > 1
+
+
+def test_stop_waits_for_the_running_batches():
+    started, release = threading.Event(), threading.Event()
+
+    def predict(batch):
+        started.set()
+        release.wait(10)
+        return np.ones((len(batch), 10), dtype=np.float32)
+
+    async def run():
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=1., workers=1)
+        batcher.start()
+        request = asyncio.ensure_future(batcher.submit(images(2)))
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, started.wait, 10)
+        assert len(batcher._tasks) == 1
+
+        stopping = asyncio.ensure_future(batcher.stop())
+        await asyncio.sleep(0.05)
+        assert not stopping.done()
+        release.set()
+        await stopping
+        assert not batcher._tasks
+        return await request
+
+    assert asyncio.run(run()).shape == (2, 10)
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import sweep_wrn
+
+
+def add_trial(connection, sweep, status, config=None):
+    with connection:
+        cursor = connection.execute('INSERT INTO trials (sweep, config, status) VALUES (?, ?, ?)',
+                                    (sweep, json.dumps(config or dict(sweep_wrn.DEFAULTS)), status))
+    return cursor.lastrowid
+
+
+def test_requeue_trials_left_running(tmp_path):
+    connection = sweep_wrn.connect(str(tmp_path / 'sweeps.db'))
+    completed = add_trial(connection, 'a', 'completed')
+    running = add_trial(connection, 'a', 'running', {'k': 4})
+    queued = add_trial(connection, 'a', 'queued')
+    other = add_trial(connection, 'b', 'running')
+    with connection:
+        for trial_id in (completed, running):
+            connection.execute('INSERT INTO epochs (trial_id, epoch, val_loss) VALUES (?, 1, 0.5)', (trial_id,))
+            connection.execute("INSERT INTO rungs (sweep, rung, trial_id, value) VALUES ('a', 1, ?, 0.5)",
+                               (trial_id,))
+
+    assert sweep_wrn.requeue_trials(connection, 'a') == [(running, {'k': 4}), (queued, dict(sweep_wrn.DEFAULTS))]
+    statuses = dict(connection.execute('SELECT id, status FROM trials'))
+    assert statuses == {completed: 'completed', running: 'queued', queued: 'queued', other: 'running'}
+    assert [row[0] for row in connection.execute('SELECT trial_id FROM epochs')] == [completed]
+    assert [row[0] for row in connection.execute('SELECT trial_id FROM rungs')] == [completed]
+
+
+def test_failed_data_loading_marks_the_trial_failed(tmp_path, monkeypatch):
+    tf = pytest.importorskip('tensorflow')
+    # TensorFlow may have started its thread pools in another test already
+    monkeypatch.setattr(tf.config.threading, 'set_intra_op_parallelism_threads', lambda threads: None)
+    monkeypatch.setattr(tf.config.threading, 'set_inter_op_parallelism_threads', lambda threads: None)
+
+    def load_data(config):
+        raise IOError('extra_32x32.mat is missing')
+    monkeypatch.setattr(sweep_wrn, 'load_data', load_data)
+
+    db_path = str(tmp_path / 'sweeps.db')
+    connection = sweep_wrn.connect(db_path)
+    trial_id = add_trial(connection, 'a', 'queued')
+
+    task = (trial_id, 'a', dict(sweep_wrn.DEFAULTS), db_path, 1, 2, [], 3)
+    assert sweep_wrn.run_trial(task) == (trial_id, 'failed')
+    status, error = connection.execute('SELECT status, error FROM trials WHERE id = ?', (trial_id,)).fetchone()
+    assert status == 'failed'
+    assert 'extra_32x32.mat is missing' in error
@@ -0,0 +1,18 @@
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from keras.optimizers import SGD
+
+from svhn_data import IMAGE_SHAPE
+from wide_resnet import create_wide_residual_network, compile_wide_residual_network
+
+
+def test_jit_compile_needs_tensorflow_2_8(monkeypatch):
+    model = create_wide_residual_network(IMAGE_SHAPE, nb_classes=10, N=1, k=1, verbose=0)
+    monkeypatch.setattr(tf, '__version__', '2.7.4')
+    with pytest.raises(ValueError, match='TensorFlow 2.8 or later, found 2.7.4'):
+        compile_wide_residual_network(model, SGD(), jit_compile=True)
+
+    # Without XLA the older versions are fine
+    compile_wide_residual_network(model, SGD())
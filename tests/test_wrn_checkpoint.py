@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from keras.layers import Input, Dense, Flatten
+from keras.models import Model
+from keras.optimizers import SGD
+
+from wrn_checkpoint import TrainingStateCheckpoint
+
+CONFIG = {'data': 'extra_0_100000', 'N': 2, 'k': 2, 'batch_size': 128, 'schedule': 'plateau'}
+
+
+def build():
+    inputs = Input((4, 4, 3))
+    model = Model(inputs, Dense(10, activation='softmax')(Flatten()(inputs)))
+    model.compile(SGD(0.1, momentum=0.9), loss='sparse_categorical_crossentropy')
+    return model
+
+
+def train(path, config, epochs=2):
+    rng = np.random.RandomState(0)
+    x, y = rng.rand(32, 4, 4, 3).astype(np.float32), rng.randint(0, 10, 32)
+    model = build()
+    checkpoint = TrainingStateCheckpoint(path, config=config)
+    model.fit(x, y, batch_size=16, epochs=epochs, verbose=0, callbacks=[checkpoint])
+    return model
+
+
+def test_resumes_a_state_saved_with_the_same_config(tmp_path):
+    path = str(tmp_path / 'training_state.npz')
+    trained = train(path, dict(CONFIG))
+
+    model = build()
+    assert TrainingStateCheckpoint(path, config=dict(CONFIG)).restore(model) == 2
+    for a, b in zip(model.get_weights(), trained.get_weights()):
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('change', [{'k': 4}, {'data': 'extra_0_200000'}, {'batch_size': 512}])
+def test_refuses_a_state_saved_with_another_config(tmp_path, change):
+    path = str(tmp_path / 'training_state.npz')
+    train(path, dict(CONFIG))
+
+    config = dict(CONFIG, **change)
+    with pytest.raises(ValueError, match='saved with the settings'):
+        TrainingStateCheckpoint(path, config=config).restore(build())
+
+
+def test_saves_the_state_of_wrapped_callbacks(tmp_path):
+    from keras.callbacks import ModelCheckpoint
+    from wrn_profiler import TrainingProfiler
+
+    path = str(tmp_path / 'training_state.npz')
+    model_checkpoint = ModelCheckpoint(str(tmp_path / 'weights.h5'), save_best_only=True, save_weights_only=True)
+    wrapped = TrainingProfiler(str(tmp_path / 'profile.jsonl')).wrap(model_checkpoint, 'checkpoint')
+    model_checkpoint.best = 0.25
+    state = TrainingStateCheckpoint(path, callbacks=[wrapped])
+    state.set_model(build())
+    state.on_epoch_end(0)
+    state.wait()
+
+    restored = ModelCheckpoint(str(tmp_path / 'weights.h5'), save_best_only=True, save_weights_only=True)
+    resumed = TrainingStateCheckpoint(path, callbacks=[TrainingProfiler(str(tmp_path / 'profile.jsonl'))
+                                                       .wrap(restored, 'checkpoint')])
+    assert resumed.restore(build()) == 1
+    resumed.on_epoch_begin(1)
+    assert restored.best == 0.25
@@ -0,0 +1,395 @@
+# Training callbacks
+
+import math
+import warnings
+import numpy as np
+
+from keras.callbacks import Callback
+from keras import backend as K
+
+
+# Customise ReduceLROnPlateau callback to restore the best model weights after reducing LR
+# Copied from source code - https://github.com/keras-team/keras/blob/master/keras/callbacks.py
+# Added code to snapshot the best weights in memory and restore them when the LR is reduced
+
+class Custom_ReduceLROnPlateau(Callback):
+    """Reduce learning rate when a metric has stopped improving.
+    Models often benefit from reducing the learning rate by a factor
+    of 2-10 once learning stagnates. This callback monitors a
+    quantity and if no improvement is seen for a 'patience' number
+    of epochs, the learning rate is reduced.
+    # Example
+    ```python
+    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.2,
+                                  patience=5, min_lr=0.001)
+    model.fit(X_train, Y_train, callbacks=[reduce_lr])
+    ```
+    # Arguments
+        monitor: quantity to be monitored.
+        factor: factor by which the learning rate will
+            be reduced. new_lr = lr * factor
+        patience: number of epochs with no improvement
+            after which learning rate will be reduced.
+        verbose: int. 0: quiet, 1: update messages.
+        mode: one of {auto, min, max}. In `min` mode,
+            lr will be reduced when the quantity
+            monitored has stopped decreasing; in `max`
+            mode it will be reduced when the quantity
+            monitored has stopped increasing; in `auto`
+            mode, the direction is automatically inferred
+            from the name of the monitored quantity.
+        min_delta: threshold for measuring the new optimum,
+            to only focus on significant changes.
+        cooldown: number of epochs to wait before resuming
+            normal operation after lr has been reduced.
+        min_lr: lower bound on the learning rate.
+        restore_best_weights: whether to restore the weights of the best
+            epoch when the learning rate is reduced. The weights are
+            snapshotted in memory whenever the monitored quantity improves,
+            so it works on any model without reading a checkpoint file.
+        restore_optimizer: whether to also snapshot and restore the
+            optimizer state (e.g. the momentum), so training resumes
+            exactly as it was at the best epoch but with the new lr.
+    """
+
+    def __init__(self, monitor='val_loss', factor=0.1, patience=10,
+                 verbose=0, mode='auto', min_delta=1e-4, cooldown=0, min_lr=0,
+                 restore_best_weights=True, restore_optimizer=False, **kwargs):
+        super(Custom_ReduceLROnPlateau, self).__init__()
+
+        self.monitor = monitor
+        if factor >= 1.0:
+            raise ValueError('ReduceLROnPlateau '
+                             'does not support a factor >= 1.0.')
+        if 'epsilon' in kwargs:
+            min_delta = kwargs.pop('epsilon')
+            warnings.warn('`epsilon` argument is deprecated and '
+                          'will be removed, use `min_delta` instead.')
+        self.factor = factor
+        self.min_lr = min_lr
+        self.min_delta = min_delta
+        self.patience = patience
+        self.verbose = verbose
+        self.cooldown = cooldown
+        self.cooldown_counter = 0  # Cooldown counter.
+        self.wait = 0
+        self.best = 0
+        self.mode = mode
+        self.monitor_op = None
+        self.restore_best_weights = restore_best_weights
+        self.restore_optimizer = restore_optimizer
+        self.best_weights = None
+        self.best_optimizer_weights = None
+        self._reset()
+
+    def _reset(self):
+        """Resets wait counter and cooldown counter.
+        """
+        if self.mode not in ['auto', 'min', 'max']:
+            warnings.warn('Learning Rate Plateau Reducing mode %s is unknown, '
+                          'fallback to auto mode.' % (self.mode),
+                          RuntimeWarning)
+            self.mode = 'auto'
+        if (self.mode == 'min' or
+           (self.mode == 'auto' and 'acc' not in self.monitor)):
+            self.monitor_op = lambda a, b: np.less(a, b - self.min_delta)
+            self.best = np.inf
+        else:
+            self.monitor_op = lambda a, b: np.greater(a, b + self.min_delta)
+            self.best = -np.inf
+        self.cooldown_counter = 0
+        self.wait = 0
+
+    def on_train_begin(self, logs=None):
+        self._reset()
+        self.best_weights = None
+        self.best_optimizer_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        logs['lr'] = K.get_value(self.model.optimizer.lr)
+        current = logs.get(self.monitor)
+        if current is None:
+            warnings.warn(
+                'Reduce LR on plateau conditioned on metric `%s` '
+                'which is not available. Available metrics are: %s' %
+                (self.monitor, ','.join(list(logs.keys()))), RuntimeWarning
+            )
+
+        else:
+            if self.in_cooldown():
+                self.cooldown_counter -= 1
+                self.wait = 0
+
+            if self.monitor_op(current, self.best):
+                self.best = current
+                self.wait = 0
+                if self.restore_best_weights:
+                    self._snapshot()
+            elif not self.in_cooldown():
+                self.wait += 1
+                if self.wait >= self.patience:
+                    old_lr = float(K.get_value(self.model.optimizer.lr))
+                    if old_lr > self.min_lr:
+                        new_lr = old_lr * self.factor
+                        new_lr = max(new_lr, self.min_lr)
+                        # Restore the best weights before setting the new lr,
+                        # as the optimizer snapshot may hold the old one
+                        if self.restore_best_weights and self.best_weights is not None:
+                            self._restore()
+                        K.set_value(self.model.optimizer.lr, new_lr)
+
+                        if self.verbose > 0:
+                            print('\nEpoch %05d: ReduceLROnPlateau reducing '
+                                  'learning rate to %s.' % (epoch + 1, new_lr))
+                        self.cooldown_counter = self.cooldown
+                        self.wait = 0
+
+    def in_cooldown(self):
+        return self.cooldown_counter > 0
+
+    def _snapshot(self):
+        """Copies the current weights (and optimizer state) into memory.
+        """
+        self.best_weights = self.model.get_weights()
+        if self.restore_optimizer:
+            self.best_optimizer_weights = self.model.optimizer.get_weights()
+
+    def _restore(self):
+        """Sets the model (and optimizer) back to the best snapshot.
+        """
+        self.model.set_weights(self.best_weights)
+        if self.restore_optimizer and self.best_optimizer_weights:
+            self.model.optimizer.set_weights(self.best_optimizer_weights)
+
+
+# Proactive learning rate schedules
+# ReduceLROnPlateau waits `patience` epochs for every plateau before it acts. These schedules fix the
+# learning rate of every step in advance over a set number of epochs instead.
+
+class LearningRateSchedule(Callback):
+    """Base class of the schedules which set the learning rate before every batch.
+
+    Subclasses implement `schedule(progress)`, the learning rate after
+    `progress` epochs. After `epochs` epochs the learning rate is left
+    alone, e.g. to StochasticWeightAveraging.
+
+    # Arguments
+        epochs: length of the schedule.
+        steps_per_epoch: number of batches per epoch, defaults to the one fit knows.
+    """
+
+    def __init__(self, epochs, steps_per_epoch=None):
+        super(LearningRateSchedule, self).__init__()
+        self.epochs = epochs
+        self.steps_per_epoch = steps_per_epoch
+        self.epoch = 0
+
+    def schedule(self, progress):
+        raise NotImplementedError
+
+    def on_train_begin(self, logs=None):
+        if self.steps_per_epoch is None:
+            self.steps_per_epoch = self.params.get('steps')
+        if not self.steps_per_epoch:
+            raise ValueError('%s needs steps_per_epoch when fit does not know the number of steps.'
+                             % type(self).__name__)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_batch_begin(self, batch, logs=None):
+        progress = self.epoch + batch / float(self.steps_per_epoch)
+        if progress < self.epochs:
+            K.set_value(self.model.optimizer.lr, self.schedule(progress))
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None:
+            logs['lr'] = K.get_value(self.model.optimizer.lr)
+
+
+class OneCycleLR(LearningRateSchedule):
+    """One-cycle schedule (Smith & Topin, 2018).
+
+    The learning rate rises from max_lr / div_factor to max_lr over the
+    first warmup_fraction of the epochs, then anneals down to
+    max_lr / (div_factor * final_div_factor), both along half cosines.
+
+    # Arguments
+        max_lr: peak learning rate.
+        epochs: length of the cycle.
+        steps_per_epoch: number of batches per epoch, defaults to the one fit knows.
+        warmup_fraction: fraction of the cycle spent rising.
+        div_factor: ratio of the peak to the initial learning rate.
+        final_div_factor: ratio of the initial to the final learning rate.
+    """
+
+    def __init__(self, max_lr, epochs, steps_per_epoch=None, warmup_fraction=0.3,
+                 div_factor=25., final_div_factor=1e4):
+        super(OneCycleLR, self).__init__(epochs, steps_per_epoch)
+        self.max_lr = max_lr
+        self.warmup_fraction = warmup_fraction
+        self.initial_lr = max_lr / div_factor
+        self.final_lr = self.initial_lr / final_div_factor
+
+    def schedule(self, progress):
+        fraction = progress / float(self.epochs)
+        if fraction < self.warmup_fraction:
+            start, stop, t = self.initial_lr, self.max_lr, fraction / self.warmup_fraction
+        else:
+            start, stop, t = self.max_lr, self.final_lr, (fraction - self.warmup_fraction) / (1. - self.warmup_fraction)
+        return stop + (start - stop) * (1. + math.cos(math.pi * t)) / 2.
+
+
+class CosineAnnealingWarmRestarts(LearningRateSchedule):
+    """Cosine annealing with warm restarts, SGDR (Loshchilov & Hutter, 2017).
+
+    The learning rate follows `cycles` half cosines from max_lr down to
+    min_lr, every cycle cycle_mult times longer than the previous one. The
+    length of the first cycle is chosen so that the last one ends after
+    `epochs` epochs.
+
+    # Arguments
+        max_lr: learning rate at every restart.
+        epochs: length of the schedule.
+        steps_per_epoch: number of batches per epoch, defaults to the one fit knows.
+        cycles: number of cycles.
+        cycle_mult: growth of the cycle length from one cycle to the next.
+        min_lr: learning rate at the end of every cycle.
+    """
+
+    def __init__(self, max_lr, epochs, steps_per_epoch=None, cycles=3, cycle_mult=2., min_lr=0.):
+        super(CosineAnnealingWarmRestarts, self).__init__(epochs, steps_per_epoch)
+        self.max_lr = max_lr
+        self.min_lr = min_lr
+        self.cycle_mult = cycle_mult
+        self.first_cycle = epochs / sum(cycle_mult ** i for i in range(cycles))
+
+    def schedule(self, progress):
+        t, length = progress, self.first_cycle
+        while t >= length:
+            t -= length
+            length *= self.cycle_mult
+        return self.min_lr + (self.max_lr - self.min_lr) * (1. + math.cos(math.pi * t / length)) / 2.
+
+
+SCHEDULES = {'onecycle': OneCycleLR, 'cosine': CosineAnnealingWarmRestarts}
+
+
+def recalibrate_batch_norm(model, batches, max_batches=None):
+    """
+    Recomputes the moving mean and variance of every BatchNormalization layer of the model
+    The statistics are averaged over the batches, each taken in training mode as during training, so
+    they match weights which were never trained with them, e.g. averaged weights.
+    :param batches: Iterable of (x, y) or x batches, e.g. the training dataset
+    :param max_batches: Number of batches to use at most, None for all of them
+    :return: Number of images the statistics were computed over
+    """
+    import tensorflow as tf
+    from keras.layers import BatchNormalization
+    from keras.models import Model
+
+    layers = [layer for layer in model.layers if isinstance(layer, BatchNormalization)]
+    if not layers:
+        return 0
+    probe = Model(model.inputs, [layer.input for layer in layers])
+    reduce_axes = []
+    for layer in layers:
+        rank = len(layer.input.shape)
+        axes = layer.axis if isinstance(layer.axis, (list, tuple)) else [layer.axis]
+        axes = [axis % rank for axis in axes]
+        reduce_axes.append([axis for axis in range(rank) if axis not in axes])
+
+    @tf.function
+    def moments(x):
+        outputs = probe(x, training=True)
+        if len(layers) == 1:
+            outputs = [outputs]
+        return [tf.nn.moments(output, axes=axes) for output, axes in zip(outputs, reduce_axes)]
+
+    count = 0
+    sums = None
+    for i, batch in enumerate(batches):
+        if max_batches is not None and i >= max_batches:
+            break
+        x = batch[0] if isinstance(batch, (list, tuple)) else batch
+        size = int(x.shape[0])
+        values = [(mean.numpy() * size, variance.numpy() * size) for mean, variance in moments(x)]
+        sums = values if sums is None else [(m + vm, v + vv) for (m, v), (vm, vv) in zip(sums, values)]
+        count += size
+
+    if count:
+        updates = []
+        for layer, (mean_sum, variance_sum) in zip(layers, sums):
+            updates.append((layer.moving_mean, mean_sum / count))
+            updates.append((layer.moving_variance, variance_sum / count))
+        K.batch_set_value(updates)
+    return count
+
+
+class StochasticWeightAveraging(Callback):
+    """Averages the weights of the last epochs, SWA (Izmailov et al., 2018).
+
+    From start_epoch on, the weights at the end of every `period` epochs
+    are added to a running average. At the end of training the model is
+    given the averaged weights and its BatchNormalization statistics are
+    recomputed on `data`, as the moving averages of the trained weights do
+    not hold for the averaged ones.
+
+    # Arguments
+        start_epoch: first epoch (counted from 0) whose weights are averaged.
+        data: batches of training images the BatchNormalization statistics
+            are recomputed on, e.g. the training dataset, or a function
+            returning them, e.g. `lambda: scheduler.epoch_batches(0)`.
+            None keeps the averaged moving statistics.
+        swa_lr: constant learning rate from start_epoch on, None to leave
+            the learning rate to the other callbacks.
+        period: number of epochs between two averaged weights, e.g. the
+            cycle length of a cyclic schedule.
+        max_batches: number of batches to recompute the statistics on at
+            most, None for all of them.
+        verbose: int. 0: quiet, 1: update messages.
+    """
+
+    def __init__(self, start_epoch, data=None, swa_lr=None, period=1, max_batches=None, verbose=0):
+        super(StochasticWeightAveraging, self).__init__()
+        self.start_epoch = start_epoch
+        self.data = data
+        self.swa_lr = swa_lr
+        self.period = period
+        self.max_batches = max_batches
+        self.verbose = verbose
+        self.swa_weights = None
+        self.swa_count = 0
+
+    def on_train_begin(self, logs=None):
+        self.swa_weights = None
+        self.swa_count = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if self.swa_lr is not None and epoch >= self.start_epoch:
+            K.set_value(self.model.optimizer.lr, self.swa_lr)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if epoch < self.start_epoch or (epoch + 1 - self.start_epoch) % self.period:
+            return
+        weights = self.model.get_weights()
+        if self.swa_weights is None:
+            self.swa_weights = [np.array(w, dtype=np.float64) for w in weights]
+        else:
+            for average, w in zip(self.swa_weights, weights):
+                average += (w - average) / (self.swa_count + 1.)
+        self.swa_count += 1
+
+    def on_train_end(self, logs=None):
+        if self.swa_weights is None:
+            return
+        self.model.set_weights([average.astype(w.dtype) for average, w
+                                in zip(self.swa_weights, self.model.get_weights())])
+        count = 0
+        if self.data is not None:
+            batches = self.data() if callable(self.data) else self.data
+            count = recalibrate_batch_norm(self.model, batches, self.max_batches)
+        if self.verbose > 0:
+            print('\nStochasticWeightAveraging: set the average of %d weights, '
+                  'BatchNormalization statistics recomputed on %d images' % (self.swa_count, count))
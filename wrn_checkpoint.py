@@ -0,0 +1,205 @@
+# Resumable training checkpoints
+# ModelCheckpoint only saves the weights, so a job stopped half way had to be revived by hand with a
+# guessed learning rate (see 'Code for reviving the model' in the notes). TrainingStateCheckpoint
+# saves everything training depends on at the end of every epoch: the weights, the optimizer slots
+# (e.g. the momentum), the learning rate, the epoch, the counters of callbacks such as EarlyStopping
+# and ReduceLROnPlateau, the RNG states and the epoch of the data schedulers. The state is copied in
+# memory on the training thread and written to disk on a background thread, to a temporary file which
+# is then renamed, so a job killed while writing keeps the previous checkpoint. The settings of the run
+# are saved along, and a state saved with other settings is refused instead of silently resumed.
+#
+# Usage:
+#   checkpoint = TrainingStateCheckpoint('training_state.npz', callbacks=callbacks, data=[train_generator],
+#                                        config={'N': 2, 'k': 2, 'data': 'extra_0_100000', 'batch_size': 128})
+#   initial_epoch = checkpoint.restore(model)
+#   model.fit(..., initial_epoch=initial_epoch, callbacks=callbacks + [checkpoint])
+
+import json
+import os
+import random
+import threading
+import numpy as np
+
+from keras.callbacks import Callback
+from keras import backend as K
+
+# Attributes of the Keras callbacks which carry their state from one epoch to the next
+CALLBACK_STATE = ('wait', 'best', 'cooldown_counter', 'stopped_epoch', 'best_epoch', 'swa_count')
+
+# Snapshots of weights held by callbacks, e.g. Custom_ReduceLROnPlateau, EarlyStopping(restore_best_weights=True)
+# and StochasticWeightAveraging
+CALLBACK_ARRAYS = ('best_weights', 'best_optimizer_weights', 'swa_weights')
+
+
+def _optimizer_variables(model):
+    """Returns the variables of the optimizer, creating its slots first if training has not started."""
+    optimizer = model.optimizer
+    if hasattr(optimizer, 'build'):
+        # tf.keras 2.11+ optimizers
+        optimizer.build(model.trainable_weights)
+        variables = optimizer.variables
+        return list(variables() if callable(variables) else variables)
+    if hasattr(optimizer, '_create_all_weights'):
+        optimizer._create_all_weights(model.trainable_weights)
+    return list(optimizer.weights)
+
+
+def _learning_rate(optimizer):
+    return optimizer.lr if hasattr(optimizer, 'lr') else optimizer.learning_rate
+
+
+class TrainingStateCheckpoint(Callback):
+    """Saves the complete training state at the end of every epoch, in the background.
+
+    # Arguments
+        filepath: .npz file the state is saved to.
+        callbacks: the other callbacks of the training, whose counters are saved.
+        data: batch generators serving one epoch per training epoch, with a
+            `set_epoch` method, e.g. ShardScheduler. They are set back to the
+            resumed epoch, so the data order goes on as if training had not
+            stopped. The order of a tf.data pipeline comes from its own seed
+            and is not resumed.
+        period: number of epochs between two checkpoints.
+        config: JSON-serializable dict of the settings the training state
+            depends on, e.g. the model size, data slice, batch size and
+            schedule. It is saved with the state, and `restore` refuses a
+            state saved with a different config.
+    """
+
+    def __init__(self, filepath, callbacks=(), data=(), period=1, config=None):
+        super(TrainingStateCheckpoint, self).__init__()
+        self.filepath = filepath
+        # As it reads back from the JSON of the state, e.g. tuples become lists
+        self.config = json.loads(json.dumps(config)) if config is not None else None
+        # The state of a wrapped callback, e.g. a ModelCheckpoint timed by TrainingProfiler.wrap, is on the
+        # callback inside the wrapper
+        self.callbacks = [getattr(callback, 'callback', callback) for callback in callbacks if callback is not self]
+        self.data = list(data)
+        self.period = period
+        self._thread = None
+        self._error = None
+        self._pending_callback_states = None
+
+    def _snapshot(self, epoch):
+        """Copies the training state into memory, so training can go on while it is written."""
+        state = {'epoch': epoch + 1,
+                 'config': self.config,
+                 'lr': float(K.get_value(_learning_rate(self.model.optimizer))),
+                 'python_random': random.getstate(),
+                 'callbacks': []}
+        arrays = {}
+        for i, value in enumerate(self.model.get_weights()):
+            arrays['weights_%d' % i] = value
+        for i, value in enumerate(K.batch_get_value(_optimizer_variables(self.model))):
+            arrays['optimizer_%d' % i] = value
+
+        numpy_state = np.random.get_state()
+        arrays['numpy_random_keys'] = numpy_state[1]
+        state['numpy_random'] = [numpy_state[0], int(numpy_state[2]), int(numpy_state[3]), float(numpy_state[4])]
+        try:
+            import tensorflow as tf
+            arrays['tf_random'] = tf.random.get_global_generator().state.numpy()
+        except (ImportError, AttributeError):
+            pass
+
+        for i, callback in enumerate(self.callbacks):
+            values = {}
+            for name in CALLBACK_STATE:
+                if hasattr(callback, name):
+                    values[name] = float(getattr(callback, name))
+            for name in CALLBACK_ARRAYS:
+                weights = getattr(callback, name, None)
+                if weights is not None:
+                    values[name] = len(weights)
+                    for j, value in enumerate(weights):
+                        arrays['callback_%d_%s_%d' % (i, name, j)] = np.array(value)
+            state['callbacks'].append(values)
+        return state, arrays
+
+    def _write(self, state, arrays):
+        try:
+            tmp_path = '%s.%d.tmp.npz' % (os.path.splitext(self.filepath)[0], os.getpid())
+            np.savez(tmp_path, state=np.array(json.dumps(state)), **arrays)
+            os.replace(tmp_path, self.filepath)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """Waits for the checkpoint being written, and raises its error if writing it failed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def on_epoch_begin(self, epoch, logs=None):
+        # The callbacks reset their counters in on_train_begin, so restored counters are set afterwards
+        if self._pending_callback_states is not None:
+            for callback, values in zip(self.callbacks, self._pending_callback_states):
+                for name, value in values.items():
+                    setattr(callback, name, value)
+            self._pending_callback_states = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.period:
+            return
+        state, arrays = self._snapshot(epoch)
+        # Only one checkpoint is written at a time, the previous one has nearly always finished
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(state, arrays))
+        self._thread.start()
+
+    def on_train_end(self, logs=None):
+        self.wait()
+
+    def restore(self, model):
+        """
+        Restores the training state saved in filepath, if there is one
+        Call it after compiling the model and before fit, and pass the returned epoch to fit as initial_epoch.
+        :return: The epoch to resume from, 0 if there is no checkpoint
+        :raises ValueError: If the state was saved with another config
+        """
+        if not os.path.exists(self.filepath):
+            return 0
+
+        with np.load(self.filepath) as data:
+            arrays = dict((key, data[key]) for key in data.files)
+        state = json.loads(str(arrays.pop('state')))
+        if self.config is not None and state.get('config') != self.config:
+            raise ValueError('%s was saved with the settings %s, not %s. Delete it or save the training state to '
+                             'another file to start from scratch.'
+                             % (self.filepath, json.dumps(state.get('config'), sort_keys=True),
+                                json.dumps(self.config, sort_keys=True)))
+
+        model.set_weights([arrays['weights_%d' % i] for i in range(len(model.get_weights()))])
+        variables = _optimizer_variables(model)
+        K.batch_set_value([(variable, arrays['optimizer_%d' % i]) for i, variable in enumerate(variables)])
+        K.set_value(_learning_rate(model.optimizer), state['lr'])
+
+        random.setstate(tuple(tuple(value) if isinstance(value, list) else value
+                              for value in state['python_random']))
+        name, pos, has_gauss, cached_gaussian = state['numpy_random']
+        np.random.set_state((name, arrays['numpy_random_keys'], pos, has_gauss, cached_gaussian))
+        if 'tf_random' in arrays:
+            import tensorflow as tf
+            tf.random.get_global_generator().reset(arrays['tf_random'])
+
+        for generator in self.data:
+            generator.set_epoch(state['epoch'])
+
+        callback_states = []
+        for i, values in enumerate(state['callbacks']):
+            restored = {}
+            for name, value in values.items():
+                if name in CALLBACK_ARRAYS:
+                    restored[name] = [arrays['callback_%d_%s_%d' % (i, name, j)] for j in range(int(value))]
+                elif name in ('wait', 'cooldown_counter', 'stopped_epoch', 'best_epoch', 'swa_count'):
+                    restored[name] = int(value)
+                else:
+                    restored[name] = value
+            callback_states.append(restored)
+        self._pending_callback_states = callback_states
+
+        print('Resuming from epoch %d of %s, learning rate %g' % (state['epoch'], self.filepath, state['lr']))
+        return state['epoch']
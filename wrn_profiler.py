@@ -0,0 +1,234 @@
+# Training profiler
+# Breaks every epoch of model.fit / fit_generator into the time spent waiting for input, in the
+# training steps, in the validation pass and in the end-of-epoch callbacks such as ModelCheckpoint.
+# Every step and every epoch is written as a JSON line to a log file, and a summary of the phases is
+# printed at the end of training. The TF profiler can also trace a few steps for per-layer op times,
+# which are viewed in the Profile tab of TensorBoard.
+#
+# Usage:
+#   profiler = TrainingProfiler('training_profile.jsonl', batch_size=128)
+#   callbacks = [profiler, profiler.wrap(ModelCheckpoint(...), 'checkpoint'), ...]
+#   model.fit(profiler.time_input(train_data), ...)
+
+import json
+import time
+import numpy as np
+
+from keras.callbacks import Callback
+
+
+class TrainingProfiler(Callback):
+    """Records per-step and per-phase timings of the training loop.
+
+    The phases of an epoch are:
+        input: time blocked on the training batches, only known when the
+            data goes through `time_input`.
+        train: time of the training steps, minus the input time.
+        validation: time of the validation pass.
+        <name>: time of the callbacks wrapped with `wrap(callback, name)`,
+            e.g. 'checkpoint' for ModelCheckpoint.
+        other: the rest of the epoch, e.g. the other callbacks and logging.
+
+    # Arguments
+        log_path: .jsonl file the step and epoch records are appended to,
+            None to keep them in memory only.
+        batch_size: batch size, to report images/sec.
+        log_steps: whether to write a record for every step, or only
+            the epoch records.
+        profile_dir: directory of the TF profiler trace, None to not trace.
+        profile_batches: (first, last) training steps of the first epoch
+            traced by the TF profiler.
+        verbose: whether to print the summary at the end of training.
+    """
+
+    def __init__(self, log_path=None, batch_size=None, log_steps=True, profile_dir=None,
+                 profile_batches=(10, 20), verbose=1):
+        super(TrainingProfiler, self).__init__()
+        self.log_path = log_path
+        self.batch_size = batch_size
+        self.log_steps = log_steps
+        self.profile_dir = profile_dir
+        self.profile_batches = profile_batches
+        self.verbose = verbose
+        self.epochs = []
+        self._log_file = None
+        self._tracing = False
+        self._epoch = None
+        # Keras may take the first batch from the input before training begins
+        self._input = 0.
+        self._batch_input = 0.
+
+    def time_input(self, iterable):
+        """Wraps a batch generator or dataset to time how long training waits for every batch.
+        The batches are repeated forever, so fit needs steps_per_epoch, e.g. len(dataset) for
+        tf.data. Iterating a tf.data dataset this way moves it out of the graph, so only use it to profile.
+        """
+        while True:
+            iterator = iter(iterable)
+            while True:
+                start = time.time()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                self._input += time.time() - start
+                yield batch
+
+    def wrap(self, callback, phase):
+        """Returns `callback` wrapped so that its time is counted as `phase`."""
+        return _TimedCallback(callback, self, phase)
+
+    def add(self, phase, seconds):
+        if self._epoch is not None:
+            self._epoch['phases'][phase] = self._epoch['phases'].get(phase, 0.) + seconds
+
+    def _write(self, record):
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(record) + '\n')
+
+    def on_train_begin(self, logs=None):
+        self.epochs = []
+        self._epoch = None
+        if self.log_path:
+            self._log_file = open(self.log_path, 'a')
+        self._train_start = time.time()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._close_epoch()
+        self._epoch = {'epoch': epoch + 1, 'phases': {}, 'steps': []}
+        self._epoch_start = time.time()
+        self._epoch_end = None
+        self._last_batch_end = None
+        self._test_start = None
+
+    def on_batch_begin(self, batch, logs=None):
+        self._batch_start = time.time()
+        self._batch_input = self._input
+        if self.profile_dir and not self.epochs and batch == self.profile_batches[0]:
+            import tensorflow as tf
+            tf.profiler.experimental.start(self.profile_dir)
+            self._tracing = True
+
+    def on_batch_end(self, batch, logs=None):
+        now = time.time()
+        step = now - self._batch_start
+        input_wait = self._input - self._batch_input
+        self._epoch['steps'].append(step)
+        self.add('train', step - input_wait)
+        self.add('input', input_wait)
+        self._last_batch_end = now
+        if self.log_steps:
+            self._write({'type': 'step', 'epoch': self._epoch['epoch'], 'step': batch + 1,
+                         'step_sec': step, 'input_sec': input_wait})
+        if self._tracing and batch == self.profile_batches[1]:
+            self._stop_trace()
+
+    def on_test_begin(self, logs=None):
+        self._test_start = time.time()
+
+    def on_test_end(self, logs=None):
+        self.add('validation', time.time() - self._test_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._epoch_end = time.time()
+        if self._test_start is None and self._last_batch_end is not None:
+            # Keras versions without test hooks validate between the last step and on_epoch_end
+            self.add('validation', self._epoch_end - self._last_batch_end)
+        self._epoch['logs'] = dict((k, float(v)) for k, v in (logs or {}).items())
+
+    def _close_epoch(self):
+        """Finishes the record of the last epoch, once the callbacks after this one have run too."""
+        if self._epoch is None or self._epoch_end is None:
+            return
+        record = self._epoch
+        record['epoch_sec'] = time.time() - self._epoch_start
+        known = sum(seconds for phase, seconds in record['phases'].items() if phase != 'other')
+        record['phases']['other'] = max(0., record['epoch_sec'] - known)
+        steps = np.array(record.pop('steps'))
+        if len(steps):
+            record.update(steps=len(steps), step_p50_ms=float(np.percentile(steps, 50) * 1000),
+                          step_p99_ms=float(np.percentile(steps, 99) * 1000))
+            if self.batch_size:
+                record['train_images_per_sec'] = len(steps) * self.batch_size / float(steps.sum())
+        self.epochs.append(record)
+        self._write(dict(record, type='epoch'))
+        self._epoch = None
+
+    def _stop_trace(self):
+        import tensorflow as tf
+        tf.profiler.experimental.stop()
+        self._tracing = False
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            self._stop_trace()
+        self._close_epoch()
+        summary = self.summary()
+        self._write(dict(summary, type='summary'))
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        if self.verbose:
+            self.print_summary(summary)
+
+    def summary(self):
+        """Total time of every phase over the epochs, and the mean step times."""
+        totals = {}
+        for record in self.epochs:
+            for phase, seconds in record['phases'].items():
+                totals[phase] = totals.get(phase, 0.) + seconds
+        epoch_sec = sum(record['epoch_sec'] for record in self.epochs)
+        summary = {'epochs': len(self.epochs), 'train_sec': time.time() - self._train_start,
+                   'epoch_sec': epoch_sec / max(1, len(self.epochs)), 'phases': totals}
+        for key in ('step_p50_ms', 'step_p99_ms', 'train_images_per_sec'):
+            values = [record[key] for record in self.epochs if key in record]
+            if values:
+                summary[key] = float(np.mean(values))
+        return summary
+
+    def print_summary(self, summary):
+        print('\nTraining profile: %d epochs, %.1f s/epoch' % (summary['epochs'], summary['epoch_sec']))
+        total = sum(summary['phases'].values()) or 1.
+        for phase, seconds in sorted(summary['phases'].items(), key=lambda item: -item[1]):
+            print('  %-12s %10.1f s %6.1f%%' % (phase, seconds, 100. * seconds / total))
+        if 'step_p50_ms' in summary:
+            print('  step p50 %.1f ms, p99 %.1f ms' % (summary['step_p50_ms'], summary['step_p99_ms']))
+        if 'train_images_per_sec' in summary:
+            print('  %.0f training images/sec' % summary['train_images_per_sec'])
+        if self.profile_dir:
+            print('  TF profiler trace in %s, see the Profile tab of TensorBoard' % self.profile_dir)
+
+
+class _TimedCallback(Callback):
+    """Runs a callback and counts the time of its epoch and training hooks as a profiler phase."""
+
+    def __init__(self, callback, profiler, phase):
+        super(_TimedCallback, self).__init__()
+        self.callback = callback
+        self.profiler = profiler
+        self.phase = phase
+
+    def set_model(self, model):
+        super(_TimedCallback, self).set_model(model)
+        self.callback.set_model(model)
+
+    def set_params(self, params):
+        super(_TimedCallback, self).set_params(params)
+        self.callback.set_params(params)
+
+    def _call(self, name, *args):
+        start = time.time()
+        getattr(self.callback, name)(*args)
+        self.profiler.add(self.phase, time.time() - start)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._call('on_epoch_begin', epoch, logs)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._call('on_epoch_end', epoch, logs)
+
+    def on_train_begin(self, logs=None):
+        self.callback.on_train_begin(logs)
+
+    def on_train_end(self, logs=None):
+        self.callback.on_train_end(logs)
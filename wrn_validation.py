@@ -0,0 +1,167 @@
+# Cheap validation with periodic full evaluation
+# The validation split is 20% of the training slice (20k images of the 100k slice), and Keras evaluates all
+# of it after every epoch to drive EarlyStopping, ModelCheckpoint and ReduceLROnPlateau. ValidationScheduler
+# replaces validation_data: after every epoch it scores a fixed stratified subsample of the validation set,
+# and only scores the whole set every `full_every` epochs or when the subsample value would be a new best.
+# Either way the callbacks after it find the same keys in the logs:
+#   val_loss, val_accuracy        - from the full set when it was scored this epoch, else from the subsample
+#   val_loss_ci, val_accuracy_ci  - half-width of their 95% confidence interval
+#   val_size                      - number of images they were computed over
+#   val_sec                       - time spent validating
+# As a new best always triggers a full evaluation, every best seen by the other callbacks comes from the
+# full set. Validation runs the model in inference mode only, at a larger batch size than training.
+#
+# Usage:
+#   validation = ValidationScheduler(images[:split], labels[:split], stats.mean, stats.std)
+#   model.fit(train_dataset, callbacks=[validation, EarlyStopping(monitor='val_loss'), ...])
+
+import time
+import warnings
+import numpy as np
+
+from keras.callbacks import Callback
+
+# Two-sided 95% quantile of the normal distribution
+Z_95 = 1.959964
+
+# Metrics computed by ValidationScheduler which can be monitored
+MONITORS = ('val_loss', 'val_accuracy')
+
+
+def stratified_subsample(labels, size, seed=0):
+    """
+    Draws a subsample with the same class proportions as the labels
+    :param labels: (n,) class indices
+    :param size: Number of images to draw, about
+    :return: Sorted indices of the subsample
+    """
+    labels = np.asarray(labels)
+    if size >= len(labels):
+        return np.arange(len(labels))
+    rng = np.random.RandomState(seed)
+    index = []
+    for label in np.unique(labels):
+        members = np.flatnonzero(labels == label)
+        count = max(1, int(round(size * len(members) / float(len(labels)))))
+        index.append(rng.choice(members, min(count, len(members)), replace=False))
+    return np.sort(np.concatenate(index))
+
+
+def confidence_interval(values):
+    """Half-width of the 95% normal confidence interval of the mean of the values."""
+    if len(values) < 2:
+        return float('nan')
+    return float(Z_95 * np.std(values, ddof=1) / np.sqrt(len(values)))
+
+
+class ValidationScheduler(Callback):
+    """Validates on a stratified subsample every epoch and on the full set every few epochs or on a new best.
+
+    Pass it to fit in place of validation_data, ahead of the callbacks
+    which monitor the validation metrics.
+
+    # Arguments
+        images: (n, 32, 32, 3) uint8 validation images, array or memmap.
+        labels: (n,) class indices of the validation images.
+        mean: featurewise mean the images are standardized with.
+        std: featurewise standard deviation the images are standardized with.
+        subsample_size: number of images scored every epoch.
+        full_every: number of epochs between two evaluations of the full set.
+        batch_size: batch size of the evaluation, larger than for training as
+            no activations are kept for gradients.
+        monitor: metric whose improvement triggers a full evaluation.
+        mode: one of {auto, min, max}, as for EarlyStopping.
+        seed: seed of the subsample.
+        verbose: int. 0: quiet, 1: a message for every full evaluation.
+    """
+
+    def __init__(self, images, labels, mean, std, subsample_size=5000, full_every=5, batch_size=1024,
+                 monitor='val_loss', mode='auto', seed=0, verbose=0):
+        super(ValidationScheduler, self).__init__()
+        from svhn_input import make_dataset
+
+        labels = np.asarray(labels)
+        index = stratified_subsample(labels, subsample_size, seed)
+        # The subsample is small enough to be held in memory, the full set is cached after its first pass
+        self.subsample = make_dataset(np.asarray(images[index]), labels[index], mean, std, batch_size,
+                                      shuffle=False)
+        self.full = make_dataset(images, labels, mean, std, batch_size, shuffle=False, cache=True)
+        self.subsample_size = len(index)
+        self.full_size = len(labels)
+        self.full_every = full_every
+        if monitor not in MONITORS:
+            raise ValueError('ValidationScheduler can monitor %s, not %s.' % (', '.join(MONITORS), monitor))
+        self.monitor = monitor
+        self.verbose = verbose
+
+        if mode not in ['auto', 'min', 'max']:
+            warnings.warn('ValidationScheduler mode %s is unknown, fallback to auto mode.' % mode, RuntimeWarning)
+            mode = 'auto'
+        if mode == 'min' or (mode == 'auto' and 'acc' not in monitor):
+            self.monitor_op = np.less
+            self.best = np.inf
+        else:
+            self.monitor_op = np.greater
+            self.best = -np.inf
+        self._step = None
+
+    def _make_step(self):
+        import tensorflow as tf
+        from keras import losses
+
+        model = self.model
+        loss_fn = model.loss if callable(model.loss) else losses.get(model.loss)
+
+        @tf.function
+        def step(x, y):
+            # Inference mode only, nothing is recorded for gradients
+            y_pred = model(x, training=False)
+            # The weight decay is added as in the val_loss of Keras
+            loss = loss_fn(y, y_pred)
+            if model.losses:
+                loss += tf.add_n(model.losses)
+            correct = tf.equal(tf.argmax(y_pred, axis=-1), tf.cast(tf.reshape(y, [-1]), tf.int64))
+            return loss, tf.cast(correct, tf.float32)
+        return step
+
+    def evaluate(self, dataset):
+        """
+        Scores the model on one of the datasets
+        :return: Dict of the loss and accuracy, their confidence intervals and the number of images
+        """
+        if self._step is None:
+            self._step = self._make_step()
+        losses, correct = [], []
+        for x, y in dataset:
+            loss, hits = self._step(x, y)
+            losses.append(loss.numpy())
+            correct.append(hits.numpy())
+        losses = np.concatenate(losses)
+        correct = np.concatenate(correct)
+        return {'val_loss': float(np.mean(losses)), 'val_loss_ci': confidence_interval(losses),
+                'val_accuracy': float(np.mean(correct)), 'val_accuracy_ci': confidence_interval(correct),
+                'val_size': len(losses)}
+
+    def on_train_begin(self, logs=None):
+        self.best = np.inf if self.monitor_op == np.less else -np.inf
+
+    def on_epoch_end(self, epoch, logs=None):
+        start = time.time()
+        results = self.evaluate(self.subsample)
+        current = results[self.monitor]
+
+        # A subsample value at least as good as the best one reported could be a new best, which is
+        # only reported from the full set
+        if (epoch + 1) % self.full_every == 0 or not self.monitor_op(self.best, current):
+            subsample_value = current
+            results = self.evaluate(self.full)
+            current = results[self.monitor]
+            if self.verbose > 0:
+                print('\nEpoch %05d: ValidationScheduler full evaluation, %s %.4f on the subsample, '
+                      '%.4f on the full set' % (epoch + 1, self.monitor, subsample_value, current))
+
+        if self.monitor_op(current, self.best):
+            self.best = current
+        results['val_sec'] = time.time() - start
+        if logs is not None:
+            logs.update(results)